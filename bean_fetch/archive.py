@@ -0,0 +1,457 @@
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import sqlite3
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Tuple, Type
+
+import bean_fetch.venues.coinbase as cb
+import bean_fetch.venues.coinbasepro.venue as cbpro
+import bean_fetch.venues.ethereum.venue as eth
+from bean_fetch.data import Kind, LazyTx, RawTx, kind_name
+from bean_fetch.encoding import dumps
+
+# --- constants ---
+
+FILES = "files"
+SEGMENTS = "segments"
+PARTITIONED = "partitioned"
+
+FORMATS = [FILES, SEGMENTS, PARTITIONED]
+
+# format of the timestamp embedded in archive keys
+KEY_TIME = "%Y-%m-%d_%H-%M-%S"
+
+# name of the manifest of a partitioned archive (in its root)
+MANIFEST = "manifest.sqlite"
+
+# format of the timestamps stored in the manifest, sortable as text
+MANIFEST_TIME = "%Y-%m-%dT%H:%M:%S.%f"
+
+# segments are rotated once they grow past this many bytes
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# codec name -> (id, compress, decompress). the id is stored in every frame header, so a store can
+# be read regardless of the codec it is currently configured with
+CODECS: Dict[str, Tuple[int, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "none": (0, bytes, bytes),
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress),
+}
+
+# frame header: payload length, codec id
+FRAME = struct.Struct(">IB")
+
+# --- records ---
+
+
+def encode(tx: RawTx[Kind]) -> Tuple[str, bytes]:
+    """returns the archive key and canonical json representation of `tx`. the key includes the
+    sha256 hash of exactly these bytes. kinds are named by their value, as `str` of a `str` enum
+    differs between python versions"""
+    data = dumps(tx).encode('UTF-8')
+    time = tx.timestamp.strftime(KEY_TIME)
+    hash = hashlib.sha256(data).hexdigest()
+    return f"{tx.venue}-{kind_name(tx.kind)}-{time}-{hash}", data
+
+
+def key_time(key: str) -> datetime:
+    """the timestamp (to the second) embedded in an archive key"""
+    return datetime.strptime("-".join(key.rsplit("-", 6)[1:6]), KEY_TIME)
+
+
+def kind(venue: str, value: str) -> Any:
+    if venue == cb.VENUE:
+        return cb.Kind(value)
+    elif venue == cbpro.VENUE:
+        return cbpro.Kind(value)
+    elif venue == eth.VENUE:
+        return eth.Kind(value)
+    raise ValueError(f"unknown venue: {venue}")
+
+
+def decode(data: bytes) -> RawTx[Kind]:
+    j = json.loads(data)
+    return RawTx(kind=kind(j["venue"], j["kind"]),
+                 venue=j["venue"],
+                 timestamp=datetime.utcfromtimestamp(j["timestamp"]),
+                 raw=json.dumps(j["raw"]),
+                 meta=j.get("meta"))
+
+
+def load(data: bytes) -> RawTx[Kind]:
+    """decodes a record written by `encode` without validating it. only the venue, kind and
+    timestamp are parsed up front, the payload is decoded when it is first read"""
+    # the payload is the last but one field, so everything before it is a small json object
+    start = data.find(b'"raw":')
+    if start < 0:
+        return decode(data)
+    head = json.loads(data[:start].rstrip().rstrip(b",") + b"}")
+    return LazyTx(venue=head["venue"],
+                  kind=kind(head["venue"], head["kind"]),
+                  timestamp=datetime.utcfromtimestamp(head["timestamp"]),
+                  tail=data[start:])
+
+
+# --- selection ---
+
+
+@dataclass(frozen=True)
+class Selection:
+    """a subset of the archive: records from `venues` (all if `None`) with a timestamp in
+    `[since, until)`. timestamps are naive utc, like those of loaded records"""
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    venues: Optional[FrozenSet[str]] = None
+
+    @property
+    def everything(self) -> bool:
+        return self.since is None and self.until is None and self.venues is None
+
+    def matches(self, key: str) -> bool:
+        if self.venues is not None and key.split("-", 1)[0] not in self.venues:
+            return False
+        if self.since is None and self.until is None:
+            return True
+        t = key_time(key)
+        return (self.since is None or t >= self.since) and (self.until is None or t < self.until)
+
+
+# --- archive ---
+
+
+class Archive(ABC):
+    """a store of json encoded `RawTx` records, addressed by the key returned from `encode`"""
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        ...
+
+    @abstractmethod
+    def remove(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self) -> None:
+        """removes every record in the archive"""
+        ...
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        for key in self.keys():
+            yield key, self.get(key)
+
+    def select(self, selection: Selection) -> Iterator[str]:
+        """the keys of the records in `selection`, matched on the timestamp and venue in each
+        key"""
+        return (key for key in self.keys() if selection.matches(key))
+
+    def write(self, tx: RawTx[Kind]) -> str:
+        key, data = encode(tx)
+        self.put(key, data)
+        return key
+
+    def read(self, key: str) -> RawTx[Kind]:
+        return decode(self.get(key))
+
+    def load(self, key: str) -> RawTx[Kind]:
+        """like `read`, but trusts the stored record and decodes its payload lazily"""
+        return load(self.get(key))
+
+    def flush(self) -> None:
+        """makes every record put so far durable"""
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "Archive":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
+
+
+class FileArchive(Archive):
+    """one json file per record, holding the bytes that its key hashes"""
+    def __init__(self, path: Path):
+        self.path = path
+
+    def keys(self) -> Iterator[str]:
+        if not self.path.is_dir():
+            return
+        for p in self.path.iterdir():
+            if p.is_file() and p.suffix == ".json":
+                yield p.stem
+
+    def get(self, key: str) -> bytes:
+        return (self.path / f"{key}.json").read_bytes()
+
+    def put(self, key: str, data: bytes) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        (self.path / f"{key}.json").write_bytes(data)
+
+    def remove(self, key: str) -> None:
+        path = self.path / f"{key}.json"
+        if path.exists():
+            path.unlink()
+
+    def delete(self) -> None:
+        for key in list(self.keys()):
+            self.remove(key)
+
+
+class SegmentArchive(Archive):
+    """append-only segment files of length prefixed (and optionally compressed) records. each
+    segment has a sidecar index with one `key offset length` line per record. removed records are
+    marked with a `key -1 0` tombstone"""
+    def __init__(self, path: Path, codec: str = "none"):
+        if codec not in CODECS:
+            raise ValueError(f"unknown archive codec: {codec}")
+        self.path = path
+        self.codec = codec
+        self.index: Dict[str, Tuple[int, int, int]] = {}
+        self.maps: Dict[int, mmap.mmap] = {}
+        self.writer: Optional[Tuple[int, Any, Any]] = None
+        # newest segment, records and tombstones are only appended to it
+        self.last = 1
+
+        for idx in sorted(self.path.glob("*.idx")):
+            segment = int(idx.stem)
+            self.last = segment
+            size = self.segment(segment).stat().st_size
+            lines = idx.read_text().split("\n")
+            # every complete line ends with a newline, a crash can cut the last one short
+            torn = lines.pop() != ""
+            kept = []
+            for line in lines:
+                key, offset, length = line.split(" ")
+                if int(offset) < 0:
+                    self.index.pop(key, None)
+                # entries written just before a crash may point past the end of the segment
+                elif int(offset) + int(length) > size:
+                    continue
+                else:
+                    self.index[key] = (segment, int(offset), int(length))
+                kept.append(line)
+            # frames appended later would make dropped entries point at other records
+            if torn or len(kept) < len(lines):
+                idx.write_text("".join(f"{line}\n" for line in kept))
+
+    def segment(self, n: int) -> Path:
+        return self.path / f"{n:06d}.seg"
+
+    def keys(self) -> Iterator[str]:
+        return iter(list(self.index))
+
+    def get(self, key: str) -> bytes:
+        segment, offset, length = self.index[key]
+        if self.writer and self.writer[0] == segment:
+            self.writer[1].flush()
+            self.unmap(segment)
+        if segment not in self.maps:
+            with self.segment(segment).open("rb") as f:
+                self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        frame = self.maps[segment][offset:offset + length]
+        size, codec = FRAME.unpack_from(frame)
+        payload = frame[FRAME.size:FRAME.size + size]
+        for cid, _, decompress in CODECS.values():
+            if cid == codec:
+                return decompress(payload)
+        raise ValueError(f"unknown codec id {codec} in segment {segment}")
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        # walk the index in segment / offset order so reads are sequential
+        for key, _ in sorted(self.index.items(), key=lambda kv: kv[1]):
+            yield key, self.get(key)
+
+    def put(self, key: str, data: bytes) -> None:
+        if key in self.index:
+            return
+
+        cid, compress, _ = CODECS[self.codec]
+        payload = compress(data)
+        frame = FRAME.pack(len(payload), cid) + payload
+
+        segment, seg, idx = self.open_writer()
+        offset = seg.tell()
+        seg.write(frame)
+        idx.write(f"{key} {offset} {len(frame)}\n")
+        self.index[key] = (segment, offset, len(frame))
+
+        if seg.tell() >= SEGMENT_SIZE:
+            self.close_writer()
+            self.open_writer(segment + 1)
+
+    def remove(self, key: str) -> None:
+        if key in self.index:
+            _, _, idx = self.open_writer()
+            idx.write(f"{key} -1 0\n")
+            del self.index[key]
+
+    def open_writer(self, segment: Optional[int] = None) -> Tuple[int, Any, Any]:
+        if self.writer is not None:
+            return self.writer
+        n = segment if segment is not None else self.last
+        self.last = max(self.last, n)
+        self.path.mkdir(parents=True, exist_ok=True)
+        seg = self.segment(n).open("ab")
+        idx = self.segment(n).with_suffix(".idx").open("a")
+        self.writer = (n, seg, idx)
+        return self.writer
+
+    def flush(self) -> None:
+        if self.writer:
+            _, seg, idx = self.writer
+            for f in (seg, idx):
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close_writer(self) -> None:
+        if self.writer:
+            _, seg, idx = self.writer
+            # flush the segment before the index, so the index never points past its end
+            seg.close()
+            idx.close()
+            self.unmap(self.writer[0])
+            self.writer = None
+
+    def unmap(self, segment: int) -> None:
+        m = self.maps.pop(segment, None)
+        if m:
+            m.close()
+
+    def delete(self) -> None:
+        self.close()
+        for p in list(self.path.glob("*.seg")) + list(self.path.glob("*.idx")):
+            p.unlink()
+        self.index = {}
+
+    def close(self) -> None:
+        self.close_writer()
+        for m in self.maps.values():
+            m.close()
+        self.maps = {}
+
+
+class PartitionedArchive(Archive):
+    """one json file per record like `FileArchive`, grouped into `venue/YYYY/MM` directories.
+    a sqlite manifest records the timestamp, venue, kind and hash of every record, so keys are
+    listed and selected without walking (or opening) any record files. manifest rows are
+    committed on `flush`, records written after the last flush are re-put by the next fetch"""
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        missing = not (self.path / MANIFEST).exists()
+        # writers for different venues share the archive from their own threads, behind a lock
+        self.db = sqlite3.connect(str(self.path / MANIFEST), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS manifest (key TEXT PRIMARY KEY, "
+                        "venue TEXT NOT NULL, kind TEXT NOT NULL, timestamp TEXT NOT NULL, "
+                        "hash TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS manifest_time ON manifest (timestamp)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS manifest_venue_time ON manifest (venue, timestamp)")
+        if missing:
+            self.rebuild()
+
+    def file(self, key: str) -> Path:
+        t = key_time(key)
+        return self.path / key.split("-", 1)[0] / f"{t:%Y}" / f"{t:%m}" / f"{key}.json"
+
+    def keys(self) -> Iterator[str]:
+        return iter([key for key, in self.db.execute("SELECT key FROM manifest")])
+
+    def select(self, selection: Selection) -> Iterator[str]:
+        where: List[str] = []
+        params: List[Any] = []
+        if selection.venues is not None:
+            where.append(f"venue IN ({', '.join('?' * len(selection.venues))})")
+            params += sorted(selection.venues)
+        if selection.since is not None:
+            where.append("timestamp >= ?")
+            params.append(selection.since.strftime(MANIFEST_TIME))
+        if selection.until is not None:
+            where.append("timestamp < ?")
+            params.append(selection.until.strftime(MANIFEST_TIME))
+        sql = "SELECT key FROM manifest" + (f" WHERE {' AND '.join(where)}" if where else "")
+        return iter([key for key, in self.db.execute(sql, params)])
+
+    def get(self, key: str) -> bytes:
+        return self.file(key).read_bytes()
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        self.record(key, data)
+
+    def record(self, key: str, data: bytes) -> None:
+        tx: RawTx[Any] = load(data)
+        self.db.execute(
+            "INSERT OR REPLACE INTO manifest (key, venue, kind, timestamp, hash) "
+            "VALUES (?, ?, ?, ?, ?)", (key, tx.venue, kind_name(tx.kind),
+                                       tx.timestamp.strftime(MANIFEST_TIME), key.rsplit("-", 1)[1]))
+
+    def remove(self, key: str) -> None:
+        path = self.file(key)
+        if path.exists():
+            path.unlink()
+        self.db.execute("DELETE FROM manifest WHERE key = ?", (key, ))
+
+    def delete(self) -> None:
+        for key in list(self.keys()):
+            self.remove(key)
+        self.db.commit()
+
+    def rebuild(self) -> int:
+        """recreates the manifest from the record files, returns the number of records found"""
+        self.db.execute("DELETE FROM manifest")
+        n = 0
+        for path in self.path.glob("*/*/*/*.json"):
+            self.record(path.stem, path.read_bytes())
+            n += 1
+        self.db.commit()
+        return n
+
+    def flush(self) -> None:
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+
+def open_archive(path: Path, fmt: str = FILES, codec: str = "none") -> Archive:
+    if fmt == FILES:
+        return FileArchive(path)
+    if fmt == SEGMENTS:
+        return SegmentArchive(path / SEGMENTS, codec)
+    if fmt == PARTITIONED:
+        return PartitionedArchive(path / PARTITIONED)
+    raise ValueError(f"unknown archive format: {fmt}")
+
+
+def migrate(src: Archive, dst: Archive) -> int:
+    """copies every record in `src` that is not yet in `dst`, returns the number copied"""
+    existing = set(dst.keys())
+    copied = 0
+    for key, data in src.items():
+        if key not in existing:
+            dst.put(key, json.dumps(json.loads(data)).encode('UTF-8'))
+            copied += 1
+    return copied
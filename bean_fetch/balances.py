@@ -0,0 +1,232 @@
+import sqlite3
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from beancount.core.data import Transaction
+
+import bean_fetch.state as state
+import bean_fetch.venues.coinbase as cb
+from bean_fetch.config import Config, archive
+from bean_fetch.parsing import SHARD_SIZE, parse_keys, signatures
+from bean_fetch.pool import chunked
+from bean_fetch.stats import STATS
+
+# --- constants ---
+
+# name of the balance store (in the cache dir)
+BALANCE_STORE = "balances.sqlite"
+
+# scope of the balance metrics
+BALANCES = "balances"
+
+# --- types ---
+
+# (account, currency)
+Holding = Tuple[str, str]
+
+# (account, currency, day, change)
+Delta = Tuple[str, str, date, Decimal]
+
+# (venue, currency, reported balance, ledger balance)
+Check = Tuple[str, str, Decimal, Decimal]
+
+# --- deltas ---
+
+
+def deltas(entry: Any) -> List[Delta]:
+    """the change that every posting of `entry` makes to the balance of its account"""
+    if not isinstance(entry, Transaction):
+        return []
+    return [(p.account, p.units.currency, entry.date, p.units.number) for p in entry.postings
+            if p.units is not None and isinstance(p.units.number, Decimal)]
+
+
+# --- store ---
+
+
+class BalanceStore:
+    """daily balance snapshots per (account, currency), materialized from the parsed archive.
+    each snapshot holds the net change of its day and the balance at the end of it, so the
+    balance at any date is a single indexed lookup. the postings of every record folded into the
+    snapshots are kept, so records that leave the archive (or are parsed differently) are
+    reverted without replaying the rest"""
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS applied "
+                        "(key TEXT PRIMARY KEY, signature TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS postings (key TEXT NOT NULL, "
+                        "account TEXT NOT NULL, currency TEXT NOT NULL, day TEXT NOT NULL, "
+                        "amount TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS postings_key ON postings (key)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS snapshots (account TEXT NOT NULL, "
+                        "currency TEXT NOT NULL, day TEXT NOT NULL, change TEXT NOT NULL, "
+                        "balance TEXT NOT NULL, PRIMARY KEY (account, currency, day))")
+
+    def applied(self) -> Dict[str, str]:
+        """archive key -> parser signature, of every record folded into the snapshots"""
+        return dict(self.db.execute("SELECT key, signature FROM applied"))
+
+    def apply(self, results: Iterable[Tuple[str, str, Any]]) -> None:
+        """folds the (key, signature, entry) of parsed records into the snapshots"""
+        changes: Dict[Holding, Dict[date, Decimal]] = defaultdict(lambda: defaultdict(Decimal))
+        applied, postings = [], []
+        for key, signature, entry in results:
+            applied.append((key, signature))
+            for account, currency, day, amount in deltas(entry):
+                postings.append((key, account, currency, day.isoformat(), str(amount)))
+                changes[(account, currency)][day] += amount
+        self.db.executemany("INSERT OR REPLACE INTO applied (key, signature) VALUES (?, ?)",
+                            applied)
+        self.db.executemany(
+            "INSERT INTO postings (key, account, currency, day, amount) VALUES (?, ?, ?, ?, ?)",
+            postings)
+        self.fold(changes)
+        self.db.commit()
+        STATS.add(BALANCES, "records_applied", len(applied))
+
+    def revert(self, keys: Iterable[str]) -> None:
+        """takes the records for `keys` back out of the snapshots"""
+        changes: Dict[Holding, Dict[date, Decimal]] = defaultdict(lambda: defaultdict(Decimal))
+        n = 0
+        for part in chunked(keys, 500):
+            params = ", ".join("?" * len(part))
+            for account, currency, day, amount in self.db.execute(
+                    f"SELECT account, currency, day, amount FROM postings WHERE key IN ({params})",
+                    part):
+                changes[(account, currency)][date.fromisoformat(day)] -= Decimal(amount)
+            self.db.execute(f"DELETE FROM postings WHERE key IN ({params})", part)
+            self.db.execute(f"DELETE FROM applied WHERE key IN ({params})", part)
+            n += len(part)
+        self.fold(changes)
+        self.db.commit()
+        STATS.add(BALANCES, "records_reverted", n)
+
+    def fold(self, changes: Dict[Holding, Dict[date, Decimal]]) -> None:
+        """adds the daily `changes` to the snapshots, and carries them into the balances of every
+        later snapshot of the same holding"""
+        for (account, currency), days in changes.items():
+            start = min(days).isoformat()
+            row = self.db.execute(
+                "SELECT balance FROM snapshots WHERE account = ? AND currency = ? AND day < ? "
+                "ORDER BY day DESC LIMIT 1", (account, currency, start)).fetchone()
+            balance = Decimal(row[0]) if row else Decimal(0)
+
+            net: Dict[date, Decimal] = defaultdict(Decimal)
+            for day, change in self.db.execute(
+                    "SELECT day, change FROM snapshots WHERE account = ? AND currency = ? "
+                    "AND day >= ?", (account, currency, start)):
+                net[date.fromisoformat(day)] += Decimal(change)
+            for d, change in days.items():
+                net[d] += change
+
+            rows = []
+            for d in sorted(net):
+                # days whose postings cancel out (e.g. after a revert) need no snapshot
+                if net[d] == 0:
+                    continue
+                balance += net[d]
+                rows.append((account, currency, d.isoformat(), str(net[d]), str(balance)))
+            self.db.execute("DELETE FROM snapshots WHERE account = ? AND currency = ? AND day >= ?",
+                            (account, currency, start))
+            self.db.executemany(
+                "INSERT INTO snapshots (account, currency, day, change, balance) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def balances(self,
+                 day: date,
+                 account: str = "",
+                 currency: Optional[str] = None) -> Dict[Holding, Decimal]:
+        """the non-zero balance at the end of `day` of every holding of `account` and its
+        sub-accounts (all accounts by default), optionally only in `currency`"""
+        sql = ("SELECT account, currency, balance FROM snapshots AS s WHERE day = "
+               "(SELECT MAX(day) FROM snapshots WHERE account = s.account "
+               "AND currency = s.currency AND day <= ?)")
+        params: List[Any] = [day.isoformat()]
+        if account:
+            # sub-accounts sort between `account:` and `account;`
+            sql += " AND (account = ? OR (account >= ? AND account < ?))"
+            params += [account, account + ":", account + ";"]
+        if currency:
+            sql += " AND currency = ?"
+            params.append(currency)
+        out: Dict[Holding, Decimal] = {}
+        for a, c, balance in self.db.execute(sql + " ORDER BY account, currency", params):
+            if Decimal(balance) != 0:
+                out[(a, c)] = Decimal(balance)
+        return out
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "BalanceStore":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
+
+
+# --- updating ---
+
+
+def update_balances(config: Config, store: BalanceStore, jobs: int = 1) -> Tuple[int, int]:
+    """brings `store` up to date with the archive: records archived (or whose venue parser or
+    config changed) since the last update are parsed and folded in, records that are no longer
+    archived are reverted. returns the number of records (applied, reverted)"""
+    with archive(config) as a:
+        keys = sorted(a.keys())
+    live = set(keys)
+    sigs = signatures(config)
+
+    with STATS.timed(BALANCES, "update"):
+        applied = store.applied()
+        stale = {
+            key
+            for key, signature in applied.items()
+            if key not in live or sigs.get(key.split("-", 1)[0]) != signature
+        }
+        store.revert(sorted(stale))
+
+        todo = [k for k in keys if k not in applied or k in stale]
+        results = parse_keys(config, todo, jobs)
+        for part in chunked(results, SHARD_SIZE):
+            store.apply((key, sigs[key.split("-", 1)[0]], entry) for key, _, entry in part)
+    return len(todo), len(stale)
+
+
+# --- reconciliation ---
+
+
+def accounts(config: Config) -> Dict[str, str]:
+    """venue -> the ledger account that holds its funds"""
+    out: Dict[str, str] = {}
+    if config.coinbase:
+        out[cb.VENUE] = config.coinbase.assets_prefix
+    if config.balances and config.balances.accounts:
+        out.update(config.balances.accounts)
+    return out
+
+
+def reconcile(config: Config, store: BalanceStore) -> List[Check]:
+    """compares the balances that each venue reported on its last fetch with the ledger balances
+    of its account on that day, for every currency held on either side"""
+    out: List[Check] = []
+    state_dir = config.archive_dir / state.STATE_DIR
+    for venue, account in sorted(accounts(config).items()):
+        reported = state.Reported.load(state_dir, venue)
+        if reported is None or reported.time is None:
+            continue
+        ledger: Dict[str, Decimal] = defaultdict(Decimal)
+        for (_, currency), balance in store.balances(reported.time.date(), account).items():
+            ledger[currency] += balance
+        for currency in sorted(set(reported.balances) | set(ledger)):
+            check = (venue, currency, reported.balances.get(currency, Decimal(0)),
+                     ledger.get(currency, Decimal(0)))
+            if check[2] or check[3]:
+                out.append(check)
+    return out
@@ -0,0 +1,48 @@
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from typing import Any
+
+from beancount.core.amount import Amount
+from beancount.core.data import EMPTY_SET, Posting, Transaction, new_metadata
+
+from bean_fetch.balances import BalanceStore
+
+
+def entry(day: date, number: str, currency: str = "BTC") -> Any:
+    postings = [
+        Posting("Assets:Coinbase:BTC", Amount(Decimal(number), currency), None, None, None, None),
+        Posting("Equity:Opening", Amount(-Decimal(number), currency), None, None, None, None),
+    ]
+    return Transaction(new_metadata("test", 0), day, "*", None, "", EMPTY_SET, EMPTY_SET,
+                       postings)
+
+
+def test_revert_carries_into_later_snapshots(tmp_path: Path) -> None:
+    with BalanceStore(tmp_path / "balances.sqlite") as store:
+        store.apply([
+            ("a", "1", entry(date(2021, 1, 1), "1.5")),
+            ("b", "1", entry(date(2021, 1, 5), "2")),
+            ("c", "1", entry(date(2021, 1, 5), "0.25")),
+            ("d", "1", entry(date(2021, 1, 9), "-1")),
+        ])
+        account = "Assets:Coinbase"
+        holding = ("Assets:Coinbase:BTC", "BTC")
+        assert store.balances(date(2021, 1, 4), account) == {holding: Decimal("1.5")}
+        assert store.balances(date(2021, 1, 5), account) == {holding: Decimal("3.75")}
+        assert store.balances(date(2021, 1, 20), account) == {holding: Decimal("2.75")}
+
+        store.revert(["b"])
+        assert store.balances(date(2021, 1, 4), account) == {holding: Decimal("1.5")}
+        assert store.balances(date(2021, 1, 5), account) == {holding: Decimal("1.75")}
+        assert store.balances(date(2021, 1, 7), account) == {holding: Decimal("1.75")}
+        assert store.balances(date(2021, 1, 20), account) == {holding: Decimal("0.75")}
+        assert set(store.applied()) == {"a", "c", "d"}
+
+        # reverting every record of a day
+        store.revert(["c"])
+        assert store.balances(date(2021, 1, 5), account) == {holding: Decimal("1.5")}
+        assert store.balances(date(2021, 1, 20), account) == {holding: Decimal("0.5")}
+        # holdings of other accounts are not included
+        assert store.balances(date(2021, 1, 20), "Assets:Coinbase:B") == {}
+        assert store.balances(date(2021, 1, 20))[("Equity:Opening", "BTC")] == Decimal("-0.5")
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple, Type
+
+
+def fingerprint(config: Any, fields: Iterable[str]) -> str:
+    """sha256 of `fields` of a (pydantic) dataclass config, used to invalidate results derived
+    from them. fields that do not affect the results (e.g. how records are fetched) are left out,
+    so that changing them keeps the results"""
+    values = {f: getattr(config, f) for f in fields} if config is not None else None
+    data = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('UTF-8')).hexdigest()
+
+
+class ParseCache:
+    """on-disk memo of parse results, keyed by archive key. each entry records the signature
+    (parser version and config fingerprint) it was produced with, and is only returned to callers
+    presenting the same signature"""
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries "
+                        "(key TEXT PRIMARY KEY, signature TEXT NOT NULL, value BLOB NOT NULL)")
+
+    def lookup(self, signatures: Dict[str, str]) -> Dict[str, Any]:
+        """returns every cached value whose signature matches `signatures` (venue -> signature)"""
+        out: Dict[str, Any] = {}
+        for key, signature, value in self.db.execute("SELECT key, signature, value FROM entries"):
+            if signatures.get(key.split("-", 1)[0]) == signature:
+                out[key] = pickle.loads(value)
+        return out
+
+    def keys(self, signatures: Dict[str, str]) -> Set[str]:
+        """the keys of every cached value whose signature matches `signatures`"""
+        return {
+            key
+            for key, signature in self.db.execute("SELECT key, signature FROM entries")
+            if signatures.get(key.split("-", 1)[0]) == signature
+        }
+
+    def scan(self, signatures: Dict[str, str]) -> Iterator[Tuple[str, Any]]:
+        """like `lookup`, but yields (key, value) pairs one at a time instead of loading them all
+        into memory"""
+        for key, signature, value in self.db.execute("SELECT key, signature, value FROM entries"):
+            if signatures.get(key.split("-", 1)[0]) == signature:
+                yield key, pickle.loads(value)
+
+    def select(self, keys: Iterable[str], signatures: Dict[str, str],
+               batch_size: int = 500) -> Iterator[Tuple[str, Any]]:
+        """like `scan`, but only for `keys`, which are looked up `batch_size` at a time"""
+        keys = list(keys)
+        for i in range(0, len(keys), batch_size):
+            part = keys[i:i + batch_size]
+            rows = self.db.execute(
+                f"SELECT key, signature, value FROM entries WHERE key IN "
+                f"({', '.join('?' * len(part))})", part).fetchall()
+            for key, signature, value in rows:
+                if signatures.get(key.split("-", 1)[0]) == signature:
+                    yield key, pickle.loads(value)
+
+    def store(self, entries: Iterable[Tuple[str, str, Any]]) -> None:
+        """stores (key, signature, value) triples, replacing any existing entry for the key"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO entries (key, signature, value) VALUES (?, ?, ?)",
+            ((k, s, pickle.dumps(v, pickle.HIGHEST_PROTOCOL)) for k, s, v in entries))
+        self.db.commit()
+
+    def evict(self, live: Iterable[str]) -> int:
+        """drops entries whose key is not in `live`, returns the number dropped"""
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS live (key TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM live")
+        self.db.executemany("INSERT OR IGNORE INTO live (key) VALUES (?)", ((k, ) for k in live))
+        dropped = self.db.execute(
+            "DELETE FROM entries WHERE key NOT IN (SELECT key FROM live)").rowcount
+        self.db.commit()
+        return int(dropped)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "ParseCache":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Dict, Optional
+
+import yaml
+from pydantic.dataclasses import dataclass
+
+import bean_fetch.venues.coinbase as cb
+import bean_fetch.venues.coinbasepro.venue as cbpro
+import bean_fetch.venues.ethereum.venue as eth
+import bean_fetch.state as state
+from bean_fetch.archive import Archive, FILES, open_archive
+
+# --- config ---
+
+
+@dataclass(frozen=True)
+class FetchConfig:
+    concurrent: bool = False
+    timeouts: Optional[Dict[str, float]] = None
+    on_error: Optional[Dict[str, str]] = None
+
+
+@dataclass(frozen=True)
+class PriceConfig:
+    # currency that every other commodity is priced in
+    quote: str = "USD"
+    # name of the price source (see `bean_fetch.prices.SOURCES`)
+    source: str = "coinbasepro"
+    # missing days at most this far apart are fetched with a single ranged request
+    max_gap: int = 30
+
+
+@dataclass(frozen=True)
+class WatchConfig:
+    # blocks below the chain head that a block needs before its txs are archived
+    confirmations: int = 12
+    # blocks below the newest archived block that are checked for reorgs
+    reorg_depth: int = 128
+    # seconds between polls, by venue name (see `bean_fetch.watch.INTERVALS` for the defaults)
+    intervals: Optional[Dict[str, float]] = None
+
+
+@dataclass(frozen=True)
+class BalanceConfig:
+    # ledger account that holds the funds of each venue, by venue name. the balances a venue
+    # reports are reconciled against this account and its sub-accounts (coinbase defaults to
+    # its `assets_prefix`)
+    accounts: Optional[Dict[str, str]] = None
+
+
+@dataclass(frozen=True)
+class Config:
+    archive_dir: Path
+    archive_format: str
+    archive_codec: str
+    fetch: FetchConfig
+    coinbase: Optional[cb.Config]
+    coinbasepro: Optional[cbpro.Config]
+    ethereum: Optional[eth.Config]
+    prices: Optional[PriceConfig] = None
+    watch: Optional[WatchConfig] = None
+    balances: Optional[BalanceConfig] = None
+
+
+def load_config(path: Path) -> Config:
+    config = yaml.load(path.read_text(), yaml.Loader)
+    archive_dir = path.absolute().parent / config["archive_dir"]
+    return Config(
+        archive_dir=archive_dir,
+        archive_format=config.get("archive_format", FILES),
+        archive_codec=config.get("archive_codec", "none"),
+        fetch=FetchConfig(**config.get("fetch", {})),
+        coinbase=cb.Config(**config["coinbase"], state_dir=archive_dir /
+                           state.STATE_DIR) if "coinbase" in config else None,
+        coinbasepro=cbpro.Config(**config["coinbasepro"], state_dir=archive_dir /
+                                 state.STATE_DIR) if "coinbasepro" in config else None,
+        ethereum=eth.Config(**config["ethereum"],
+                            state_dir=archive_dir / state.STATE_DIR,
+                            cache_dir=archive_dir /
+                            state.CACHE_DIR) if "ethereum" in config else None,
+        prices=PriceConfig(**config["prices"] or {}) if "prices" in config else None,
+        watch=WatchConfig(**config["watch"] or {}) if "watch" in config else None,
+        balances=BalanceConfig(**config["balances"] or {}) if "balances" in config else None,
+    )
+
+
+# --- archive ---
+
+
+def archive(config: Config, fmt: Optional[str] = None) -> Archive:
+    return open_archive(config.archive_dir, fmt or config.archive_format, config.archive_codec)
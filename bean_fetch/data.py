@@ -1,6 +1,8 @@
+import json
 from datetime import datetime
-from typing import Mapping, Optional, List, TypeVar, Generic
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, TypeVar, Generic
 from abc import ABC
+from threading import Event
 
 from pydantic import Json
 from pydantic.dataclasses import dataclass
@@ -11,6 +13,11 @@ Config = TypeVar("Config")
 Kind = TypeVar("Kind")
 
 
+class Cancelled(Exception):
+    """raised by a venue (or its client) when its fetch was cancelled, e.g. on a timeout"""
+    pass
+
+
 @dataclass_json
 @dataclass(frozen=True)
 class RawTx(Generic[Kind]):
@@ -21,9 +28,48 @@ class RawTx(Generic[Kind]):
     meta: Optional[Mapping[str, str]] = None
 
 
+def kind_name(kind: Any) -> str:
+    """the name of a venue `Kind` (its enum value)"""
+    return str(getattr(kind, "value", kind))
+
+
+class LazyTx(RawTx[Kind]):
+    """a `RawTx` loaded from the archive without validation. the `raw` and `meta` fields are kept
+    as the undecoded json text of the record (everything from the `"raw":` key onwards) and only
+    set when one of them is first read"""
+    __slots__ = ("venue", "kind", "timestamp", "raw", "meta", "tail")
+    tail: bytes
+
+    def __init__(self, venue: str, kind: Kind, timestamp: datetime, tail: bytes):
+        object.__setattr__(self, "venue", venue)
+        object.__setattr__(self, "kind", kind)
+        object.__setattr__(self, "timestamp", timestamp)
+        object.__setattr__(self, "tail", tail)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called while the `raw` and `meta` slots are unset
+        if name not in ("raw", "meta"):
+            raise AttributeError(name)
+        decoded = json.loads(b"{" + self.tail)
+        object.__setattr__(self, "raw", decoded["raw"])
+        object.__setattr__(self, "meta", decoded.get("meta"))
+        return decoded.get(name)
+
+
+class Stream(Generic[Kind]):
+    """records fetched by a venue that can persist the venue's progress. `commit` is called once
+    every record yielded so far has been written to the archive"""
+    def __init__(self, records: Iterable[RawTx[Kind]], commit: Callable[[], None]):
+        self.records = records
+        self.commit = commit
+
+    def __iter__(self) -> Iterator[RawTx[Kind]]:
+        return iter(self.records)
+
+
 class VenueLike(Generic[Config, Kind], ABC):
     @staticmethod
-    def fetch(config: Config) -> List[RawTx[Kind]]:
+    def fetch(config: Config, cancel: Optional[Event] = None) -> Iterable[RawTx[Kind]]:
         ...
 
     @staticmethod
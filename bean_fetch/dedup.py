@@ -0,0 +1,153 @@
+import os
+from enum import Enum
+from pathlib import Path
+from typing import Any, Counter, Dict, List, Optional, Set, Tuple
+
+from bean_fetch.archive import Archive, encode, load
+from bean_fetch.data import Kind, RawTx, kind_name
+from bean_fetch.stats import STATS
+
+# --- constants ---
+
+# fields of a raw payload that identify the underlying venue record (in order of preference)
+ID_FIELDS = ("id", "trade_id", "hash")
+
+# fields (of the payload or meta) that ids are only unique within, e.g. trade ids per product
+ID_SCOPES = ("product_id", "account_id")
+
+# key of the index lines that record the removal of a record
+REMOVED = "-"
+
+
+class Status(str, Enum):
+    NEW = "new"
+    CHANGED = "changed"
+    SKIPPED = "skipped"
+
+
+# --- index ---
+
+
+def identity(tx: RawTx[Kind]) -> Optional[str]:
+    """returns the id of the venue record that `tx` was built from, if it has one"""
+    if not isinstance(tx.raw, dict):
+        return None
+    for field in ID_FIELDS:
+        if field in tx.raw:
+            meta = tx.meta or {}
+            scopes = [str(tx.raw.get(s, meta.get(s))) for s in ID_SCOPES
+                      if s in tx.raw or s in meta]
+            return "/".join(scopes + [str(tx.raw[field])])
+    return None
+
+
+class HashIndex:
+    """persistent index of the records in an archive, keyed by (venue, kind, sha256). records whose
+    hash is already indexed are skipped without touching the archive. a record with a known id but
+    a new hash replaces the previous version.
+
+    the index is an append-only file of `venue kind sha256 id key` lines, loaded once per run.
+    removed records are recorded with a `-` key. lines are only written on `flush`, after the
+    archive has been flushed, so the index never refers to records that were not persisted"""
+    def __init__(self, path: Path, archive: Archive):
+        self.path = path
+        self.archive = archive
+        self.hashes: Set[Tuple[str, str, str]] = set()
+        self.ids: Dict[Tuple[str, str, str], str] = {}
+        self.counts: Counter[Status] = Counter()
+        self.out: Optional[Any] = None
+        self.pending: List[str] = []
+
+        if path.is_file():
+            for line in path.read_text().splitlines():
+                self.index(*line.split(" "))
+            self.validate()
+        else:
+            self.rebuild()
+        self.flush()
+
+    def index(self, venue: str, kind: str, hash: str, id: str, key: str) -> None:
+        if key == REMOVED:
+            self.hashes.discard((venue, kind, hash))
+            if self.ids.get((venue, kind, id), "").endswith(hash):
+                del self.ids[(venue, kind, id)]
+            return
+        # a changed record replaces the previous version, whose hash is no longer archived
+        previous = self.ids.get((venue, kind, id))
+        if previous and previous != key:
+            self.hashes.discard((venue, kind, previous.rsplit("-", 1)[1]))
+        self.hashes.add((venue, kind, hash))
+        self.ids[(venue, kind, id)] = key
+
+    def append(self, venue: str, kind: str, hash: str, id: str, key: str) -> None:
+        self.pending.append(f"{venue} {kind} {hash} {id} {key}\n")
+        self.index(venue, kind, hash, id, key)
+
+    def rebuild(self) -> None:
+        """indexes every record already in the archive"""
+        for key, data in self.archive.items():
+            tx: RawTx[Any] = load(data)
+            hash = key.rsplit("-", 1)[1]
+            self.append(tx.venue, kind_name(tx.kind), hash, identity(tx) or hash, key)
+
+    def validate(self) -> None:
+        """drops indexed records that are missing from the archive, e.g. because it was not
+        flushed before a crash or the index was built for another archive format. they are then
+        archived again when they are next fetched, instead of being skipped"""
+        archived = set(self.archive.keys())
+        for (venue, kind, id), key in list(self.ids.items()):
+            if key not in archived:
+                self.append(venue, kind, key.rsplit("-", 1)[1], id, REMOVED)
+                STATS.add(venue, "records_unindexed")
+
+    def write(self, tx: RawTx[Kind]) -> Status:
+        """archives `tx` unless an identical record is already present"""
+        key, data = encode(tx)
+        hash = key.rsplit("-", 1)[1]
+        venue, kind = tx.venue, kind_name(tx.kind)
+
+        if (venue, kind, hash) in self.hashes:
+            status = Status.SKIPPED
+        else:
+            id = identity(tx) or hash
+            previous = self.ids.get((venue, kind, id))
+            self.archive.put(key, data)
+            if previous and previous != key:
+                self.archive.remove(previous)
+            self.append(venue, kind, hash, id, key)
+            status = Status.CHANGED if previous else Status.NEW
+
+        self.counts[status] += 1
+        STATS.add(venue, f"records_{status.value}")
+        return status
+
+    def remove(self, key: str) -> None:
+        """removes the record stored under `key` from the archive and the index, e.g. a tx that
+        was dropped by a chain reorg. does nothing if the record is no longer archived"""
+        try:
+            tx: RawTx[Any] = load(self.archive.get(key))
+        except (KeyError, OSError):
+            return
+        hash = key.rsplit("-", 1)[1]
+        self.archive.remove(key)
+        self.append(tx.venue, kind_name(tx.kind), hash, identity(tx) or hash, REMOVED)
+        STATS.add(tx.venue, "records_removed")
+
+    def flush(self) -> None:
+        """flushes the archive, then writes the lines of the records put since the last flush"""
+        self.archive.flush()
+        if not self.pending:
+            return
+        if self.out is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.out = self.path.open("a")
+        self.out.write("".join(self.pending))
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.pending = []
+
+    def close(self) -> None:
+        self.flush()
+        if self.out:
+            self.out.close()
+            self.out = None
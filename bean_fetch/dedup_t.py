@@ -0,0 +1,46 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from bean_fetch.archive import FileArchive
+from bean_fetch.data import RawTx
+from bean_fetch.dedup import HashIndex, Status
+from bean_fetch.venues.coinbasepro.data import VENUE, Kind
+
+
+def record(status: str) -> RawTx[Any]:
+    return RawTx(venue=VENUE,
+                 kind=Kind.DEPOSIT,
+                 timestamp=datetime(2021, 1, 1),
+                 raw=f'{{"id": "1", "status": "{status}"}}',
+                 meta={})
+
+
+def test_changed_record_replaces_hash(tmp_path: Path) -> None:
+    archive = FileArchive(tmp_path / "archive")
+    index = HashIndex(tmp_path / "index", archive)
+    assert index.write(record("pending")) == Status.NEW
+    assert index.write(record("completed")) == Status.CHANGED
+    # the first version was removed from the archive, so it is not skipped when it comes back
+    assert index.write(record("pending")) == Status.CHANGED
+    index.close()
+    assert len(list(archive.keys())) == 1
+
+    index = HashIndex(tmp_path / "index", archive)
+    assert len(index.hashes) == 1
+    assert index.write(record("pending")) == Status.SKIPPED
+
+
+def test_records_missing_from_archive_are_written_again(tmp_path: Path) -> None:
+    archive = FileArchive(tmp_path / "archive")
+    index = HashIndex(tmp_path / "index", archive)
+    index.write(record("pending"))
+    index.close()
+
+    # e.g. the index of another archive format
+    archive = FileArchive(tmp_path / "other")
+    index = HashIndex(tmp_path / "index", archive)
+    assert index.hashes == set()
+    assert index.write(record("pending")) == Status.NEW
+    index.close()
+    assert len(list(archive.keys())) == 1
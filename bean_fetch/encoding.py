@@ -0,0 +1,41 @@
+import dataclasses
+import json
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict
+
+# --- canonical json ---
+
+# separators, key order and datetime handling match `json.dumps` / dataclasses-json defaults, so
+# records encoded before this encoder existed keep their archive keys
+
+
+def default(obj: Any) -> Any:
+    """converts the values the json module does not know about. dataclasses are encoded field by
+    field in declaration order. datetimes become posix timestamps, naive ones are taken to be in
+    local time as dataclasses-json does (so their timestamp depends on the host's timezone)"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return fields(obj)
+    if isinstance(obj, datetime):
+        return obj.timestamp()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return "0x" + obj.hex()
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"{type(obj).__name__} is not json serializable")
+
+
+def fields(obj: Any) -> Dict[str, Any]:
+    """the (unconverted) field values of a dataclass instance"""
+    return {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+
+
+ENCODER = json.JSONEncoder(default=default)
+
+
+def dumps(obj: Any) -> str:
+    """the canonical json representation of `obj`"""
+    return ENCODER.encode(obj)
@@ -0,0 +1,91 @@
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator, cast
+
+from eth_typing import ChecksumAddress
+
+from bean_fetch.archive import encode
+from bean_fetch.data import RawTx
+from bean_fetch.encoding import dumps
+from bean_fetch.venues.ethereum.data import VENUE, EthTx, Kind, LogReceipt, TxReceipt
+
+# archived records are named after the hash of these exact bytes, any change to the encoding
+# archives every record again under a new key
+KEY = ("ethereum-TRANSACTION-2021-03-14_01-59-26-"
+       "47e6669b7fb3ff09b58d2c75f7eceb56e765c54a5fb38aa9bcde8afea0140c3c")
+
+DATA = (b'{"venue": "ethereum", "kind": "TRANSACTION", "timestamp": 1615705166.0, "raw": '
+        b'{"timestamp": 1615705166.0, "blockHash": "0x' + b"11" * 32 + b'", '
+        b'"blockNumber": 12000000, "chainId": 1, "data": null, '
+        b'"sender": "0xAbABaBaBaBABabaBaBabABaBABABAbabaBabaBAB", "receiver": null, '
+        b'"gas": 21000, "gasPrice": 100000000000, "hash": "0x' + b"22" * 32 + b'", '
+        b'"input": "0x", "nonce": 7, "value": 1000000000000000000, "receipt": '
+        b'{"contractAddress": null, "cumulativeGasUsed": 21000, "gasUsed": 21000, "logs": '
+        b'[{"address": "0x1111111111111111111111111111111111111111", "data": "0x01", '
+        b'"logIndex": 0, "payload": null, "removed": false, "topic": null, '
+        b'"topics": ["0x' + b"33" * 32 + b'"]}], "logsBloom": "0x00", "root": null, '
+        b'"status": 1}}, "meta": {}}')
+
+
+@contextmanager
+def timezone(name: str) -> Iterator[None]:
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = previous
+        time.tzset()
+
+
+def eth_tx() -> Any:
+    # naive, like the timestamps of every archived record
+    return EthTx(timestamp=datetime(2021, 3, 14, 1, 59, 26),
+                 blockHash="0x" + "11" * 32,
+                 blockNumber=12000000,
+                 chainId=1,
+                 data=None,
+                 sender=cast(ChecksumAddress, "0xAbABaBaBaBABabaBaBabABaBABABAbabaBabaBAB"),
+                 receiver=None,
+                 gas=21000,
+                 gasPrice=10**11,
+                 hash="0x" + "22" * 32,
+                 input="0x",
+                 nonce=7,
+                 value=10**18,
+                 receipt=TxReceipt(contractAddress=None,
+                                   cumulativeGasUsed=21000,
+                                   gasUsed=21000,
+                                   logs=[
+                                       LogReceipt(address=cast(ChecksumAddress, "0x" + "11" * 20),
+                                                  data="0x01",
+                                                  logIndex=0,
+                                                  payload=None,
+                                                  removed=False,
+                                                  topic=None,
+                                                  topics=["0x" + "33" * 32])
+                                   ],
+                                   logsBloom="0x00",
+                                   root=None,
+                                   status=1))
+
+
+def test_archive_key_is_stable() -> None:
+    # naive datetimes are encoded in local time, 01:59:26 EST is 06:59:26 UTC
+    with timezone("America/New_York"):
+        tx = eth_tx()
+        raw: Any = RawTx(venue=VENUE,
+                         kind=Kind.TRANSACTION,
+                         timestamp=tx.timestamp,
+                         raw=dumps(tx),
+                         meta={})
+        assert encode(raw) == (KEY, DATA)
+        # the bytes that dataclasses-json produced before the canonical encoder existed
+        assert dumps(tx) == tx.to_json()
+        assert DATA == raw.to_json().encode("UTF-8")
@@ -0,0 +1,122 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, as_completed
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from bean_fetch.archive import Archive
+from bean_fetch.config import FetchConfig
+from bean_fetch.data import RawTx
+from bean_fetch.dedup import HashIndex
+from bean_fetch.stats import STATS
+from bean_fetch.writer import Writer
+
+# --- constants ---
+
+# error policies
+RAISE = "raise"  # abort the whole fetch
+SKIP = "skip"  # report the error and keep going with the other venues
+
+# --- types ---
+
+# a venue name together with a function that starts fetching from it. the function is passed an
+# event that is set once the fetch should stop (e.g. on a timeout)
+Source = Tuple[str, Callable[[Event], Iterable[RawTx[Any]]]]
+
+T = TypeVar("T")
+
+# --- fetch ---
+
+
+class VenueTimeout(Exception):
+    pass
+
+
+def fetch_venues(sources: List[Source], archive: Archive, index: HashIndex,
+                 config: FetchConfig) -> Dict[str, Optional[Exception]]:
+    """fetches every source into `archive`, one after another or (if `config.concurrent`) all at
+    once. returns the error each venue failed with, or `None` if it succeeded. records fetched
+    before a venue failed are kept. a venue that runs past its timeout is abandoned: it is told to
+    stop, and only the records it wrote before the deadline are kept"""
+    for name, _ in sources:
+        if policy(config, name) not in (RAISE, SKIP):
+            raise ValueError(f"unknown error policy for {name}: {policy(config, name)}")
+
+    lock = Lock()
+    cancels = {name: Event() for name, _ in sources}
+    results: Dict[str, Optional[Exception]] = {}
+
+    def run(name: str, fetch: Callable[[Event], Iterable[RawTx[Any]]]) -> None:
+        print(f"fetching data from {name}")
+        timeout = (config.timeouts or {}).get(name)
+        writer = Writer(archive, index, lock=lock, name=name)
+        with STATS.timed(name, "fetch"):
+            if not timeout:
+                writer.consume(fetch(cancels[name]), cancels[name])
+                return
+            # the fetch runs on its own thread, so that a venue blocked in a request is abandoned
+            # at the deadline instead of waited for
+            future = background(lambda: writer.consume(fetch(cancels[name]), cancels[name]),
+                                name)
+            try:
+                future.result(timeout=timeout)
+            except TimeoutError:
+                cancels[name].set()
+                writer.close()
+                raise VenueTimeout(f"{name} did not finish within {timeout}s")
+
+    def record(name: str, error: Optional[Exception]) -> None:
+        results[name] = error
+        if error is None:
+            print(f"finished fetching data from {name}")
+            return
+        if policy(config, name) == RAISE:
+            # stop the other venues, they keep whatever they already wrote
+            for cancel in cancels.values():
+                cancel.set()
+            raise error
+        print(f"failed to fetch data from {name}: {error!r}")
+
+    if not config.concurrent:
+        for name, fetch in sources:
+            try:
+                run(name, fetch)
+                record(name, None)
+            except Exception as e:
+                record(name, e)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(len(sources), 1)) as pool:
+        futures: Dict["Future[None]", str] = {
+            pool.submit(run, name, fetch): name
+            for name, fetch in sources
+        }
+        failure: Optional[Exception] = None
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is not None and not isinstance(error, Exception):
+                raise error
+            try:
+                record(futures[future], error)
+            except Exception as e:
+                failure = failure or e
+        if failure:
+            raise failure
+    return results
+
+
+def background(fn: Callable[[], T], name: str) -> "Future[T]":
+    """runs `fn` on a daemon thread, which does not keep the process alive if it never returns"""
+    future: "Future[T]" = Future()
+
+    def target() -> None:
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    Thread(target=target, name=name, daemon=True).start()
+    return future
+
+
+def policy(config: FetchConfig, name: str) -> str:
+    return (config.on_error or {}).get(name, RAISE)
@@ -0,0 +1,79 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from threading import Event
+from typing import Any, Iterator
+
+from bean_fetch.archive import FileArchive
+from bean_fetch.config import FetchConfig
+from bean_fetch.data import RawTx
+from bean_fetch.dedup import HashIndex
+from bean_fetch.fetching import SKIP, VenueTimeout, fetch_venues
+from bean_fetch.venues.ethereum.data import VENUE, Kind
+
+
+def record(n: int) -> RawTx[Any]:
+    return RawTx(venue=VENUE,
+                 kind=Kind.TRANSACTION,
+                 timestamp=datetime(2021, 1, 1),
+                 raw=f'{{"hash": "0x{n:x}"}}',
+                 meta={})
+
+
+def fetch(tmp_path: Path, source: Any, timeout: float) -> Any:
+    archive = FileArchive(tmp_path / "archive")
+    index = HashIndex(tmp_path / "index", archive)
+    config = FetchConfig(timeouts={VENUE: timeout}, on_error={VENUE: SKIP})
+    start = time.monotonic()
+    results = fetch_venues([(VENUE, source)], archive, index, config)
+    index.close()
+    return results, time.monotonic() - start, list(archive.keys())
+
+
+def test_timeout_stops_blocked_source(tmp_path: Path) -> None:
+    released = Event()
+
+    def blocked(cancel: Event) -> Iterator[RawTx[Any]]:
+        yield record(1)
+        # a request that does not return before the deadline
+        released.wait(3)
+        yield record(2)
+
+    results, elapsed, keys = fetch(tmp_path, blocked, 0.5)
+    released.set()
+    assert isinstance(results[VENUE], VenueTimeout)
+    assert elapsed < 2
+    assert keys == []
+
+
+def test_timeout_when_source_finishes_late(tmp_path: Path) -> None:
+    def late(cancel: Event) -> Iterator[RawTx[Any]]:
+        yield record(1)
+        time.sleep(1)
+
+    results, _, _ = fetch(tmp_path, late, 0.5)
+    assert isinstance(results[VENUE], VenueTimeout)
+
+
+def test_timeout_cancels_source(tmp_path: Path) -> None:
+    cancelled = Event()
+
+    def slow(cancel: Event) -> Iterator[RawTx[Any]]:
+        cancel.wait(3)
+        if cancel.is_set():
+            cancelled.set()
+        return iter([])
+
+    results, _, _ = fetch(tmp_path, slow, 0.5)
+    assert isinstance(results[VENUE], VenueTimeout)
+    assert cancelled.wait(1)
+
+
+def test_source_within_timeout(tmp_path: Path) -> None:
+    def quick(cancel: Event) -> Iterator[RawTx[Any]]:
+        yield record(1)
+        yield record(2)
+
+    results, _, keys = fetch(tmp_path, quick, 5)
+    assert results == {VENUE: None}
+    assert len(keys) == 2
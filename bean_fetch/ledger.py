@@ -0,0 +1,216 @@
+import heapq
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, Iterable, Iterator, List, Optional, Set, TextIO, Tuple, Type
+
+from beancount.parser import printer
+
+import bean_fetch.state as state
+from bean_fetch.archive import Selection
+from bean_fetch.config import Config
+from bean_fetch.parsing import SortKey, parse_records
+from bean_fetch.prices import PRICES, Need, needs, prices
+from bean_fetch.stats import STATS, TOTAL
+
+# --- constants ---
+
+# name of the file (in the state dir) that records which records every ledger contains
+LEDGER_INDEX = "ledger.sqlite"
+
+# bytes of (pickled) entries held in memory before they are sorted and spilled to disk
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# --- types ---
+
+# (sort key, archive key, pickled entry)
+Item = Tuple[SortKey, str, bytes]
+
+# --- sorting ---
+
+
+class ExternalSort:
+    """sorts (sort key, archive key, entry) triples that may not fit in memory. entries are held
+    pickled, once they take up more than `budget` bytes the buffer is sorted and spilled to a
+    temporary run file. iterating merges the runs with whatever is still buffered"""
+    def __init__(self, budget: int = MEMORY_BUDGET, tmp_dir: Optional[Path] = None):
+        self.budget = budget
+        self.tmp_dir = tmp_dir
+        self.buffer: List[Item] = []
+        self.size = 0
+        self.runs: List[IO[bytes]] = []
+
+    def add(self, sk: SortKey, key: str, entry: Any) -> None:
+        blob = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        self.buffer.append((sk, key, blob))
+        self.size += len(blob)
+        if self.size > self.budget:
+            self.spill()
+
+    def spill(self) -> None:
+        self.buffer.sort(key=itemgetter(0))
+        run = tempfile.TemporaryFile(dir=self.tmp_dir)
+        for item in self.buffer:
+            pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+        self.runs.append(run)
+        self.buffer, self.size = [], 0
+        STATS.add(TOTAL, "sort_spills")
+
+    @staticmethod
+    def read(run: IO[bytes]) -> Iterator[Item]:
+        run.seek(0)
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+
+    def __iter__(self) -> Iterator[Tuple[SortKey, str, Any]]:
+        self.buffer.sort(key=itemgetter(0))
+        runs = [self.read(run) for run in self.runs] + [iter(self.buffer)]
+        for sk, key, blob in heapq.merge(*runs, key=itemgetter(0)):
+            yield sk, key, pickle.loads(blob)
+
+    def close(self) -> None:
+        for run in self.runs:
+            run.close()
+        self.runs, self.buffer = [], []
+
+    def __enter__(self) -> "ExternalSort":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
+
+
+# --- index ---
+
+
+class LedgerIndex:
+    """the archive keys of the records (and prices) written to each ledger file, so appending
+    only adds what a ledger does not contain yet. keys are only committed once the ledger they
+    were written to has been closed"""
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS written "
+                        "(ledger TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (ledger, key))")
+
+    def contains(self, ledger: str, key: str) -> bool:
+        return self.db.execute("SELECT 1 FROM written WHERE ledger = ? AND key = ?",
+                               (ledger, key)).fetchone() is not None
+
+    def count(self, ledger: str) -> int:
+        n: int = self.db.execute("SELECT COUNT(*) FROM written WHERE ledger = ?",
+                                 (ledger, )).fetchone()[0]
+        return n
+
+    def add(self, ledger: str, key: str) -> None:
+        self.db.execute("INSERT OR IGNORE INTO written (ledger, key) VALUES (?, ?)", (ledger, key))
+
+    def reset(self, ledger: str) -> None:
+        self.db.execute("DELETE FROM written WHERE ledger = ?", (ledger, ))
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def rollback(self) -> None:
+        self.db.rollback()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "LedgerIndex":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
+
+
+# --- writing ---
+
+
+def price_key(need: Need) -> Tuple[SortKey, str]:
+    """the sort key and ledger index key of the price entry for `need`"""
+    commodity, quote, day = need
+    return (datetime(day.year, day.month, day.day), PRICES,
+            f"{commodity}-{quote}"), f"{PRICES}-{commodity}-{quote}-{day.isoformat()}"
+
+
+def emit(entries: Iterable[Tuple[SortKey, str, Any]], out: TextIO,
+         written: Optional[Tuple[LedgerIndex, str]] = None) -> int:
+    """writes `entries` to `out` one at a time, recording their keys in the `written` (index,
+    ledger) if given. returns the number of entries written"""
+    n = 0
+    for _, key, entry in entries:
+        out.write(printer.format_entry(entry) + "\n")
+        if written:
+            written[0].add(written[1], key)
+        n += 1
+    STATS.add(TOTAL, "ledger_entries", n)
+    return n
+
+
+def write_ledger(config: Config,
+                 path: Optional[Path] = None,
+                 jobs: int = 1,
+                 append: bool = False,
+                 budget: int = MEMORY_BUDGET,
+                 selection: Selection = Selection()) -> int:
+    """parses the archived records in `selection` and writes their entries (and the prices they
+    need, if configured) to the ledger at `path` (or stdout) in (timestamp, venue, hash) order.
+    entries are sorted externally so memory use is bounded by `budget`, and the ledger is written
+    incrementally. with `append`, only the entries that are not in the ledger yet are sorted and
+    appended to it. returns the number of entries written"""
+    if append and path is None:
+        raise ValueError("only ledger files can be appended to")
+    ledger = str(path.absolute()) if path else ""
+
+    with LedgerIndex(config.archive_dir / state.STATE_DIR / LEDGER_INDEX) as index, \
+            ExternalSort(budget) as sort, STATS.timed(TOTAL, "ledger"):
+        if append and path and path.exists() and path.stat().st_size and not index.count(ledger):
+            raise ValueError(f"{path} was not written by bean-fetch, write it without --append")
+        append = append and bool(path and path.exists())
+
+        wanted: Set[Need] = set()
+        for key, sk, entry in parse_records(config, jobs, selection):
+            if entry is None or append and index.contains(ledger, key):
+                continue
+            sort.add(sk, key, entry)
+            if config.prices:
+                wanted |= needs([entry], config.prices.quote)
+
+        if config.prices:
+            for price in prices(config, wanted):
+                sk, key = price_key((price.currency, price.amount.currency, price.date))
+                if not (append and index.contains(ledger, key)):
+                    sort.add(sk, key, price)
+
+        if path is None:
+            return emit(sort, sys.stdout)
+
+        if not append:
+            index.reset(ledger)
+        try:
+            if append:
+                with path.open("a") as f:
+                    n = emit(sort, f, (index, ledger))
+            else:
+                # write next to the ledger and swap it in, so a failed run leaves it untouched
+                tmp = path.with_name(path.name + ".tmp")
+                with tmp.open("w") as f:
+                    n = emit(sort, f, (index, ledger))
+                os.replace(tmp, path)
+        except BaseException:
+            index.rollback()
+            raise
+        index.commit()
+        return n
@@ -0,0 +1,21 @@
+import random
+from datetime import datetime, timedelta
+from operator import itemgetter
+from pathlib import Path
+
+from bean_fetch.ledger import ExternalSort
+
+
+def test_external_sort_merges_spilled_runs(tmp_path: Path) -> None:
+    rng = random.Random(1)
+    items = []
+    for n in range(2000):
+        # plenty of equal sort keys, which keep the order they were added in
+        sk = (datetime(2021, 1, 1) + timedelta(hours=rng.randrange(300)), "coinbase", "")
+        items.append((sk, f"key-{n}", {"n": n, "memo": "x" * rng.randrange(50)}))
+
+    with ExternalSort(budget=4096, tmp_dir=tmp_path) as sorter:
+        for item in items:
+            sorter.add(*item)
+        assert len(sorter.runs) > 5
+        assert list(sorter) == sorted(items, key=itemgetter(0))
@@ -1,22 +1,33 @@
 import argparse
-import hashlib
-import json
-from datetime import datetime
+import signal
+import sys
+from datetime import date, datetime, timezone
+from functools import partial
 from pathlib import Path
+from threading import Event
 from typing import Any, List, Optional
 
-import yaml
-from pydantic.dataclasses import dataclass
-
 import bean_fetch.venues.coinbase as cb
 import bean_fetch.venues.coinbasepro.venue as cbpro
-import bean_fetch.venues.ethereum as eth
-from bean_fetch.data import Kind, RawTx
+import bean_fetch.venues.ethereum.venue as eth
+import bean_fetch.state as state
+from bean_fetch.archive import FORMATS, Selection, migrate
+from bean_fetch.balances import BALANCE_STORE, BalanceStore, update_balances
+from bean_fetch.balances import reconcile as check_balances
+from bean_fetch.config import Config, archive, load_config
+from bean_fetch.dedup import HashIndex, Status
+from bean_fetch.fetching import Source, fetch_venues
+from bean_fetch.ledger import MEMORY_BUDGET, write_ledger
+from bean_fetch.stats import STATS, TOTAL
+from bean_fetch.watch import watch
 
 # --- constants ---
 
 TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
+# name of the file (in the state dir) that indexes the hashes of all archived records
+INDEX = "index"
+
 # --- cli ---
 
 use = '''bean-fetch -c <CONFIG> <command>
@@ -24,6 +35,9 @@ use = '''bean-fetch -c <CONFIG> <command>
 The following commands are available
    fetch     Fetch raw transaction data from the outside world and persist it to disk
    parse     Parse the raw data into a beancount ledger
+   watch     Keep fetching new raw data as it appears, until interrupted
+   balances  Report account balances at a date (--at), or reconcile them with the venues
+   migrate   Copy the archive into another storage format (--to files|segments)
 '''
 
 parser = argparse.ArgumentParser(
@@ -33,106 +47,202 @@ parser.add_argument("-c",
                     required=True,
                     help="configuration file path")
 parser.add_argument("command", help="command to run")
-args = parser.parse_args()
-
-# --- config ---
-
-
-@dataclass(frozen=True)
-class Config:
-    archive_dir: Path
-    coinbase: Optional[cb.Config]
-    coinbasepro: Optional[cbpro.Config]
-    ethereum: Optional[eth.Config]
-
-
-def load_config(path: Path) -> Config:
-    config = yaml.load(path.read_text(), yaml.Loader)
-    return Config(
-        archive_dir=path.absolute().parent / config["archive_dir"],
-        coinbase=cb.Config(
-            **config["coinbase"]) if "coinbase" in config else None,
-        coinbasepro=cbpro.Config(
-            **config["coinbasepro"]) if "coinbasepro" in config else None,
-        ethereum=eth.Config(
-            **config["ethereum"]) if "ethereum" in config else None,
-    )
-
-
-# --- archive ---
-
-
-def serialize(path: Path, tx: RawTx[Kind]) -> None:
-    """writes `tx` to `dir`. includes the sha256 hash of the contents in the filename"""
-    time = tx.timestamp.strftime("%Y-%m-%d_%H-%M-%S")
-    hash = hashlib.sha256(tx.to_json().encode('UTF-8')).hexdigest()
-    out = tx.to_json(indent=4)
-    path.mkdir(parents=True, exist_ok=True)
-    (path / f"{tx.venue}-{tx.kind}-{time}-{hash}.json").write_text(out)
-
-
-def deserialize(path: Path) -> RawTx[Kind]:
-    j = json.loads(path.read_text())
-
-    if j["venue"] == cb.VENUE:
-        j["kind"] = cb.Kind(j["kind"])
-    elif j["venue"] == cbpro.VENUE:
-        j["kind"] = cbpro.Kind(j["kind"])
-    elif j["venue"] == eth.VENUE:
-        j["kind"] = eth.Kind(j["kind"])
-    else:
-        raise ValueError(f"unknown venue: {j['venue']}")
-
-    return RawTx(kind=j["kind"],
-                 venue=j["venue"],
-                 timestamp=datetime.utcfromtimestamp(j["timestamp"]),
-                 raw=json.dumps(j["raw"]))
-
+parser.add_argument("--to",
+                    choices=FORMATS,
+                    help="archive format to migrate to")
+parser.add_argument("--prune",
+                    action="store_true",
+                    help="remove the source records after a successful migration")
+parser.add_argument("-j",
+                    "--jobs",
+                    type=int,
+                    default=1,
+                    help="number of processes to parse with")
+parser.add_argument("-o",
+                    "--output",
+                    type=Path,
+                    help="ledger file to parse into (default: stdout)")
+parser.add_argument("--append",
+                    action="store_true",
+                    help="only append the entries that are not in the --output ledger yet")
+parser.add_argument("--memory-budget",
+                    type=int,
+                    default=MEMORY_BUDGET // (1024 * 1024),
+                    help="MiB of entries to sort in memory before spilling to disk")
+parser.add_argument("--since",
+                    type=date.fromisoformat,
+                    help="only parse records from this day on (YYYY-MM-DD, utc)")
+parser.add_argument("--until",
+                    type=date.fromisoformat,
+                    help="only parse records from before this day (YYYY-MM-DD, utc)")
+parser.add_argument("--venue",
+                    action="append",
+                    help="only parse records from this venue (can be repeated)")
+parser.add_argument("--account",
+                    default="",
+                    help="only report the balances of this account and its sub-accounts")
+parser.add_argument("--at",
+                    type=date.fromisoformat,
+                    help="report balances at the end of this day (YYYY-MM-DD, default: today)")
+parser.add_argument("--reconcile",
+                    action="store_true",
+                    help="compare the ledger with the balances reported on the last fetch")
+parser.add_argument("--stats",
+                    nargs="?",
+                    const="text",
+                    choices=["text", "json"],
+                    help="report timings and request / record counts (to stderr) when done")
+parser.add_argument("--profile",
+                    choices=["fetch", "write", "parse"],
+                    help="run a stage under cProfile and report its most expensive functions "
+                    "(profile parse with -j 1, worker processes are not profiled)")
+parser.add_argument("--profile-out",
+                    help="write the raw profile to this file instead (for pstats / snakeviz)")
 
 # --- main ---
 
 
-def fetch(config: Config) -> None:
-    raw: List[RawTx[Any]] = []
-
+def sources(config: Config) -> List[Source]:
+    out: List[Source] = []
     if config.coinbase:
-        print("fetching data from coinbase")
-        raw += cb.Venue.fetch(config.coinbase)
+        out.append((cb.VENUE, partial(cb.Venue.fetch, config.coinbase)))
     if config.coinbasepro:
-        print("fetching data from coinbase pro")
-        raw += cbpro.Venue.fetch(config.coinbasepro)
+        out.append((cbpro.VENUE, partial(cbpro.Venue.fetch, config.coinbasepro)))
     if config.ethereum:
-        print("fetching data from ethereum")
-        raw += eth.Venue.fetch(config.ethereum)
-
-    print("writing raw transaction data to archive")
-    for tx in raw:
-        serialize(config.archive_dir, tx)
-
-
-def parse(config: Config) -> None:
-    txs: List[RawTx[Any]] = [
-        deserialize(p) for p in config.archive_dir.iterdir() if p.is_file()
-    ]
-
-    for tx in txs:
-        if cb.Venue.handles(tx) and config.coinbase:
-            cb.Venue.parse(config.coinbase, tx)
-        elif cbpro.Venue.handles(tx) and config.coinbasepro:
-            cbpro.Venue.parse(config.coinbasepro, tx)
-        elif eth.Venue.handles(tx) and config.ethereum:
-            eth.Venue.parse(config.ethereum, tx)
-        else:
-            raise ValueError(f"unable to parse tx:\n {tx}")
+        out.append((eth.VENUE, partial(eth.Venue.fetch, config.ethereum)))
+    return out
+
+
+def selection(args: argparse.Namespace) -> Selection:
+    def midnight(day: Optional[date]) -> Optional[datetime]:
+        return datetime(day.year, day.month, day.day) if day else None
+
+    return Selection(since=midnight(args.since),
+                     until=midnight(args.until),
+                     venues=frozenset(args.venue) if args.venue else None)
+
+
+def fetch(config: Config) -> List[str]:
+    """fetches every configured venue, returns the venues that failed"""
+    with archive(config) as a:
+        index = HashIndex(config.archive_dir / state.STATE_DIR / INDEX, a)
+        try:
+            results = fetch_venues(sources(config), a, index, config.fetch)
+        finally:
+            index.close()
+
+            counts = index.counts
+            print(f"archived {counts[Status.NEW]} new and {counts[Status.CHANGED]} changed "
+                  f"records, skipped {counts[Status.SKIPPED]} unchanged records")
+    failed = [name for name, error in results.items() if error is not None]
+    if failed:
+        print(f"failed to fetch {', '.join(failed)}", file=sys.stderr)
+    return failed
+
+
+def watch_venues(config: Config) -> None:
+    stop = Event()
+
+    def terminate(signum: int, frame: Any) -> None:
+        stop.set()
+
+    signal.signal(signal.SIGTERM, terminate)
+    with archive(config) as a:
+        index = HashIndex(config.archive_dir / state.STATE_DIR / INDEX, a)
+        try:
+            watch(config, a, index, stop)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            index.close()
+
+            counts = index.counts
+            print(f"archived {counts[Status.NEW]} new and {counts[Status.CHANGED]} changed "
+                  f"records, skipped {counts[Status.SKIPPED]} unchanged records")
+
+
+def parse(config: Config,
+          jobs: int = 1,
+          output: Optional[Path] = None,
+          append: bool = False,
+          budget: int = MEMORY_BUDGET,
+          selection: Selection = Selection()) -> None:
+    written = write_ledger(config, output, jobs, append, budget, selection)
+    if output:
+        print(f"{'appended' if append else 'wrote'} {written} entries to {output}")
+
+
+def balances(config: Config,
+             jobs: int = 1,
+             account: str = "",
+             at: Optional[date] = None,
+             reconcile: bool = False) -> None:
+    with BalanceStore(config.archive_dir / state.CACHE_DIR / BALANCE_STORE) as store:
+        applied, reverted = update_balances(config, store, jobs)
+        if applied or reverted:
+            print(f"applied {applied} and reverted {reverted} records", file=sys.stderr)
+
+        if not reconcile:
+            day = at or datetime.now(timezone.utc).date()
+            for (acct, currency), balance in store.balances(day, account).items():
+                print(f"{day} {acct} {balance} {currency}")
+            return
+
+        mismatches = 0
+        for venue, currency, reported, ledger in check_balances(config, store):
+            ok = reported == ledger
+            mismatches += not ok
+            print(f"{venue} {currency}: reported {reported}, ledger {ledger}"
+                  f"{'' if ok else f' (off by {ledger - reported})'}")
+        print(f"{mismatches} mismatched balances")
+
+
+def migrate_archive(config: Config, to: str, prune: bool = False) -> None:
+    if to == config.archive_format:
+        raise ValueError(f"archive is already stored as {to}")
+
+    with archive(config) as src, archive(config, to) as dst:
+        print(f"migrating archive from {config.archive_format} to {to}")
+        copied = migrate(src, dst)
+        print(f"copied {copied} records")
+        if prune:
+            print(f"removing {config.archive_format} records")
+            src.delete()
+    print(f"set `archive_format: {to}` in the config to use the migrated archive")
 
 
 def main() -> None:
+    args = parser.parse_args()
     config = load_config(Path(args.config))
-
-    if args.command == "fetch":
-        fetch(config)
-    elif args.command == "parse":
-        parse(config)
+    STATS.profile = args.profile
+    failed: List[str] = []
+
+    try:
+        with STATS.timed(TOTAL, f"{args.command} command"):
+            if args.command == "fetch":
+                failed = fetch(config)
+            elif args.command == "watch":
+                watch_venues(config)
+            elif args.command == "parse":
+                if args.append and not args.output:
+                    parser.error("--append requires --output")
+                parse(config, args.jobs, args.output, args.append,
+                      args.memory_budget * 1024 * 1024, selection(args))
+            elif args.command == "balances":
+                balances(config, args.jobs, args.account, args.at, args.reconcile)
+            elif args.command == "migrate":
+                if not args.to:
+                    parser.error("migrate requires --to")
+                migrate_archive(config, args.to, args.prune)
+    finally:
+        if args.stats == "json":
+            print(STATS.to_json(), file=sys.stderr)
+        elif args.stats:
+            print(STATS.format(), file=sys.stderr)
+        if args.profile:
+            print(STATS.dump_profile(args.profile_out), file=sys.stderr)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from beancount.core.data import Transaction
+
+import bean_fetch.venues.coinbase as cb
+import bean_fetch.venues.coinbasepro.venue as cbpro
+import bean_fetch.venues.ethereum.venue as eth
+import bean_fetch.state as state
+from bean_fetch.archive import Selection
+from bean_fetch.cache import ParseCache, fingerprint
+from bean_fetch.config import Config, archive
+from bean_fetch.data import RawTx, kind_name
+from bean_fetch.stats import STATS, TOTAL, Table
+
+# --- constants ---
+
+# name of the parse cache (in the cache dir)
+PARSE_CACHE = "parse.sqlite"
+
+# max records parsed (and held in memory) at once per shard
+SHARD_SIZE = 1000
+
+# --- types ---
+
+# (timestamp, venue, hash): the order in which parsed entries are emitted
+SortKey = Tuple[datetime, str, str]
+
+Parsed = Tuple[SortKey, Transaction]
+
+# the result of parsing a single archived record, keyed by its archive key
+Result = Tuple[str, SortKey, Optional[Transaction]]
+
+# --- parse ---
+
+
+def parse_tx(config: Config, tx: RawTx[Any]) -> Optional[Transaction]:
+    if cb.Venue.handles(tx) and config.coinbase:
+        return cb.Venue.parse(config.coinbase, tx)
+    elif cbpro.Venue.handles(tx) and config.coinbasepro:
+        return cbpro.Venue.parse(config.coinbasepro, tx)
+    elif eth.Venue.handles(tx) and config.ethereum:
+        return eth.Venue.parse(config.ethereum, tx)
+    else:
+        raise ValueError(f"unable to parse tx:\n {tx}")
+
+
+def sort_key(key: str, tx: RawTx[Any]) -> SortKey:
+    return tx.timestamp, tx.venue, key.rsplit("-", 1)[1]
+
+
+def signatures(config: Config) -> Dict[str, str]:
+    """venue -> parser version and config fingerprint. cached results for a venue are reused only
+    while its signature is unchanged"""
+    return {
+        cb.VENUE: f"{cb.PARSER_VERSION}:{fingerprint(config.coinbase, cb.PARSE_FIELDS)}",
+        cbpro.VENUE: (f"{cbpro.PARSER_VERSION}:"
+                      f"{fingerprint(config.coinbasepro, cbpro.PARSE_FIELDS)}"),
+        eth.VENUE: f"{eth.PARSER_VERSION}:{fingerprint(config.ethereum, eth.PARSE_FIELDS)}",
+    }
+
+
+def prepare(config: Config, txs: List[RawTx[Any]]) -> None:
+    """lets venues resolve whatever they need to parse `txs` in bulk, before they are parsed one
+    by one"""
+    if config.ethereum:
+        eth.Venue.prepare(config.ethereum, [tx for tx in txs if eth.Venue.handles(tx)])
+
+
+def parse_shard(config: Config, keys: List[str]) -> List[Result]:
+    """parses the archived records for `keys`, recording the time spent loading and parsing
+    each venue / kind"""
+    out: List[Result] = []
+    with archive(config) as a, STATS.timed(TOTAL, "parse"):
+        txs: List[RawTx[Any]] = []
+        for key in keys:
+            start = time.perf_counter()
+            txs.append(a.load(key))
+            STATS.add_time(key.split("-", 1)[0], "load", time.perf_counter() - start)
+
+        with STATS.timed(TOTAL, "prepare"):
+            prepare(config, txs)
+
+        for key, tx in zip(keys, txs):
+            start = time.perf_counter()
+            out.append((key, sort_key(key, tx), parse_tx(config, tx)))
+            kind = kind_name(tx.kind)
+            STATS.add_time(tx.venue, f"parse {kind}", time.perf_counter() - start)
+            STATS.add(tx.venue, f"parsed {kind}")
+    return out
+
+
+def parse_worker(config: Config, keys: List[str]) -> Tuple[List[Result], Dict[str, Table]]:
+    """`parse_shard` in a worker process, returns the results along with the metrics collected
+    while parsing them"""
+    STATS.reset()
+    results = parse_shard(config, keys)
+    return results, STATS.snapshot()
+
+
+def parse_shards(config: Config, keys: List[str], jobs: int) -> Iterator[List[Result]]:
+    """the results of parsing `keys`, one shard of at most `SHARD_SIZE` records at a time"""
+    if jobs <= 1 or len(keys) <= 1:
+        for i in range(0, len(keys), SHARD_SIZE):
+            yield parse_shard(config, keys[i:i + SHARD_SIZE])
+        return
+
+    # a few shards per worker keeps the pool busy when shards take uneven amounts of time
+    size = min(max(len(keys) // (jobs * 4), 1), SHARD_SIZE)
+    shards = [keys[i:i + size] for i in range(0, len(keys), size)]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for results, snapshot in pool.map(partial(parse_worker, config), shards):
+            STATS.merge(snapshot)
+            yield results
+
+
+def parse_records(config: Config,
+                  jobs: int = 1,
+                  selection: Selection = Selection()) -> Iterator[Result]:
+    """parses every archived record in `selection`, sharding them across `jobs` processes, and
+    yields the (key, sort key, entry) of each in no particular order. records that were already
+    parsed with the current parser version and config are streamed from the parse cache, the
+    rest are parsed (and cached) one shard at a time, so memory use does not grow with the
+    archive"""
+    with archive(config) as a:
+        keys = sorted(a.select(selection))
+    if not selection.everything:
+        # only look up the cached results of the selected records
+        yield from parse_keys(config, keys, jobs)
+        return
+
+    sigs = signatures(config)
+    with ParseCache(config.archive_dir / state.CACHE_DIR / PARSE_CACHE) as cache:
+        cached = cache.keys(sigs)
+        todo = [k for k in keys if k not in cached]
+        live = set(keys)
+        for key, (sk, entry) in cache.scan(sigs):
+            # results of records that are no longer archived are evicted below
+            if key not in live:
+                continue
+            STATS.add(key.split("-", 1)[0], "parse_cache_hits")
+            yield key, sk, entry
+
+        for rs in parse_shards(config, todo, jobs):
+            cache.store((key, sigs[key.split("-", 1)[0]], (sk, entry)) for key, sk, entry in rs)
+            yield from rs
+        cache.evict(keys)
+
+
+def parse_keys(config: Config, keys: List[str], jobs: int = 1) -> Iterator[Result]:
+    """like `parse_records`, but only for the archived records in `keys`"""
+    sigs = signatures(config)
+    with ParseCache(config.archive_dir / state.CACHE_DIR / PARSE_CACHE) as cache:
+        done = set()
+        for key, (sk, entry) in cache.select(keys, sigs):
+            done.add(key)
+            STATS.add(key.split("-", 1)[0], "parse_cache_hits")
+            yield key, sk, entry
+
+        for rs in parse_shards(config, [k for k in keys if k not in done], jobs):
+            cache.store((key, sigs[key.split("-", 1)[0]], (sk, entry)) for key, sk, entry in rs)
+            yield from rs
+
+
+def parse_archive(config: Config, jobs: int = 1) -> List[Parsed]:
+    """every parsed entry in (timestamp, venue, hash) order, independent of `jobs`. holds the
+    whole ledger in memory, see `bean_fetch.ledger` for a memory-bounded alternative"""
+    parsed = [(sk, entry) for _, sk, entry in parse_records(config, jobs) if entry is not None]
+    return sorted(parsed, key=itemgetter(0))
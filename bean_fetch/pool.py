@@ -0,0 +1,111 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Full, Queue
+from threading import Event
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Tuple, TypeVar
+
+A = TypeVar("A")
+B = TypeVar("B")
+
+# marks the end of a stream in its queue
+DONE = object()
+
+
+def imap(fn: Callable[[A], B], items: Iterable[A], workers: int, window: int = 0) -> Iterator[B]:
+    """applies `fn` to `items` on a thread pool and yields the results in input order. at most
+    `window` (default: `workers`) results are in flight or buffered at any one time"""
+    window = max(window or workers, 1)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending: Deque["Future[B]"] = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Failed:
+    """an exception raised by a stream, passed through its queue"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Closed(Exception):
+    """raised in the workers of `istream` once its consumer is gone"""
+    pass
+
+
+def istream(fn: Callable[[A], Iterable[B]], items: Iterable[A], workers: int,
+            buffer: int) -> Iterator[Tuple[A, Iterator[B]]]:
+    """like `imap` for an `fn` that returns a stream: runs `fn` on up to `workers` items at once,
+    and yields (item, elements of `fn(item)`) pairs in input order. each worker runs at most
+    `buffer` elements ahead of the consumer, so long streams are not held in memory. a stream is
+    drained (and its elements dropped) if the next pair is requested before it was consumed"""
+    closed = Event()
+
+    def put(q: "Queue[Any]", x: Any) -> None:
+        while True:
+            if closed.is_set():
+                raise Closed()
+            try:
+                return q.put(x, timeout=0.1)
+            except Full:
+                pass
+
+    def produce(item: A, q: "Queue[Any]") -> None:
+        try:
+            if closed.is_set():
+                return
+            for x in fn(item):
+                put(q, x)
+            put(q, DONE)
+        except Closed:
+            pass
+        except BaseException as e:
+            try:
+                put(q, Failed(e))
+            except Closed:
+                pass
+
+    def drain(q: "Queue[Any]") -> Iterator[B]:
+        while True:
+            x = q.get()
+            if x is DONE:
+                return
+            if isinstance(x, Failed):
+                raise x.error
+            yield x
+
+    def emit(item: A, q: "Queue[Any]") -> Iterator[Tuple[A, Iterator[B]]]:
+        stream = drain(q)
+        yield item, stream
+        for _ in stream:
+            pass
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending: Deque[Tuple[A, "Queue[Any]"]] = deque()
+        try:
+            for item in items:
+                q: "Queue[Any]" = Queue(maxsize=max(buffer, 1))
+                pool.submit(produce, item, q)
+                pending.append((item, q))
+                if len(pending) >= max(workers, 1):
+                    yield from emit(*pending.popleft())
+            while pending:
+                yield from emit(*pending.popleft())
+        finally:
+            # unblocks the workers, so that the pool can shut down
+            closed.set()
+
+
+def chunked(items: Iterable[A], size: int) -> Iterator[List[A]]:
+    """splits `items` into lists of at most `size` elements"""
+    chunk: List[A] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,40 @@
+import threading
+from typing import Iterator, List
+
+from bean_fetch.pool import istream
+
+
+def test_istream_keeps_order_and_bounds_buffer() -> None:
+    produced = {k: 0 for k in range(4)}
+    lock = threading.Lock()
+
+    def stream(k: int) -> Iterator[int]:
+        for i in range(100):
+            with lock:
+                produced[k] += 1
+            yield k * 100 + i
+
+    out: List[int] = []
+    for k, items in istream(stream, range(4), workers=2, buffer=5):
+        first = next(items)
+        # workers wait for the consumer instead of fetching whole streams ahead of it
+        with lock:
+            assert all(n <= 5 + 1 for j, n in produced.items() if j > k)
+        out += [first] + list(items)
+    assert out == list(range(400))
+
+
+def test_istream_raises_stream_errors() -> None:
+    def stream(k: int) -> Iterator[int]:
+        yield k
+        if k == 1:
+            raise ValueError(k)
+
+    seen: List[int] = []
+    try:
+        for _, items in istream(stream, range(3), workers=2, buffer=1):
+            seen += list(items)
+        assert False, "stream error was not raised"
+    except ValueError:
+        pass
+    assert seen == [0]
@@ -0,0 +1,218 @@
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+import requests
+from beancount.core.amount import Amount
+from beancount.core.data import Price, Transaction, new_metadata
+
+import bean_fetch.state as state
+from bean_fetch.config import Config, PriceConfig
+from bean_fetch.stats import STATS
+from bean_fetch.venues.coinbasepro.client import Client
+
+# --- constants ---
+
+# name of the price cache (in the state dir). prices cost network time to rebuild, so they are
+# kept with the venue state rather than in the cache dir
+PRICE_CACHE = "prices.sqlite"
+
+# scope of the price metrics
+PRICES = "prices"
+
+# --- types ---
+
+# (commodity, quote currency, day)
+Need = Tuple[str, str, date]
+
+# --- needs ---
+
+
+def needs(entries: Iterable[Any], quote: str) -> Set[Need]:
+    """every (commodity, quote, day) price needed to value the postings of `entries` in `quote`"""
+    out: Set[Need] = set()
+    for entry in entries:
+        if not isinstance(entry, Transaction):
+            continue
+        for posting in entry.postings:
+            for amount in (posting.units, posting.cost, posting.price):
+                currency = getattr(amount, "currency", None)
+                if isinstance(currency, str) and currency != quote:
+                    out.add((currency, quote, entry.date))
+    return out
+
+
+def ranges(days: Iterable[date], max_gap: int) -> List[Tuple[date, date]]:
+    """coalesces `days` into inclusive ranges, bridging gaps of up to `max_gap` days so that
+    sparse needs are fetched with a few large requests"""
+    out: List[Tuple[date, date]] = []
+    for day in sorted(set(days)):
+        if out and (day - out[-1][1]).days <= max_gap + 1:
+            out[-1] = (out[-1][0], day)
+        else:
+            out.append((day, day))
+    return out
+
+
+# --- sources ---
+
+
+class PriceSource(ABC):
+    @abstractmethod
+    def fetch(self, commodity: str, quote: str, start: date, end: date) -> Dict[date, Decimal]:
+        """daily closing prices of `commodity` in `quote` for `start..end` (inclusive). days
+        without a price are left out"""
+        ...
+
+
+class CoinbaseProSource(PriceSource):
+    """daily candles of the `{commodity}-{quote}` coinbase pro product"""
+    # max candles returned by a single request
+    MAX_CANDLES = 300
+
+    def __init__(self, client: Client):
+        self.client = client
+
+    def fetch(self, commodity: str, quote: str, start: date, end: date) -> Dict[date, Decimal]:
+        out: Dict[date, Decimal] = {}
+        lo = start
+        while lo <= end:
+            hi = min(end, lo + timedelta(days=self.MAX_CANDLES - 1))
+            try:
+                candles = self.client.get_product_historic_rates(f"{commodity}-{quote}",
+                                                                 start=lo.isoformat(),
+                                                                 end=hi.isoformat(),
+                                                                 granularity=86400)
+            except requests.HTTPError as e:
+                # the pair is not listed
+                if e.response is not None and e.response.status_code in (400, 404):
+                    return out
+                raise
+            for t, _, _, _, close, _ in candles:
+                day = datetime.fromtimestamp(t, timezone.utc).date()
+                if start <= day <= end:
+                    out[day] = Decimal(str(close))
+            lo = hi + timedelta(days=1)
+        return out
+
+
+def coinbasepro(config: Config) -> PriceSource:
+    cbpro = config.coinbasepro
+    if cbpro is None:
+        return CoinbaseProSource(Client("", "", ""))
+    return CoinbaseProSource(
+        Client(cbpro.api_key,
+               cbpro.api_secret,
+               cbpro.api_passphrase,
+               api_url=cbpro.api_url,
+               rate_limit=cbpro.rate_limit))
+
+
+# price source name -> constructor
+SOURCES: Dict[str, Callable[[Config], PriceSource]] = {
+    "coinbasepro": coinbasepro,
+}
+
+# --- cache ---
+
+
+class PriceCache:
+    """on-disk daily prices, indexed by (commodity, quote, day). days that were fetched but have
+    no price are stored as null, so they are not requested again"""
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS prices (commodity TEXT NOT NULL, "
+                        "quote TEXT NOT NULL, day TEXT NOT NULL, price TEXT, "
+                        "PRIMARY KEY (commodity, quote, day))")
+
+    def lookup(self, wanted: Iterable[Need]) -> Dict[Need, Optional[Decimal]]:
+        """the cached prices for `wanted`, missing prices map to `None`"""
+        out: Dict[Need, Optional[Decimal]] = {}
+        for commodity, quote, day in wanted:
+            row = self.db.execute(
+                "SELECT price FROM prices WHERE commodity = ? AND quote = ? AND day = ?",
+                (commodity, quote, day.isoformat())).fetchone()
+            if row is not None:
+                out[(commodity, quote, day)] = Decimal(row[0]) if row[0] is not None else None
+        return out
+
+    def store(self, commodity: str, quote: str, start: date, end: date,
+              prices: Dict[date, Decimal]) -> None:
+        """records the prices fetched for `start..end`. days before today without a price are
+        stored as missing, today's price is not final yet so it is never stored"""
+        today = datetime.now(timezone.utc).date()
+        rows = []
+        day = start
+        while day <= end and day < today:
+            price = prices.get(day)
+            rows.append((commodity, quote, day.isoformat(),
+                         str(price) if price is not None else None))
+            day += timedelta(days=1)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO prices (commodity, quote, day, price) VALUES (?, ?, ?, ?)",
+            rows)
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "PriceCache":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
+
+
+# --- oracle ---
+
+
+class PriceOracle:
+    """answers batches of price needs from the cache, fetching whatever is missing from `source`
+    in as few ranged requests as possible"""
+    def __init__(self, source: PriceSource, cache: PriceCache, max_gap: int = 30):
+        self.source = source
+        self.cache = cache
+        self.max_gap = max_gap
+
+    def resolve(self, wanted: Set[Need]) -> Dict[Need, Decimal]:
+        known = self.cache.lookup(wanted)
+        STATS.add(PRICES, "prices_cached", len(known))
+
+        missing: Dict[Tuple[str, str], List[date]] = defaultdict(list)
+        for commodity, quote, day in wanted - set(known):
+            missing[(commodity, quote)].append(day)
+
+        for (commodity, quote), days in sorted(missing.items()):
+            for lo, hi in ranges(days, self.max_gap):
+                prices = self.source.fetch(commodity, quote, lo, hi)
+                STATS.add(PRICES, "price_ranges_fetched")
+                self.cache.store(commodity, quote, lo, hi, prices)
+                for day in days:
+                    if lo <= day <= hi:
+                        known[(commodity, quote, day)] = prices.get(day)
+
+        return {need: price for need, price in known.items() if price is not None}
+
+
+def price_entries(prices: Dict[Need, Decimal]) -> List[Price]:
+    return [
+        Price(new_metadata("bean-fetch", 0), day, commodity, Amount(price, quote))
+        for (commodity, quote, day), price in sorted(prices.items(), key=lambda p: p[0][2])
+    ]
+
+
+def prices(config: Config, wanted: Set[Need]) -> List[Price]:
+    """the `Price` entries for `wanted` (see `needs`)"""
+    pc = config.prices or PriceConfig()
+    if pc.source not in SOURCES:
+        raise ValueError(f"unknown price source: {pc.source}")
+    with PriceCache(config.archive_dir / state.STATE_DIR / PRICE_CACHE) as cache:
+        oracle = PriceOracle(SOURCES[pc.source](config), cache, pc.max_gap)
+        return price_entries(oracle.resolve(wanted))
@@ -0,0 +1,41 @@
+import time
+from threading import Event, Lock
+from typing import Optional
+
+from bean_fetch.data import Cancelled
+
+
+class TokenBucket:
+    """thread-safe token bucket that allows `rate` acquisitions per second on average, and bursts
+    of up to `burst`. once `cancel` is set, acquiring raises `Cancelled`"""
+    def __init__(self, rate: float, burst: int, cancel: Optional[Event] = None):
+        self.rate = rate
+        self.burst = burst
+        self.cancel = cancel
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self) -> None:
+        """blocks until a token is available"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # reserve a token even if the bucket is empty, callers then wait their turn in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        sleep(wait, self.cancel)
+
+
+def sleep(seconds: float, cancel: Optional[Event] = None) -> None:
+    """sleeps for `seconds`, raising `Cancelled` as soon as `cancel` is set"""
+    if cancel is None:
+        time.sleep(max(seconds, 0.0))
+    elif cancel.wait(max(seconds, 0.0)):
+        raise Cancelled()
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """seconds to wait before retry number `attempt` (starting from 0)"""
+    return min(cap, base * (1 << attempt))
@@ -0,0 +1,71 @@
+import json
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# --- constants ---
+
+# name of the directory (relative to the archive) where venues persist state between runs
+STATE_DIR = ".state"
+
+# name of the directory (relative to the archive) for data that can be rebuilt from the archive
+CACHE_DIR = ".cache"
+
+# --- io ---
+
+
+def load(path: Path) -> Dict[str, Any]:
+    """reads the json state stored at `path`, returns an empty dict if there is none"""
+    if not path.is_file():
+        return {}
+    state: Dict[str, Any] = json.loads(path.read_text())
+    return state
+
+
+def save(path: Path, state: Dict[str, Any]) -> None:
+    """atomically replaces the json state stored at `path`"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(state, indent=4, sort_keys=True))
+    os.replace(tmp, path)
+
+
+# --- reported balances ---
+
+
+class Reported:
+    """the balance of every currency that a venue reported while fetching. they are recorded in
+    `<venue>-balances.json`, once the records fetched alongside them have been archived, so the
+    ledger can be reconciled against them"""
+    def __init__(self, state_dir: Optional[Path], venue: str):
+        self.path = state_dir / f"{venue}-balances.json" if state_dir else None
+        self.time: Optional[datetime] = None
+        self.balances: Dict[str, Decimal] = {}
+
+    def report(self, balances: Iterable[Tuple[str, Decimal]]) -> None:
+        """records the (currency, balance) of every account, balances of accounts with the same
+        currency are summed"""
+        self.time = datetime.now(timezone.utc)
+        self.balances = {}
+        for currency, balance in balances:
+            self.balances[currency] = self.balances.get(currency, Decimal(0)) + balance
+
+    def save(self) -> None:
+        if self.path and self.time:
+            save(self.path, {
+                "time": self.time.isoformat(),
+                "balances": {c: str(b) for c, b in self.balances.items()},
+            })
+
+    @staticmethod
+    def load(state_dir: Path, venue: str) -> Optional["Reported"]:
+        """the balances reported on the last fetch of `venue`, if any"""
+        reported = Reported(state_dir, venue)
+        stored = load(reported.path) if reported.path else {}
+        if not stored:
+            return None
+        reported.time = datetime.fromisoformat(stored["time"])
+        reported.balances = {c: Decimal(b) for c, b in stored["balances"].items()}
+        return reported
@@ -0,0 +1,125 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+# --- constants ---
+
+# scope for metrics that do not belong to a single venue
+TOTAL = "total"
+
+# --- stats ---
+
+# scope -> name -> value
+Table = Dict[str, Dict[str, float]]
+
+
+class Stats:
+    """thread-safe wall time and counters, grouped by scope (usually a venue). `timed` blocks
+    for the stage named `profile` are also run under cProfile"""
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.times: Table = {}
+        self.counts: Table = {}
+        self.profile: Optional[str] = None
+        self.profiles: List[cProfile.Profile] = []
+
+    def add(self, scope: str, name: str, n: float = 1) -> None:
+        with self.lock:
+            counts = self.counts.setdefault(scope, {})
+            counts[name] = counts.get(name, 0) + n
+
+    def add_time(self, scope: str, stage: str, seconds: float) -> None:
+        with self.lock:
+            times = self.times.setdefault(scope, {})
+            times[stage] = times.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, scope: str, stage: str) -> Iterator[None]:
+        profiler = cProfile.Profile() if stage == self.profile else None
+        start = time.perf_counter()
+        if profiler:
+            try:
+                profiler.enable()
+            except ValueError:
+                # only one profiler can be active at a time (e.g. with concurrent venues)
+                profiler = None
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                with self.lock:
+                    self.profiles.append(profiler)
+            self.add_time(scope, stage, time.perf_counter() - start)
+
+    def track(self, session: requests.Session, scope: str) -> None:
+        """counts the requests sent through `session`, the bytes received and the time spent
+        waiting for responses"""
+        def hook(r: requests.Response, *args: Any, **kwargs: Any) -> None:
+            self.add(scope, "requests")
+            self.add(scope, "bytes_received", len(r.content))
+            self.add_time(scope, "http", r.elapsed.total_seconds())
+
+        session.hooks["response"].append(hook)
+
+    # --- merging ---
+
+    def snapshot(self) -> Dict[str, Table]:
+        with self.lock:
+            return {
+                "times": {s: dict(t) for s, t in self.times.items()},
+                "counts": {s: dict(c) for s, c in self.counts.items()},
+            }
+
+    def merge(self, snapshot: Dict[str, Table]) -> None:
+        """adds the metrics collected elsewhere (e.g. in a worker process)"""
+        for scope, times in snapshot["times"].items():
+            for stage, seconds in times.items():
+                self.add_time(scope, stage, seconds)
+        for scope, counts in snapshot["counts"].items():
+            for name, n in counts.items():
+                self.add(scope, name, n)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.times, self.counts, self.profiles = {}, {}, []
+
+    # --- output ---
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=4, sort_keys=True)
+
+    def format(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for scope in sorted(set(snapshot["times"]) | set(snapshot["counts"])):
+            lines.append(f"{scope}:")
+            for stage, seconds in sorted(snapshot["times"].get(scope, {}).items()):
+                lines.append(f"    {stage + ' time':<28} {seconds:>12.3f}s")
+            for name, n in sorted(snapshot["counts"].get(scope, {}).items()):
+                lines.append(f"    {name:<28} {n:>12,.0f}")
+        return "\n".join(lines)
+
+    def dump_profile(self, path: Optional[str] = None, limit: int = 30) -> str:
+        """writes the combined profile of every profiled block to `path`, or returns the `limit`
+        most expensive functions (by cumulative time) if no path is given"""
+        if not self.profiles:
+            return f"no `{self.profile}` stage was profiled"
+        out = io.StringIO()
+        stats = pstats.Stats(*self.profiles, stream=out)
+        if path:
+            stats.dump_stats(path)
+            return f"wrote `{self.profile}` profile to {path}"
+        stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+# metrics for the current process
+STATS = Stats()
@@ -1,18 +1,51 @@
-from typing import List, Mapping
+from decimal import Decimal
+from pathlib import Path
+from threading import Event
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
 from enum import Enum
 
-import jsonpickle
 from pydantic.dataclasses import dataclass
 from beancount.core.data import Transaction
 from coinbase.wallet.client import Client
+from coinbase.wallet.error import (InternalServerError, RateLimitExceededError,
+                                   ServiceUnavailableError)
 import coinbase.wallet.model as cb
 
-from bean_fetch.data import RawTx, VenueLike
+import bean_fetch.state as state
+from bean_fetch.data import RawTx, Stream, VenueLike
+from bean_fetch.encoding import dumps
+from bean_fetch.pool import imap
+from bean_fetch.ratelimit import TokenBucket, backoff, sleep
+from bean_fetch.state import Reported
+from bean_fetch.stats import STATS
 
 # --- constants ---
 
 VENUE = "coinbase"
 
+# https://developers.coinbase.com/api/v2#rate-limiting: 10,000 requests per hour per api key
+RATE_LIMIT = 10000 / 3600
+BURST = 10
+
+# largest page size accepted by list endpoints
+PAGE_SIZE = 100
+
+# name of the file (in the state dir) that records, per listing, the newest record that every
+# older record is final up to
+CURSORS = "coinbase.json"
+
+# statuses of records that no longer change
+FINAL_STATUSES = ("completed", "canceled")
+
+RETRY_ERRORS = (RateLimitExceededError, InternalServerError, ServiceUnavailableError)
+MAX_RETRIES = 5
+
+# bump whenever `Venue.parse` changes its output, to invalidate cached parse results
+PARSER_VERSION = 1
+
+# config fields that `Venue.parse` depends on, changing any other field keeps cached results
+PARSE_FIELDS = ("assets_prefix", "expenses_prefix", "payment_methods")
+
 
 class Kind(str, Enum):
     BUY = "buy"
@@ -31,22 +64,37 @@ class Config:
     assets_prefix: str
     expenses_prefix: str
     payment_methods: Mapping[str, str]
+    concurrency: int = 4
+    rate_limit: float = RATE_LIMIT
+    api_url: Optional[str] = None
+    state_dir: Optional[Path] = None
 
 
 # --- venue ---
 
 Raw = RawTx[Kind]
 
+# account method listing the records of each kind
+ENDPOINTS = {
+    Kind.BUY: "get_buys",
+    Kind.SELL: "get_sells",
+    Kind.DEPOSIT: "get_deposits",
+    Kind.WITHDRAWAL: "get_withdrawals",
+}
+
 
 class Venue(VenueLike[Config, Kind]):
     @staticmethod
-    def fetch(config: Config) -> List[Raw]:
-        client = Client(config.api_key, config.api_secret)
-        accounts = client.get_accounts().data
+    def fetch(config: Config, cancel: Optional[Event] = None) -> Stream[Kind]:
+        cursors = Cursors(config.state_dir / CURSORS if config.state_dir else None)
+        reported = Reported(config.state_dir, VENUE)
+
+        def commit() -> None:
+            cursors.save()
+            reported.save()
 
-        return list(
-            Fetch.buys(accounts) + Fetch.sells(accounts) +
-            Fetch.deposits(accounts) + Fetch.withdrawals(accounts))
+        client, bucket = Fetch.connect(config, cancel)
+        return Stream(Fetch.all(config, client, bucket, cursors, reported), commit)
 
     @staticmethod
     def handles(tx: Raw) -> bool:
@@ -66,39 +114,122 @@ class Venue(VenueLike[Config, Kind]):
         return dispatcher[tx.kind](tx)
 
 
+# --- cursors ---
+
+
+class Cursors:
+    """tracks, for each (account, kind) listing, the newest record that it and every older record
+    of the listing have a final status. later runs list them oldest first, starting after it, so
+    records that were still pending are fetched again until they complete or are canceled"""
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        stored = state.load(path) if path else {}
+        self.listings: Dict[str, str] = dict(stored.get("listings", {}))
+
+    @staticmethod
+    def key(acct: cb.Account, kind: Kind) -> str:
+        return f"{acct.id}/{kind.value}"
+
+    def advance(self, acct: cb.Account, kind: Kind, objs: List[cb.APIObject]) -> None:
+        """moves the cursor of a listing over the final records at the start of `objs`, which
+        were listed oldest first after it"""
+        for obj in objs:
+            if getattr(obj, "status", None) not in FINAL_STATUSES:
+                break
+            self.listings[Cursors.key(acct, kind)] = obj.id
+
+    def save(self) -> None:
+        if self.path:
+            state.save(self.path, {"listings": self.listings})
+
+
 # --- fetcher ---
 
 
 class Fetch:
     @staticmethod
-    def buys(accounts: List[cb.Account]) -> List[Raw]:
-        out: List[Raw] = []
-        for acct in accounts:
-            out += Fetch.transform(acct.get_buys().data, acct, Kind.BUY)
-        return out
+    def connect(config: Config,
+                cancel: Optional[Event] = None) -> Tuple[Client, TokenBucket]:
+        """an api client, and the rate limit shared by every request sent through it. once
+        `cancel` is set, requests (and the waits between them) raise `Cancelled`"""
+        client = Client(config.api_key, config.api_secret, base_api_uri=config.api_url)
+        STATS.track(client.session, VENUE)
+        return client, TokenBucket(config.rate_limit, BURST, cancel)
+
+    @staticmethod
+    def all(config: Config,
+            client: Client,
+            bucket: TokenBucket,
+            cursors: Cursors,
+            reported: Optional[Reported] = None) -> Iterator[Raw]:
+        """yields the buys, sells, deposits and withdrawals of every account that are newer than
+        `cursors`. the account balances are recorded on `reported`"""
+        yield from Fetch.records(config, bucket, Fetch.accounts(client, bucket, reported),
+                                 cursors)
+
+    @staticmethod
+    def accounts(client: Client,
+                 bucket: TokenBucket,
+                 reported: Optional[Reported] = None) -> List[cb.Account]:
+        """lists every account, recording their balances on `reported`"""
+        accounts: List[cb.Account] = list(Fetch.pages(bucket, client.get_accounts))
+        if reported is not None:
+            reported.report((a.balance.currency, Decimal(a.balance.amount)) for a in accounts
+                            if getattr(a, "balance", None))
+        return accounts
+
+    @staticmethod
+    def records(config: Config, bucket: TokenBucket, accounts: List[cb.Account],
+                cursors: Cursors) -> Iterator[Raw]:
+        """yields the records of every (account, kind) listing that are newer than its cursor.
+        cursors are advanced past final records as they are yielded, but only saved when the
+        stream is committed"""
+        # every (account, kind) listing is paginated on its own worker, all workers share the
+        # rate limit. listings are yielded in order as soon as they are complete
+        jobs = [(acct, kind, cursors.listings.get(Cursors.key(acct, kind))) for acct in accounts
+                for kind in Kind]
+        for acct, kind, objs in imap(lambda j: Fetch.listing(bucket, *j), jobs,
+                                     config.concurrency):
+            yield from Fetch.transform(objs, acct, kind)
+            cursors.advance(acct, kind, objs)
 
     @staticmethod
-    def sells(accounts: List[cb.Account]) -> List[Raw]:
-        out: List[Raw] = []
-        for acct in accounts:
-            out += Fetch.transform(acct.get_sells().data, acct, Kind.SELL)
-        return out
+    def listing(bucket: TokenBucket, acct: cb.Account, kind: Kind,
+                after: Optional[str]) -> Tuple[cb.Account, Kind, List[cb.APIObject]]:
+        return acct, kind, list(Fetch.pages(bucket, getattr(acct, ENDPOINTS[kind]), after))
 
     @staticmethod
-    def deposits(accounts: List[cb.Account]) -> List[Raw]:
-        out: List[Raw] = []
-        for acct in accounts:
-            out += Fetch.transform(acct.get_deposits().data, acct,
-                                   Kind.DEPOSIT)
-        return out
+    def pages(bucket: TokenBucket,
+              get: Callable[..., cb.APIObject],
+              after: Optional[str] = None) -> Iterator[Any]:
+        """yields the records on every page of a list endpoint, oldest first, starting after the
+        record with id `after` and following the `next_starting_after` cursor"""
+        params: Mapping[str, Any] = {"limit": PAGE_SIZE, "order": "asc"}
+        while True:
+            if after:
+                params = {**params, "starting_after": after}
+            page = Fetch.request(bucket, get, **params)
+            yield from page.data
+            after = page.pagination and page.pagination.next_starting_after
+            if not after:
+                break
 
     @staticmethod
-    def withdrawals(accounts: List[cb.Account]) -> List[Raw]:
-        out: List[Raw] = []
-        for acct in accounts:
-            out += Fetch.transform(acct.get_withdrawals().data, acct,
-                                   Kind.WITHDRAWAL)
-        return out
+    def request(bucket: TokenBucket, get: Callable[..., cb.APIObject],
+                **params: Any) -> cb.APIObject:
+        """sends a rate limited request, retrying with exponential backoff on rate limit and
+        server errors"""
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                return get(**params)
+            except RETRY_ERRORS:
+                if attempt == MAX_RETRIES:
+                    raise
+                STATS.add(VENUE, "retries")
+                sleep(backoff(attempt), bucket.cancel)
+                attempt += 1
 
     @staticmethod
     def transform(objs: List[cb.APIObject], acct: cb.Account,
@@ -111,7 +242,7 @@ class Fetch:
                     kind=kind,
                     timestamp=obj.created_at,
                     meta={"account_id": acct.id},
-                    raw=jsonpickle.encode(obj, unpicklable=False),
+                    raw=dumps(obj),
                 ))
         return txs
 
@@ -0,0 +1,48 @@
+from pathlib import Path
+from typing import Any, Dict
+
+from bean_fetch.archive import FileArchive, load
+from bean_fetch.dedup import HashIndex
+from bean_fetch.state import load as load_state
+from bean_fetch.venues.coinbase import CURSORS, Config, Venue
+from bean_fetch.writer import Writer
+from bench.servers import CoinbaseServer
+
+
+def fetch(tmp_path: Path, config: Config) -> Dict[str, Any]:
+    """fetches into the archive under `tmp_path`, returns the archived deposits by id"""
+    archive = FileArchive(tmp_path / "archive")
+    index = HashIndex(tmp_path / "index", archive)
+    Writer(archive, index).consume(Venue.fetch(config))
+    index.close()
+    records = (load(data).raw for _, data in archive.items())
+    return {r["id"]: r for r in records if r["resource"] == "deposit"}
+
+
+def test_pending_records_are_fetched_until_final(tmp_path: Path) -> None:
+    server = CoinbaseServer(accounts=1, records=3)
+    config = Config(api_key="k",
+                    api_secret="s",
+                    assets_prefix="Assets:Coinbase",
+                    expenses_prefix="Expenses:Coinbase",
+                    payment_methods={},
+                    api_url=server.url,
+                    state_dir=tmp_path / "state")
+    try:
+        server.statuses["wallet-0-deposits-1"] = "pending"
+        deposits = fetch(tmp_path, config)
+        assert len(deposits) == 3
+        assert deposits["wallet-0-deposits-1"]["status"] == "pending"
+        # the cursor stops before the pending deposit
+        cursors = load_state(tmp_path / "state" / CURSORS)["listings"]
+        assert cursors["wallet-0/deposit"] == "wallet-0-deposits-0"
+        assert cursors["wallet-0/buy"] == "wallet-0-buys-2"
+
+        server.statuses["wallet-0-deposits-1"] = "completed"
+        deposits = fetch(tmp_path, config)
+        assert len(deposits) == 3
+        assert deposits["wallet-0-deposits-1"]["status"] == "completed"
+        cursors = load_state(tmp_path / "state" / CURSORS)["listings"]
+        assert cursors["wallet-0/deposit"] == "wallet-0-deposits-2"
+    finally:
+        server.stop()
@@ -3,10 +3,37 @@ import hashlib
 import time
 import requests
 import base64
-from typing import Dict, Any, Optional, Generator
+from threading import Event
+from typing import (Callable, Dict, Any, Iterable, Iterator, Mapping, Optional, Generator,
+                    Tuple)
 
+from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
 
+from bean_fetch.pool import istream
+from bean_fetch.ratelimit import TokenBucket, backoff, sleep
+from bean_fetch.stats import STATS
+from .data import VENUE
+
+# --- constants ---
+
+# https://docs.pro.coinbase.com/#rate-limits: 5 requests per second per profile on private
+# endpoints, with bursts of up to 10
+RATE_LIMIT = 5.0
+BURST = 10
+
+# public endpoints (products, candles) are limited separately: 3 requests per second per ip, with
+# bursts of up to 6
+PUBLIC_RATE_LIMIT = 3.0
+PUBLIC_BURST = 6
+
+# entries (of a product's fills or an account's ledger) fetched ahead of the consumer, per worker
+STREAM_BUFFER = 1000
+
+# responses that are worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+
 
 class CBProAuth(AuthBase):
     # Provided by CBPro: https://docs.pro.coinbase.com/#signing-a-message
@@ -53,17 +80,52 @@ class Client:
         b64secret: str,
         passphrase: str,
         api_url: str = "https://api.pro.coinbase.com",
+        concurrency: int = 4,
+        rate_limit: float = RATE_LIMIT,
+        burst: int = BURST,
+        public_rate_limit: float = PUBLIC_RATE_LIMIT,
+        public_burst: int = PUBLIC_BURST,
+        cancel: Optional[Event] = None,
     ):
         self.url = api_url.rstrip("/")
-        self.auth = CBProAuth(key, b64secret, passphrase)
+        # public endpoints (e.g. candles) can be used without credentials
+        self.auth = CBProAuth(key, b64secret, passphrase) if key else None
+        self.concurrency = concurrency
+        # once `cancel` is set, requests (and the waits between them) raise `Cancelled`
+        self.cancel = cancel
+        self.bucket = TokenBucket(rate_limit, burst, cancel)
+        self.public = TokenBucket(public_rate_limit, public_burst, cancel)
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(concurrency, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        STATS.track(self.session, VENUE)
 
     def get_products(self) -> Any:
-        return self._send_message("get", "/products")
+        return self._send_message("get", "/products", public=True)
 
     def get_accounts(self) -> Any:
         return self._send_message("get", "/accounts/")
 
+    def get_product_historic_rates(self,
+                                   product_id: str,
+                                   start: Optional[str] = None,
+                                   end: Optional[str] = None,
+                                   granularity: Optional[int] = None) -> Any:
+        """[time, low, high, open, close, volume] candles, newest first. at most 300 candles are
+        returned per request"""
+        params: Dict[str, Any] = {}
+        if start is not None:
+            params["start"] = start
+        if end is not None:
+            params["end"] = end
+        if granularity is not None:
+            params["granularity"] = granularity
+        return self._send_message("get",
+                                  f"/products/{product_id}/candles",
+                                  params=params,
+                                  public=True)
+
     def get_fills(self,
                   product_id: Optional[str] = None,
                   order_id: Optional[str] = None,
@@ -85,20 +147,70 @@ class Client:
         endpoint = "/accounts/{}/ledger".format(account_id)
         return self._send_paginated_message(endpoint, params=kwargs)
 
+    def get_fills_by_product(
+            self,
+            product_ids: Iterable[str],
+            before: Optional[Mapping[str, Any]] = None) -> Iterator[Tuple[str, Iterator[Any]]]:
+        """fetches the fills for several products at once, yields (product id, fills) pairs in
+        the order of `product_ids`. products with a cursor in `before` only get newer fills"""
+        return self._parallel(lambda p, **kw: self.get_fills(product_id=p, **kw), product_ids,
+                              before or {})
+
+    def get_account_histories(
+            self,
+            account_ids: Iterable[str],
+            before: Optional[Mapping[str, Any]] = None) -> Iterator[Tuple[str, Iterator[Any]]]:
+        """fetches the ledgers of several accounts at once, yields (account id, entries) pairs
+        in the order of `account_ids`. accounts with a cursor in `before` only get newer entries"""
+        return self._parallel(self.get_account_history, account_ids, before or {})
+
+    def _parallel(self, stream: Callable[..., Iterable[Any]], keys: Iterable[str],
+                  before: Mapping[str, Any]) -> Iterator[Tuple[str, Iterator[Any]]]:
+        """streams every key on its own worker, each buffering at most `STREAM_BUFFER` entries
+        ahead of the consumer. the entries of a key have to be consumed before the next key"""
+        def fetch(k: str) -> Iterable[Any]:
+            if k in before:
+                return stream(k, before=before[k])
+            return stream(k)
+
+        return istream(fetch, keys, self.concurrency, STREAM_BUFFER)
+
+    def _request(self,
+                 method: str,
+                 url: str,
+                 public: bool = False,
+                 **kwargs: Any) -> requests.Response:
+        """sends a request, limited by the public or private rate limit, retrying with exponential
+        backoff on 429s, 5xxs and connection errors"""
+        bucket = self.public if public else self.bucket
+        for attempt in range(MAX_RETRIES + 1):
+            bucket.acquire()
+            try:
+                r = self.session.request(method, url, auth=self.auth, timeout=30, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAX_RETRIES:
+                    raise
+                STATS.add(VENUE, "retries")
+                sleep(backoff(attempt), self.cancel)
+                continue
+            if r.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                break
+            STATS.add(VENUE, "retries")
+            retry_after = r.headers.get("Retry-After", "")
+            sleep(float(retry_after) if retry_after.isdigit() else backoff(attempt), self.cancel)
+        r.raise_for_status()
+        return r
+
     def _send_message(
         self,
         method: str,
         endpoint: str,
         params: Optional[Dict[Any, Any]] = None,
         data: Optional[bytes] = None,
+        public: bool = False,
     ) -> Any:
         url = self.url + endpoint
-        r = self.session.request(method,
-                                 url,
-                                 params=params,
-                                 data=data,
-                                 auth=self.auth,
-                                 timeout=30)
+        r = self._request(method, url, public, params=params, data=data)
         return r.json()
 
     def _send_paginated_message(
@@ -106,23 +218,17 @@ class Client:
             endpoint: str,
             params: Optional[Dict[Any,
                                   Any]] = None) -> Generator[Any, None, None]:
-        if params is None:
-            params = dict()
+        params = dict(params or {})
         url = self.url + endpoint
+        # without `before` pages are walked from the newest entry backwards, following the
+        # `cb-after` header. with `before` they are walked from the cursor forwards, following the
+        # `cb-before` header until a page comes back empty
+        cursor = "after" if params.get("before") is None else "before"
         while True:
-            r = self.session.get(url,
-                                 params=params,
-                                 auth=self.auth,
-                                 timeout=30)
+            r = self._request("get", url, params=params)
             results = r.json()
             for result in results:
                 yield result
-            # If there are no more pages, we're done. Otherwise update `after`
-            # param to get next page.
-            # If this request included `before` don't get any more pages - the
-            # cbpro API doesn't support multiple pages in that case.
-            if not r.headers.get("cb-after") or params.get(
-                    "before") is not None:
+            if not results or not r.headers.get(f"cb-{cursor}"):
                 break
-            else:
-                params["after"] = r.headers["cb-after"]
+            params[cursor] = r.headers[f"cb-{cursor}"]
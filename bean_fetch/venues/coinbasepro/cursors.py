@@ -0,0 +1,31 @@
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+import bean_fetch.state as state
+
+
+class Cursors:
+    """tracks the newest fill (per product) and ledger entry (per account) that has been fetched,
+    so later runs only request entries newer than these with the api's `before` parameter. also
+    remembers the products that show up in the ledgers, which are the only ones with fills"""
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        stored = state.load(path) if path else {}
+        self.fills: Dict[str, int] = dict(stored.get("fills", {}))
+        self.ledgers: Dict[str, int] = dict(stored.get("ledgers", {}))
+        self.products: Set[str] = set(stored.get("products", []))
+
+    @staticmethod
+    def advance(cursors: Dict[str, int], key: str, ids: Iterable[int]) -> None:
+        """moves the cursor for `key` to the newest of `ids`, never backwards"""
+        newest = max(ids, default=None)
+        if newest is not None and newest > cursors.get(key, -1):
+            cursors[key] = newest
+
+    def save(self) -> None:
+        if self.path:
+            state.save(self.path, {
+                "fills": self.fills,
+                "ledgers": self.ledgers,
+                "products": sorted(self.products),
+            })
@@ -1,5 +1,7 @@
 from enum import Enum
 from datetime import datetime
+from pathlib import Path
+from typing import Optional
 
 from pydantic.dataclasses import dataclass
 from beancount.core.amount import Decimal
@@ -12,12 +14,27 @@ class Config:
     api_key: str
     api_secret: str
     api_passphrase: str
+    concurrency: int = 4
+    rate_limit: float = 5.0
+    scan_all_products: bool = False
+    api_url: str = "https://api.pro.coinbase.com"
+    state_dir: Optional[Path] = None
 
 
 # --- dispatch ---
 
 VENUE = "coinbasepro"
 
+# bump whenever `Venue.parse` changes its output, to invalidate cached parse results
+PARSER_VERSION = 1
+
+# config fields that `Venue.parse` depends on, changing any other field keeps cached results
+PARSE_FIELDS = ()
+
+
+# ledger entry types that belong to a trade, their details name the traded product
+TRADE_ENTRIES = ("match", "fee")
+
 
 class Kind(str, Enum):
     FILL = "FILL"
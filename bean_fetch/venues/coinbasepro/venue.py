@@ -1,26 +1,35 @@
-from typing import List
+from threading import Event
+from typing import Iterator, List, Optional
 
-import jsonpickle
 from beancount.core.data import Transaction
 
-from bean_fetch.data import RawTx, VenueLike
-from .data import Config, Kind, VENUE, Product, Account, Fill
+from bean_fetch.data import RawTx, Stream, VenueLike
+from bean_fetch.encoding import dumps
+from bean_fetch.state import Reported
+from .data import (Config, Kind, VENUE, PARSER_VERSION, PARSE_FIELDS, TRADE_ENTRIES, Product,
+                   Account, Fill)
 from .client import Client
+from .cursors import Cursors
 
 # --- venue ---
 
 Raw = RawTx[Kind]
 
+# name of the file (in the state dir) that records the newest fetched fill / ledger entry
+CURSORS = "coinbasepro.json"
+
 
 class Venue(VenueLike[Config, Kind]):
     @staticmethod
-    def fetch(config: Config) -> List[Raw]:
-        client = Client(config.api_key, config.api_secret,
-                        config.api_passphrase)
-        products = [Product(**p) for p in client.get_products()]
-        accounts = [Account(**a) for a in client.get_accounts()]
-        return Fetch.fills(client, products) + Fetch.transfers(
-            client, accounts)
+    def fetch(config: Config, cancel: Optional[Event] = None) -> Stream[Kind]:
+        cursors = Cursors(config.state_dir / CURSORS if config.state_dir else None)
+        reported = Reported(config.state_dir, VENUE)
+
+        def commit() -> None:
+            cursors.save()
+            reported.save()
+
+        return Stream(Fetch.all(config, cursors, Fetch.client(config, cancel), reported), commit)
 
     @staticmethod
     def handles(tx: Raw) -> bool:
@@ -36,39 +45,75 @@ class Venue(VenueLike[Config, Kind]):
 
 class Fetch:
     @staticmethod
-    def fills(client: Client, products: List[Product]) -> List[Raw]:
-        out: List[Raw] = []
-        for p in products:
-            fs = [Fill(**f) for f in client.get_fills(product_id=p.id)]
-            out += [
-                Raw(
+    def client(config: Config, cancel: Optional[Event] = None) -> Client:
+        return Client(config.api_key,
+                      config.api_secret,
+                      config.api_passphrase,
+                      api_url=config.api_url,
+                      concurrency=config.concurrency,
+                      rate_limit=config.rate_limit,
+                      cancel=cancel)
+
+    @staticmethod
+    def all(config: Config,
+            cursors: Cursors,
+            client: Optional[Client] = None,
+            reported: Optional[Reported] = None) -> Iterator[Raw]:
+        """yields the transfers and fills newer than `cursors`. cursors are advanced as records
+        are yielded, but only saved when the stream is committed. `client` can be passed in to
+        reuse its connections across fetches. the account balances are recorded on `reported`.
+
+        ledgers are fetched first, so fills are only requested for products that were traded
+        (unless `scan_all_products` is set)"""
+        client = client or Fetch.client(config)
+        accounts = [Account(**a) for a in client.get_accounts()]
+        if reported is not None:
+            reported.report((a.currency, a.balance) for a in accounts)
+        yield from Fetch.transfers(client, accounts, cursors)
+
+        products = set(cursors.products)
+        if config.scan_all_products:
+            products |= {Product(**p).id for p in client.get_products()}
+        yield from Fetch.fills(client, sorted(products), cursors)
+
+    @staticmethod
+    def fills(client: Client, products: List[str], cursors: Cursors) -> Iterator[Raw]:
+        for id, fills in client.get_fills_by_product(products, cursors.fills):
+            # without a cursor fills are listed newest first, so the cursor only moves once the
+            # product is complete
+            newest = -1
+            for f in fills:
+                newest = max(newest, int(f["trade_id"]))
+                fill = Fill(**f)
+                yield Raw(
                     venue=VENUE,
                     kind=Kind.FILL,
-                    timestamp=f.created_at,
-                    raw=jsonpickle.encode(f, unpicklable=False),
+                    timestamp=fill.created_at,
+                    raw=dumps(fill),
                     meta=None,
-                ) for f in fs
-            ]
-        return out
+                )
+            Cursors.advance(cursors.fills, id, [newest])
 
     @staticmethod
-    def transfers(c: Client, accounts: List[Account]) -> List[Raw]:
-        out: List[Raw] = []
-        for a in accounts:
-            transfers = [
-                x for x in c.get_account_history(a.id)
-                if x["type"] == "transfer"
-            ]
-            out += [
-                Raw(
+    def transfers(c: Client, accounts: List[Account], cursors: Cursors) -> Iterator[Raw]:
+        by_id = {a.id: a for a in accounts}
+        for id, entries in c.get_account_histories((a.id for a in accounts), cursors.ledgers):
+            a = by_id[id]
+            newest = -1
+            for t in entries:
+                newest = max(newest, int(t["id"]))
+                if t["type"] in TRADE_ENTRIES and "product_id" in t["details"]:
+                    cursors.products.add(t["details"]["product_id"])
+                if t["type"] != "transfer":
+                    continue
+                yield Raw(
                     venue=VENUE,
                     kind=Kind(t["details"]["transfer_type"]),
                     timestamp=t["created_at"],
-                    raw=jsonpickle.encode(t, unpicklable=False),
+                    raw=dumps(t),
                     meta={
                         "account_id": a.id,
                         "currency": a.currency
                     },
-                ) for t in transfers
-            ]
-        return out
+                )
+            Cursors.advance(cursors.ledgers, id, [newest])
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from types import TracebackType
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from bean_fetch.pool import chunked
+from bean_fetch.stats import STATS
+from .data import VENUE
+
+# name of the block cache (in the cache dir)
+BLOCK_CACHE = "ethereum.sqlite"
+
+# blocks at least this far below the head are considered final, only final data is cached
+CONFIRMATIONS = 64
+
+# keys looked up per query, below sqlite's default limit of 999 parameters per statement
+MAX_PARAMS = 900
+
+# once the cache outgrows its cap, least recently used rows are evicted down to this fraction of
+# it, so that eviction does not run on every insert
+EVICT_TO = 0.9
+
+
+class BlockCache:
+    """on-disk lru cache of json-rpc data, shared by every scan regardless of its addresses. keeps
+    block headers with compacted tx summaries (hash, from, to), which is all that matching needs,
+    and the full tx and receipt of every matched tx. rows are evicted least recently used first
+    once the stored json outgrows `max_bytes`. safe to use from several threads"""
+    def __init__(self, path: Path, max_bytes: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = Lock()
+        self.max_bytes = max_bytes
+        # lets eviction return free pages to the file system (only applies to new caches)
+        self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS blocks (number INTEGER PRIMARY KEY, "
+                        "block TEXT NOT NULL, size INTEGER NOT NULL, used INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS txs (hash TEXT PRIMARY KEY, "
+                        "tx TEXT NOT NULL, receipt TEXT NOT NULL, size INTEGER NOT NULL, "
+                        "used INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS txs_used ON txs (used)")
+        self.size, self.clock = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) FROM "
+            "(SELECT size, used FROM blocks UNION ALL SELECT size, used FROM txs)").fetchone()
+        # the cap may have been lowered since the last run
+        if self.size > self.max_bytes:
+            self.evict()
+            self.db.commit()
+
+    @staticmethod
+    def compact(block: Any) -> Any:
+        """`block` without the tx fields that matching does not look at"""
+        return {
+            "number": block["number"],
+            "hash": block["hash"],
+            "timestamp": block["timestamp"],
+            "logsBloom": block["logsBloom"],
+            "transactions": [{
+                "hash": tx["hash"],
+                "from": tx["from"],
+                "to": tx["to"],
+                "blockNumber": tx["blockNumber"],
+            } for tx in block["transactions"]],
+        }
+
+    # --- blocks ---
+
+    def blocks(self, numbers: Sequence[int]) -> Dict[int, Any]:
+        """the cached (compacted) blocks among `numbers`"""
+        with self.lock:
+            rows = self.select("SELECT number, block FROM blocks WHERE number IN ({})", numbers)
+            self.touch("blocks", "number", [n for n, _ in rows])
+        STATS.add(VENUE, "block_cache_hits", len(rows))
+        return {n: json.loads(block) for n, block in rows}
+
+    def put_blocks(self, blocks: Iterable[Any], final: int) -> None:
+        """caches the compacted form of the full `blocks` numbered up to `final`"""
+        rows = []
+        for block in blocks:
+            if int(block["number"], 16) <= final:
+                data = json.dumps(self.compact(block), separators=(",", ":"))
+                rows.append((int(block["number"], 16), data, len(data)))
+        with self.lock:
+            self.put("INSERT OR REPLACE INTO blocks (number, block, size, used) "
+                     "VALUES (?, ?, ?, ?)", rows)
+
+    # --- txs ---
+
+    def txs(self, hashes: Sequence[str]) -> Dict[str, Tuple[Any, Any]]:
+        """the cached (full tx, receipt) pairs among `hashes`"""
+        with self.lock:
+            rows = self.select("SELECT hash, tx, receipt FROM txs WHERE hash IN ({})", hashes)
+            self.touch("txs", "hash", [h for h, _, _ in rows])
+        STATS.add(VENUE, "receipt_cache_hits", len(rows))
+        return {h: (json.loads(tx), json.loads(receipt)) for h, tx, receipt in rows}
+
+    def put_txs(self, txs: Iterable[Tuple[Any, Any]], final: int) -> None:
+        """caches the (full tx, receipt) pairs of txs in blocks up to `final`"""
+        rows = []
+        for tx, receipt in txs:
+            if int(tx["blockNumber"], 16) <= final:
+                data = json.dumps(tx, separators=(",", ":"))
+                rec = json.dumps(receipt, separators=(",", ":"))
+                rows.append((tx["hash"], data, rec, len(data) + len(rec)))
+        with self.lock:
+            self.put("INSERT OR REPLACE INTO txs (hash, tx, receipt, size, used) "
+                     "VALUES (?, ?, ?, ?, ?)", rows)
+
+    # --- bookkeeping ---
+
+    @staticmethod
+    def params(values: Sequence[Any]) -> str:
+        return ", ".join("?" * len(values))
+
+    def select(self, sql: str, keys: Sequence[Any]) -> List[Any]:
+        """the rows of `sql` (a query with an `IN ({})` placeholder) for `keys`, looked up
+        `MAX_PARAMS` at a time"""
+        rows: List[Any] = []
+        for part in chunked(keys, MAX_PARAMS):
+            rows += self.db.execute(sql.format(self.params(part)), part).fetchall()
+        return rows
+
+    def touch(self, table: str, column: str, keys: Sequence[Any]) -> None:
+        if not keys:
+            return
+        self.clock += 1
+        for part in chunked(keys, MAX_PARAMS):
+            self.db.execute(f"UPDATE {table} SET used = ? WHERE {column} IN ({self.params(part)})",
+                            [self.clock] + part)
+        self.db.commit()
+
+    def put(self, sql: str, rows: Sequence[Tuple[Any, ...]]) -> None:
+        if not rows:
+            return
+        self.clock += 1
+        # replaced rows are counted twice until the next open, which only makes eviction early
+        self.db.executemany(sql, [row + (self.clock, ) for row in rows])
+        self.size += sum(row[-1] for row in rows)
+        if self.size > self.max_bytes:
+            self.evict()
+        self.db.commit()
+
+    def evict(self) -> None:
+        """drops least recently used blocks and txs until the cache is back under `EVICT_TO` of
+        its cap"""
+        target = self.max_bytes * EVICT_TO
+        while self.size > target:
+            rows = self.db.execute(
+                "SELECT 'blocks', number, size, used FROM blocks UNION ALL "
+                "SELECT 'txs', hash, size, used FROM txs ORDER BY used LIMIT 1000").fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for table, key, size, _ in rows:
+                column = "number" if table == "blocks" else "hash"
+                self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (key, ))
+                self.size -= size
+                STATS.add(VENUE, "cache_evictions")
+                if self.size <= target:
+                    break
+        # commits, and runs the vacuum to completion (`execute` only frees a single page)
+        self.db.executescript("PRAGMA incremental_vacuum;")
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def __enter__(self) -> "BlockCache":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import bean_fetch.state as state
+
+# an inclusive block range
+Range = Tuple[int, int]
+
+# an inclusive block range together with the addresses that still need it scanned
+Segment = Tuple[int, int, FrozenSet[str]]
+
+
+def ranges(stored: List[Any]) -> List[Range]:
+    # checkpoints used to hold a single `[first, last]` range per address
+    if stored and isinstance(stored[0], int):
+        return [(stored[0], stored[1])]
+    return [(lo, hi) for lo, hi in stored]
+
+
+def gaps(scanned: List[Range], start: int, head: int) -> List[Range]:
+    """the parts of `start..head` that are not covered by `scanned`"""
+    out: List[Range] = []
+    for first, last in scanned:
+        if start < first:
+            out.append((start, min(first - 1, head)))
+        start = max(start, last + 1)
+        if start > head:
+            return out
+    return out + [(start, head)] if start <= head else out
+
+
+class Checkpoint:
+    """tracks the (inclusive) block ranges that have been fully scanned for each address, as
+    ordered, disjoint ranges"""
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        stored = state.load(path) if path else {}
+        self.scanned: Dict[str, List[Range]] = {
+            a: ranges(r)
+            for a, r in stored.get("scanned", {}).items()
+        }
+
+    def segments(self, addresses: Iterable[str], start: int, head: int) -> List[Segment]:
+        """splits `start..head` into ordered, disjoint segments, each listing the addresses that
+        have not yet been scanned over it. segments that no address needs are dropped"""
+        needed = {a: gaps(self.scanned.get(a, []), start, head) for a in addresses}
+
+        bounds = sorted({lo for rs in needed.values() for lo, _ in rs}
+                        | {hi + 1 for rs in needed.values() for _, hi in rs})
+
+        out: List[Segment] = []
+        for lo, nxt in zip(bounds, bounds[1:]):
+            active = frozenset(a for a, rs in needed.items()
+                               if any(l <= lo and nxt - 1 <= h for l, h in rs))
+            if not active:
+                continue
+            if out and out[-1][1] == lo - 1 and out[-1][2] == active:
+                out[-1] = (out[-1][0], nxt - 1, active)
+            else:
+                out.append((lo, nxt - 1, active))
+        return out
+
+    def mark(self, addresses: Iterable[str], lo: int, hi: int) -> None:
+        """records that `lo..hi` has been scanned for `addresses`, merging it with the ranges it
+        overlaps or touches"""
+        for a in addresses:
+            merged: List[Range] = []
+            new = (lo, hi)
+            for first, last in self.scanned.get(a, []):
+                if last + 1 < new[0] or new[1] + 1 < first:
+                    merged.append((first, last))
+                else:
+                    new = (min(first, new[0]), max(last, new[1]))
+            self.scanned[a] = sorted(merged + [new])
+
+    def rewind(self, block: int) -> None:
+        """forgets that anything after `block` was scanned, e.g. because those blocks were
+        reorganized away"""
+        for a, scanned in list(self.scanned.items()):
+            kept = [(first, min(last, block)) for first, last in scanned if first <= block]
+            if kept:
+                self.scanned[a] = kept
+            else:
+                del self.scanned[a]
+
+    def save(self) -> None:
+        if self.path:
+            state.save(self.path, {
+                "scanned": {a: [list(r) for r in rs]
+                            for a, rs in self.scanned.items()}
+            })
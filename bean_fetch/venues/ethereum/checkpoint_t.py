@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+
+from bean_fetch.venues.ethereum.checkpoint import Checkpoint
+
+
+def test_raised_start_block() -> None:
+    c = Checkpoint(None)
+    c.mark({"a"}, 0, 100)
+    assert c.segments({"a"}, 500, 1000) == [(500, 1000, frozenset({"a"}))]
+    c.mark({"a"}, 500, 1000)
+    assert c.scanned == {"a": [(0, 100), (500, 1000)]}
+    assert c.segments({"a"}, 500, 1200) == [(1001, 1200, frozenset({"a"}))]
+    assert c.segments({"a"}, 0, 1000) == [(101, 499, frozenset({"a"}))]
+
+
+def test_mark_merges_ranges() -> None:
+    c = Checkpoint(None)
+    c.mark({"a", "b"}, 0, 10)
+    c.mark({"a"}, 20, 30)
+    c.mark({"a", "b"}, 11, 19)
+    assert c.scanned == {"a": [(0, 30)], "b": [(0, 19)]}
+    assert c.segments({"a", "b"}, 0, 40) == [(20, 30, frozenset({"b"})),
+                                             (31, 40, frozenset({"a", "b"}))]
+
+
+def test_rewind() -> None:
+    c = Checkpoint(None)
+    c.mark({"a"}, 0, 10)
+    c.mark({"a"}, 20, 30)
+    c.mark({"b"}, 25, 30)
+    c.rewind(22)
+    assert c.scanned == {"a": [(0, 10), (20, 22)]}
+
+
+def test_save_and_load(tmp_path: Path) -> None:
+    path = tmp_path / "checkpoint.json"
+    c = Checkpoint(path)
+    c.mark({"a"}, 0, 10)
+    c.mark({"a"}, 20, 30)
+    c.save()
+    assert Checkpoint(path).scanned == c.scanned
+
+
+def test_load_single_range(tmp_path: Path) -> None:
+    path = tmp_path / "checkpoint.json"
+    path.write_text(json.dumps({"scanned": {"a": [0, 100]}}))
+    assert Checkpoint(path).scanned == {"a": [(0, 100)]}
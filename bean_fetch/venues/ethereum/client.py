@@ -0,0 +1,99 @@
+from threading import Event
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bean_fetch.data import Cancelled
+from bean_fetch.stats import STATS
+from .data import VENUE
+
+Call = Tuple[str, List[Any]]
+
+# json-rpc error codes of calls that reverted (geth, openethereum). other nodes (and older geth
+# versions) report reverts with a generic code, and are recognized by their message
+REVERT_CODES = {3, -32015}
+
+
+class RPCError(Exception):
+    def __init__(self, method: str, error: Dict[str, Any]):
+        super().__init__(f"{method}: {error.get('message')} (code {error.get('code')})")
+        self.method = method
+        self.code = error.get("code")
+        self.message = error.get("message", "")
+
+
+def reverted(error: Dict[str, Any]) -> bool:
+    """whether a json-rpc error reports that the call reverted, rather than a failure of the node
+    (rate limits, timeouts, missing state...)"""
+    return error.get("code") in REVERT_CODES or "revert" in str(error.get("message", "")).lower()
+
+
+class Client:
+    """minimal json-rpc client that sends batched requests over a pooled keep-alive session. once
+    `cancel` is set, sending raises `Cancelled`"""
+    def __init__(self,
+                 url: str,
+                 pool_size: int = 4,
+                 timeout: int = 30,
+                 cancel: Optional[Event] = None):
+        self.url = url
+        self.timeout = timeout
+        self.cancel = cancel
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        STATS.track(self.session, VENUE)
+
+    def block_number(self) -> int:
+        return int(self.call("eth_blockNumber"), 16)
+
+    def get_blocks(self, numbers: Sequence[int], full_transactions: bool = True) -> List[Any]:
+        return self.batch([("eth_getBlockByNumber", [hex(n), full_transactions])
+                           for n in numbers])
+
+    def get_receipts(self, hashes: Sequence[str]) -> List[Any]:
+        return self.batch([("eth_getTransactionReceipt", [h]) for h in hashes])
+
+    def call(self, method: str, *params: Any) -> Any:
+        return self.batch([(method, list(params))])[0]
+
+    def batch(self, calls: Sequence[Call], strict: bool = True) -> List[Any]:
+        """sends `calls` as a single json-rpc batch and returns the results in request order. if
+        not `strict`, calls that revert (e.g. an `eth_call` of a getter that the contract does
+        not implement) return `None` instead of failing the whole batch. any other error fails
+        it"""
+        if not calls:
+            return []
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled()
+
+        payload: List[Dict[str, Any]] = [{
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": method,
+            "params": params
+        } for i, (method, params) in enumerate(calls)]
+        STATS.add(VENUE, "rpc_calls", len(calls))
+        r = self.session.post(self.url, json=payload, timeout=self.timeout)
+        r.raise_for_status()
+        body = r.json()
+
+        # some nodes reject a whole batch with a single error object
+        if isinstance(body, dict):
+            raise RPCError(calls[0][0], body.get("error") or {"message": str(body)})
+
+        responses = {resp["id"]: resp for resp in body}
+        results: List[Optional[Any]] = []
+        for i, (method, _) in enumerate(calls):
+            resp = responses.get(i)
+            if resp is None:
+                raise RPCError(method, {"message": "missing response in batch"})
+            if "error" in resp:
+                if strict or not reverted(resp["error"]):
+                    raise RPCError(method, resp["error"])
+                results.append(None)
+                continue
+            results.append(resp["result"])
+        return results
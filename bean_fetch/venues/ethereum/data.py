@@ -0,0 +1,94 @@
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import List, Optional
+
+from dataclasses_json import dataclass_json
+from eth_typing import ChecksumAddress
+from pydantic.dataclasses import dataclass
+
+# --- config ---
+
+# ways of finding the plain (log-less) transfers of an address when prefiltering, see `Prefilter`
+TRACE = "trace"  # `trace_filter` queries, exact but needs a node with the trace api
+STATE = "state"  # bisecting over nonces and balances, needs an archive node and can miss txs
+
+
+@dataclass(frozen=True)
+class Config:
+    rpc_url: str
+    addresses: List[ChecksumAddress]
+    start_block: int
+    assets_prefix: str = "Assets:Ethereum"
+    expenses_prefix: str = "Expenses:Ethereum"
+    batch_size: int = 100
+    concurrency: int = 4
+    receipt_batch_size: int = 100
+    block_receipts: bool = False
+    prefilter: bool = False
+    transfer_filter: str = TRACE
+    log_range: int = 2000
+    cache_size: int = 512
+    state_dir: Optional[Path] = None
+    cache_dir: Optional[Path] = None
+
+
+# --- dispatch ---
+
+VENUE = "ethereum"
+
+# bump whenever `Venue.parse` changes its output, to invalidate cached parse results
+PARSER_VERSION = 3
+
+# config fields that `Venue.parse` depends on, changing any other field keeps cached results
+PARSE_FIELDS = ("addresses", "assets_prefix", "expenses_prefix")
+
+
+class Kind(str, Enum):
+    TRANSACTION = "TRANSACTION"
+
+
+# --- data ---
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class LogReceipt:
+    address: ChecksumAddress
+    data: str
+    logIndex: int
+    payload: Optional[str]
+    removed: bool
+    topic: Optional[str]
+    topics: List[str]
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class TxReceipt:
+    contractAddress: Optional[ChecksumAddress]
+    cumulativeGasUsed: int
+    gasUsed: int
+    logs: List[LogReceipt]
+    logsBloom: str
+    root: Optional[str]
+    status: int
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class EthTx:
+    timestamp: datetime
+    blockHash: str
+    blockNumber: int
+    chainId: int
+    data: Optional[bytes]
+    sender: ChecksumAddress
+    receiver: Optional[ChecksumAddress]
+    gas: int
+    gasPrice: int
+    hash: str
+    input: str
+    nonce: int
+    value: int
+    receipt: TxReceipt
@@ -0,0 +1,156 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from eth_utils import keccak
+
+from .data import LogReceipt
+from .tokens import Token
+
+# --- events ---
+
+# (name, abi type, indexed)
+Input = Tuple[str, str, bool]
+
+
+@dataclass(frozen=True)
+class Event:
+    name: str
+    # the token standard (or contract) that emits the event
+    standard: str
+    inputs: Tuple[Input, ...]
+
+    @property
+    def signature(self) -> str:
+        return f"{self.name}({','.join(t for _, t, _ in self.inputs)})"
+
+    @property
+    def topic0(self) -> str:
+        return "0x" + keccak(text=self.signature).hex()
+
+    @property
+    def topics(self) -> int:
+        """the number of topics of a matching log (topic0 plus one per indexed input)"""
+        return 1 + sum(1 for _, _, indexed in self.inputs if indexed)
+
+
+# the events that are decoded. erc20 and erc721 share the `Transfer` and `Approval` signatures,
+# they only differ in whether the last input is indexed
+EVENTS = [
+    Event("Transfer", "erc20", (("from", "address", True), ("to", "address", True),
+                                ("value", "uint256", False))),
+    Event("Transfer", "erc721", (("from", "address", True), ("to", "address", True),
+                                 ("tokenId", "uint256", True))),
+    Event("Approval", "erc20", (("owner", "address", True), ("spender", "address", True),
+                                ("value", "uint256", False))),
+    Event("Approval", "erc721", (("owner", "address", True), ("approved", "address", True),
+                                 ("tokenId", "uint256", True))),
+    Event("ApprovalForAll", "erc721", (("owner", "address", True),
+                                       ("operator", "address", True), ("approved", "bool", False))),
+    Event("TransferSingle", "erc1155", (("operator", "address", True), ("from", "address", True),
+                                        ("to", "address", True), ("id", "uint256", False),
+                                        ("value", "uint256", False))),
+    Event("Deposit", "weth", (("dst", "address", True), ("wad", "uint256", False))),
+    Event("Withdrawal", "weth", (("src", "address", True), ("wad", "uint256", False))),
+]
+
+# (topic0, number of topics) -> event, so that a log is matched with a single lookup
+INDEX: Dict[Tuple[str, int], Event] = {(e.topic0, e.topics): e for e in EVENTS}
+
+# events that move tokens, and so need the metadata of their contract
+TRANSFERS = {"Transfer", "TransferSingle", "Deposit", "Withdrawal"}
+
+# --- decoding ---
+
+
+@dataclass(frozen=True)
+class Decoded:
+    # the contract that emitted the log
+    address: str
+    event: Event
+    args: Dict[str, Any]
+    log_index: int
+
+
+def value(typ: str, word: bytes) -> Any:
+    """decodes a single (static) abi word"""
+    if typ == "address":
+        return "0x" + word[12:].hex()
+    if typ == "bool":
+        return word != bytes(32)
+    return int.from_bytes(word, "big")
+
+
+def decode(log: LogReceipt) -> Optional[Decoded]:
+    """decodes `log` if it was emitted by one of the known `EVENTS`"""
+    if not log.topics or log.removed:
+        return None
+    event = INDEX.get((log.topics[0].lower(), len(log.topics)))
+    if event is None:
+        return None
+
+    topics = [bytes.fromhex(t[2:]) for t in log.topics[1:]]
+    data = bytes.fromhex(log.data[2:]) if log.data else b""
+    words = [data[i:i + 32] for i in range(0, len(data) - 31, 32)]
+    if len(words) < len(event.inputs) + 1 - event.topics:
+        return None
+
+    args: Dict[str, Any] = {}
+    for name, typ, indexed in event.inputs:
+        args[name] = value(typ, topics.pop(0) if indexed else words.pop(0))
+    return Decoded(address=log.address.lower(), event=event, args=args, log_index=log.logIndex)
+
+
+def decode_all(logs: List[LogReceipt]) -> List[Decoded]:
+    return [d for d in map(decode, logs) if d is not None]
+
+
+def token_addresses(logs: Iterable[Mapping[str, Any]]) -> Set[str]:
+    """the contracts that emitted token transfers among the (json-rpc or archived) `logs`. only
+    looks up topic0, without decoding anything"""
+    out: Set[str] = set()
+    for log in logs:
+        topics = log.get("topics") or []
+        event = INDEX.get((topics[0].lower(), len(topics))) if topics else None
+        if event is not None and event.name in TRANSFERS and not log.get("removed", False):
+            out.add(log["address"].lower())
+    return out
+
+
+# --- transfers ---
+
+
+@dataclass(frozen=True)
+class Transfer:
+    token: Token
+    sender: str
+    receiver: str
+    # scaled by the decimals of the token, if it has any
+    amount: Decimal
+    # the id of the transferred nft (erc721 / erc1155)
+    token_id: Optional[int]
+
+
+def transfers(logs: List[Decoded], tokens: Mapping[str, Token]) -> List[Transfer]:
+    """the token movements among `logs`. weth deposits / withdrawals are treated as mints /
+    burns of weth"""
+    out: List[Transfer] = []
+    zero = "0x" + "00" * 20
+    for log in logs:
+        if log.event.name not in TRANSFERS:
+            continue
+        token = tokens.get(log.address) or Token(log.address, None, None, None)
+        args = log.args
+        if log.event.name == "Deposit":
+            sender, receiver, raw, token_id = zero, args["dst"], args["wad"], None
+        elif log.event.name == "Withdrawal":
+            sender, receiver, raw, token_id = args["src"], zero, args["wad"], None
+        elif log.event.standard == "erc721":
+            sender, receiver, raw, token_id = args["from"], args["to"], 1, args["tokenId"]
+        elif log.event.standard == "erc1155":
+            sender, receiver, raw, token_id = args["from"], args["to"], args["value"], args["id"]
+        else:
+            sender, receiver, raw, token_id = args["from"], args["to"], args["value"], None
+        amount = Decimal(raw).scaleb(-token.decimals) if token.decimals else Decimal(raw)
+        out.append(Transfer(token, sender, receiver, amount, token_id))
+    return out
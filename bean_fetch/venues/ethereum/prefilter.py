@@ -0,0 +1,196 @@
+from functools import partial
+from typing import AbstractSet, Any, Dict, List, Optional, Set, Tuple, Union
+
+from eth_utils import keccak
+
+from bean_fetch.pool import chunked, imap
+from .client import Client, RPCError
+from .data import STATE, TRACE
+
+# block number -> hashes of txs in that block that emitted logs mentioning one of our addresses,
+# or whose traces contain calls from or to one of them
+Logged = Dict[int, Set[str]]
+
+# (nonce, balance) of each address at the end of a block
+State = Tuple[Tuple[int, int], ...]
+
+# json-rpc error code of methods that the node does not implement
+METHOD_NOT_FOUND = -32601
+
+# `eth_getLogs` topic filter: per position, any topic (`None`), or one of a list of topics
+Topics = List[Optional[Union[str, List[str]]]]
+
+
+class Prefilter:
+    """finds the blocks that can contain txs relevant to a set of addresses without downloading
+    full blocks.
+
+    logs mentioning an address (as emitter or indexed topic, e.g. either side of an erc20
+    `Transfer`) are found with ranged `eth_getLogs` queries. ranges the node refuses are split, and
+    small ranges that are still refused fall back to testing the `logsBloom` of the block headers.
+
+    plain transfers (which emit no logs) are found with `transfer_filter`:
+
+    - `trace`: ranged `trace_filter` queries for calls from or to an address, including internal
+      calls and zero-value txs. ranges the node refuses are split, and small ranges that are still
+      refused (e.g. by a node without the trace api) are downloaded in full.
+    - `state`: bisecting over the nonce and balance of each address, a range in which neither
+      changed cannot contain a tx sent by, or a value transfer to, an address. this needs an
+      archive node (without one the whole range is kept) and is lossy: txs to an address that do
+      not change its balance (zero-value calls, or a contract receiving ether it forwards within
+      the same range) are missed, unless they also emit a matching log.
+    """
+    @staticmethod
+    def candidates(client: Client,
+                   lo: int,
+                   hi: int,
+                   addresses: AbstractSet[str],
+                   log_range: int,
+                   batch_size: int,
+                   concurrency: int,
+                   transfer_filter: str = TRACE) -> Tuple[List[int], Logged]:
+        """returns the blocks in `lo..hi` that need to be downloaded, and the txs in them that
+        were matched by their logs or traces"""
+        if transfer_filter not in (TRACE, STATE):
+            raise ValueError(f"unknown transfer filter: {transfer_filter}")
+
+        logged: Logged = {}
+        ranges = [(i, min(i + log_range - 1, hi)) for i in range(lo, hi + 1, max(log_range, 1))]
+        query = partial(Prefilter.logs, client, addresses, batch_size)
+        for logs in imap(lambda r: query(*r), ranges, concurrency):
+            for log in logs:
+                if not log.get("removed", False):
+                    block = int(log["blockNumber"], 16)
+                    logged.setdefault(block, set()).add(log["transactionHash"])
+
+        blocks = set(logged)
+        if transfer_filter == STATE:
+            blocks |= set(Prefilter.transfers(client, lo, hi, addresses, batch_size))
+            return sorted(blocks), logged
+
+        trace = partial(Prefilter.traces, client, addresses, batch_size)
+        for traces, untraced in imap(lambda r: trace(*r), ranges, concurrency):
+            blocks.update(untraced)
+            for t in traces:
+                # block and uncle rewards are not txs
+                if t.get("transactionHash"):
+                    logged.setdefault(t["blockNumber"], set()).add(t["transactionHash"])
+                    blocks.add(t["blockNumber"])
+        return sorted(blocks), logged
+
+    # --- logs ---
+
+    @staticmethod
+    def filters(addresses: AbstractSet[str]) -> List[Dict[str, Any]]:
+        """`eth_getLogs` filters matching logs emitted by, or with an indexed topic equal to, any
+        of `addresses`. topics are and-ed across positions, so each position needs its own query"""
+        padded = ["0x" + "0" * 24 + a[2:] for a in sorted(addresses)]
+        out: List[Dict[str, Any]] = [{"address": sorted(addresses)}]
+        for i in (1, 2, 3):
+            topics: Topics = [None] * i
+            topics.append(padded)
+            out.append({"topics": topics})
+        return out
+
+    @staticmethod
+    def logs(client: Client, addresses: AbstractSet[str], batch_size: int, lo: int,
+             hi: int) -> List[Any]:
+        filters = Prefilter.filters(addresses)
+        calls = [("eth_getLogs", [dict(f, fromBlock=hex(lo), toBlock=hex(hi))]) for f in filters]
+        try:
+            return [log for logs in client.batch(calls) for log in logs]
+        except RPCError:
+            if hi - lo + 1 > batch_size:
+                mid = (lo + hi) // 2
+                return (Prefilter.logs(client, addresses, batch_size, lo, mid) +
+                        Prefilter.logs(client, addresses, batch_size, mid + 1, hi))
+            return Prefilter.bloom_logs(client, addresses, lo, hi)
+
+    @staticmethod
+    def bloom_logs(client: Client, addresses: AbstractSet[str], lo: int,
+                   hi: int) -> List[Any]:
+        headers = client.get_blocks(range(lo, hi + 1), full_transactions=False)
+        values = [bytes.fromhex(a[2:]) for a in addresses]
+        values += [bytes(12) + v for v in values]
+        hits = [h for h in headers if any(in_bloom(h["logsBloom"], v) for v in values)]
+
+        filters = Prefilter.filters(addresses)
+        calls = [("eth_getLogs", [dict(f, blockHash=h["hash"])]) for h in hits for f in filters]
+        return [log for logs in client.batch(calls) for log in logs]
+
+    # --- traces ---
+
+    @staticmethod
+    def traces(client: Client, addresses: AbstractSet[str], batch_size: int, lo: int,
+               hi: int) -> Tuple[List[Any], List[int]]:
+        """the traces of calls from or to any of `addresses` in `lo..hi`, and the blocks that the
+        node refused to trace"""
+        addrs = sorted(addresses)
+        calls = [("trace_filter", [{
+            "fromBlock": hex(lo),
+            "toBlock": hex(hi),
+            side: addrs
+        }]) for side in ("fromAddress", "toAddress")]
+        try:
+            return [t for traces in client.batch(calls) for t in traces], []
+        except RPCError as e:
+            if e.code != METHOD_NOT_FOUND and hi - lo + 1 > batch_size:
+                mid = (lo + hi) // 2
+                first = Prefilter.traces(client, addresses, batch_size, lo, mid)
+                second = Prefilter.traces(client, addresses, batch_size, mid + 1, hi)
+                return first[0] + second[0], first[1] + second[1]
+            print(f"unable to trace blocks {lo}..{hi} ({e}), scanning the full range")
+            return [], list(range(lo, hi + 1))
+
+    # --- transfers ---
+
+    @staticmethod
+    def transfers(client: Client, lo: int, hi: int, addresses: AbstractSet[str],
+                  batch_size: int) -> List[int]:
+        """returns the blocks in `lo..hi` in which the nonce or balance of one of `addresses`
+        changed. bisects breadth first, so each level of the search is a single batch"""
+        addrs = sorted(addresses)
+        zero: State = tuple((0, 0) for _ in addrs)
+
+        def states(blocks: List[int]) -> Dict[int, State]:
+            calls = [(m, [a, hex(b)]) for b in blocks for a in addrs
+                     for m in ("eth_getTransactionCount", "eth_getBalance")]
+            results = [int(r, 16) for c in chunked(calls, batch_size) for r in client.batch(c)]
+            pairs = list(zip(results[::2], results[1::2]))
+            return {
+                b: tuple(pairs[i * len(addrs):(i + 1) * len(addrs)])
+                for i, b in enumerate(blocks)
+            }
+
+        known: Dict[int, State] = {-1: zero}
+        frontier = [(lo, hi)]
+        out: List[int] = []
+        try:
+            while frontier:
+                missing = {b for l, h in frontier for b in (l - 1, h)} - set(known)
+                known.update(states(sorted(missing)))
+                nxt = []
+                for l, h in frontier:
+                    if known[l - 1] == known[h]:
+                        continue
+                    if l == h:
+                        out.append(l)
+                        continue
+                    mid = (l + h) // 2
+                    nxt += [(l, mid), (mid + 1, h)]
+                frontier = nxt
+        except RPCError as e:
+            print(f"unable to bisect blocks {lo}..{hi} ({e}), scanning the full range")
+            return list(range(lo, hi + 1))
+        return sorted(out)
+
+
+def in_bloom(bloom: str, value: bytes) -> bool:
+    """tests whether `value` is (possibly) a member of the 2048 bit `logsBloom` of a block"""
+    bits = bytes.fromhex(bloom[2:])
+    h = keccak(value)
+    for i in (0, 2, 4):
+        bit = ((h[i] << 8) | h[i + 1]) & 2047
+        if not bits[255 - bit // 8] & (1 << (bit % 8)):
+            return False
+    return True
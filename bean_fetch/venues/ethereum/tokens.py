@@ -0,0 +1,122 @@
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+from typing import Dict, Iterable, List, Optional, Type
+
+from eth_utils import keccak
+
+from bean_fetch.pool import chunked
+from bean_fetch.stats import STATS
+from .client import Client
+from .data import VENUE
+
+# --- constants ---
+
+# name of the token metadata cache (in the cache dir)
+TOKEN_CACHE = "tokens.sqlite"
+
+# metadata getter -> selector (first 4 bytes of the keccak hash of its signature)
+SELECTORS = {f: "0x" + keccak(text=f"{f}()")[:4].hex() for f in ("symbol", "name", "decimals")}
+
+# --- tokens ---
+
+
+@dataclass(frozen=True)
+class Token:
+    address: str
+    # `None` if the contract does not implement the getter (e.g. erc721 has no decimals)
+    symbol: Optional[str]
+    name: Optional[str]
+    decimals: Optional[int]
+
+
+def decode_string(result: Optional[str]) -> Optional[str]:
+    """decodes an abi encoded `string`, or the `bytes32` that some early tokens return instead"""
+    if not result or len(result) < 66:
+        return None
+    data = bytes.fromhex(result[2:])
+    try:
+        if len(data) == 32:
+            text = data.rstrip(b"\0").decode("utf-8")
+        else:
+            offset = int.from_bytes(data[:32], "big")
+            length = int.from_bytes(data[offset:offset + 32], "big")
+            text = data[offset + 32:offset + 32 + length].decode("utf-8")
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return text or None
+
+
+def decode_uint(result: Optional[str]) -> Optional[int]:
+    if not result or len(result) < 3:
+        return None
+    n = int(result, 16)
+    # anything larger is not a plausible number of decimals
+    return n if n <= 255 else None
+
+
+# metadata resolved by this process, by contract address
+KNOWN: Dict[str, Token] = {}
+
+
+class TokenCache:
+    """on-disk token metadata, keyed by contract address. contracts that do not implement the
+    metadata getters are cached too, so every contract is only ever looked up once"""
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS tokens (address TEXT PRIMARY KEY, "
+                        "symbol TEXT, name TEXT, decimals INTEGER)")
+
+    def lookup(self, addresses: Iterable[str]) -> Dict[str, Token]:
+        out: Dict[str, Token] = {}
+        for address in set(addresses):
+            row = self.db.execute("SELECT symbol, name, decimals FROM tokens WHERE address = ?",
+                                  (address, )).fetchone()
+            if row is not None:
+                out[address] = Token(address, *row)
+        return out
+
+    def store(self, tokens: Iterable[Token]) -> None:
+        self.db.executemany(
+            "INSERT OR REPLACE INTO tokens (address, symbol, name, decimals) VALUES (?, ?, ?, ?)",
+            ((t.address, t.symbol, t.name, t.decimals) for t in tokens))
+        self.db.commit()
+
+    def resolve(self, client: Client, addresses: Iterable[str],
+                batch_size: int = 100) -> Dict[str, Token]:
+        """the metadata of every contract in `addresses`. contracts that are not cached are
+        looked up with batched `eth_call`s (every getter of up to `batch_size` contracts per
+        request) and then cached. getters that revert or return nothing are taken as not
+        implemented, any other error raises `RPCError` so that nothing wrong is cached"""
+        wanted = set(addresses)
+        out = self.lookup(wanted)
+        STATS.add(VENUE, "token_cache_hits", len(out))
+
+        missing = sorted(wanted - set(out))
+        for part in chunked(missing, max(batch_size // len(SELECTORS), 1)):
+            calls = [("eth_call", [{"to": a, "data": SELECTORS[f]}, "latest"]) for a in part
+                     for f in ("symbol", "name", "decimals")]
+            results = client.batch(calls, strict=False)
+            tokens: List[Token] = []
+            for i, address in enumerate(part):
+                symbol, name, decimals = results[3 * i:3 * i + 3]
+                tokens.append(
+                    Token(address, decode_string(symbol), decode_string(name),
+                          decode_uint(decimals)))
+            self.store(tokens)
+            STATS.add(VENUE, "tokens_resolved", len(tokens))
+            out.update((t.address, t) for t in tokens)
+        KNOWN.update(out)
+        return out
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "TokenCache":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.close()
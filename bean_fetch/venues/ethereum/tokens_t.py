@@ -0,0 +1,43 @@
+from pathlib import Path
+from typing import Any
+
+from bean_fetch.venues.ethereum.client import Client, RPCError
+from bean_fetch.venues.ethereum.tokens import TokenCache
+from bench.servers import EthereumNode
+
+
+class LimitedNode(EthereumNode):
+    """rejects every `eth_call` as rate limited"""
+    def call(self, c: Any) -> Any:
+        if c["method"] == "eth_call":
+            return {"jsonrpc": "2.0", "id": c["id"],
+                    "error": {"code": -32005, "message": "limit exceeded"}}
+        return super().call(c)
+
+
+def test_reverted_getters_are_not_implemented(tmp_path: Path) -> None:
+    node = EthereumNode(tokens=10)
+    try:
+        with TokenCache(tmp_path / "tokens.sqlite") as cache:
+            # the tenth token reverts on `decimals()`
+            address = EthereumNode.token(9)
+            token = cache.resolve(Client(node.url), [address])[address]
+            assert (token.symbol, token.decimals) == ("T9", None)
+            assert cache.lookup({address}) == {address: token}
+    finally:
+        node.stop()
+
+
+def test_node_errors_are_not_cached(tmp_path: Path) -> None:
+    node = LimitedNode(tokens=10)
+    try:
+        with TokenCache(tmp_path / "tokens.sqlite") as cache:
+            address = EthereumNode.token(1)
+            try:
+                cache.resolve(Client(node.url), [address])
+                assert False, "resolved a rate limited token"
+            except RPCError:
+                pass
+            assert cache.lookup({address}) == {}
+    finally:
+        node.stop()
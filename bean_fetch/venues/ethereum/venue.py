@@ -0,0 +1,300 @@
+import re
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from threading import Event
+from typing import AbstractSet, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from beancount.core.amount import CURRENCY_RE, Amount
+from beancount.core.data import EMPTY_SET, Posting, Transaction, new_metadata
+from web3 import Web3
+
+from bean_fetch.data import RawTx, Stream, VenueLike
+from bean_fetch.encoding import dumps
+from bean_fetch.pool import chunked, imap
+from .cache import BLOCK_CACHE, CONFIRMATIONS, BlockCache
+from .checkpoint import Checkpoint
+from .client import Client
+from .logs import Transfer, decode_all, token_addresses, transfers
+from .tokens import KNOWN, TOKEN_CACHE, Token, TokenCache
+from .prefilter import Logged, Prefilter
+from .data import (Config, Kind, VENUE, PARSER_VERSION, PARSE_FIELDS, EthTx, TxReceipt,
+                   LogReceipt)
+
+# --- venue ---
+
+Raw = RawTx[Kind]
+
+# name of the file (in the state dir) that records the scanned block ranges per address
+CHECKPOINT = "ethereum.json"
+
+# a matched tx together with the timestamp of the block that contains it
+Match = Tuple[int, Any]
+
+# matched txs together with the last block that is fully covered once they are processed
+Chunk = Tuple[int, List[Match]]
+
+# ether amounts are in wei
+ETH = "ETH"
+WEI = 18
+
+
+class Venue(VenueLike[Config, Kind]):
+    @staticmethod
+    def fetch(config: Config, cancel: Optional[Event] = None) -> Stream[Kind]:
+        checkpoint = Checkpoint(config.state_dir / CHECKPOINT if config.state_dir else None)
+        return Stream(Fetch.scan(config, checkpoint, Fetch.client(config, cancel)),
+                      checkpoint.save)
+
+    @staticmethod
+    def handles(tx: Raw) -> bool:
+        return tx.venue == VENUE and isinstance(tx.kind, Kind)
+
+    @staticmethod
+    def prepare(config: Config, raws: List[Raw]) -> None:
+        """resolves the metadata of every token transferred in `raws` up front, with a few
+        batched requests, so that `parse` finds it in `tokens.KNOWN`"""
+        if config.cache_dir is None:
+            return
+        addresses = {a for raw in raws for a in token_addresses(raw.raw["receipt"]["logs"])}
+        if not addresses - KNOWN.keys():
+            return
+        with TokenCache(config.cache_dir / TOKEN_CACHE) as cache:
+            cache.resolve(Client(config.rpc_url), addresses - KNOWN.keys(), config.batch_size)
+
+    @staticmethod
+    def parse(config: Config, raw: Raw) -> Transaction:
+        tx = EthTx(**raw.raw)
+        return Parse.transaction(config, tx, transfers(decode_all(tx.receipt.logs), KNOWN))
+
+
+# --- fetcher ---
+
+
+class Fetch:
+    @staticmethod
+    def client(config: Config, cancel: Optional[Event] = None) -> Client:
+        # the block and receipt stages each keep up to `concurrency` requests in flight
+        return Client(config.rpc_url, pool_size=2 * config.concurrency, cancel=cancel)
+
+    @staticmethod
+    def scan(config: Config,
+             checkpoint: Checkpoint,
+             client: Optional[Client] = None,
+             head: Optional[int] = None) -> Iterator[Raw]:
+        """yields the txs for every block range up to `head` that the checkpoint has not yet seen.
+        by default `head` is the newest block with `CONFIRMATIONS` blocks on top of it, so the
+        checkpoint never covers blocks that can still be reorganized. progress is marked on
+        `checkpoint` as txs are yielded, but only saved when the stream is committed"""
+        client = client or Fetch.client(config)
+        addresses = {a.lower() for a in config.addresses}
+        final = (head if head is not None else client.block_number()) - CONFIRMATIONS
+        head = head if head is not None else final
+        cache = BlockCache(config.cache_dir / BLOCK_CACHE, config.cache_size * 1024 * 1024) \
+            if config.cache_dir and config.cache_size > 0 else None
+
+        try:
+            for lo, hi, active in checkpoint.segments(addresses, config.start_block, head):
+                if config.prefilter:
+                    numbers, logged = Prefilter.candidates(client, lo, hi, active,
+                                                           config.log_range, config.batch_size,
+                                                           config.concurrency,
+                                                           config.transfer_filter)
+                else:
+                    numbers, logged = list(range(lo, hi + 1)), {}
+                batches = Fetch.blocks(client, numbers, config.batch_size, config.concurrency,
+                                       cache, final)
+                chunks = Fetch.chunks(batches, active, logged, config.receipt_batch_size)
+                for done, txs in Fetch.receipts(client, chunks, config.concurrency,
+                                                config.block_receipts, cache, final):
+                    for tx in txs:
+                        yield RawTx(venue=VENUE,
+                                    kind=Kind.TRANSACTION,
+                                    timestamp=tx.timestamp,
+                                    raw=dumps(tx),
+                                    meta={})
+                    checkpoint.mark(active, lo, done)
+                checkpoint.mark(active, lo, hi)
+        finally:
+            if cache:
+                cache.close()
+
+    @staticmethod
+    def blocks(client: Client,
+               numbers: Iterable[int],
+               batch_size: int,
+               concurrency: int,
+               cache: Optional[BlockCache] = None,
+               final: int = -1) -> Iterator[List[Any]]:
+        """yields the blocks for `numbers` in order, in batches of `batch_size`. up to
+        `concurrency` batches are in flight at once. blocks found in `cache` are yielded in their
+        compacted form, blocks up to `final` that are downloaded are added to it"""
+        return imap(partial(Fetch.get_blocks, client, cache, final), chunked(numbers, batch_size),
+                    concurrency)
+
+    @staticmethod
+    def get_blocks(client: Client, cache: Optional[BlockCache], final: int,
+                   numbers: List[int]) -> List[Any]:
+        if cache is None:
+            return client.get_blocks(numbers)
+        cached = cache.blocks(numbers)
+        fetched = client.get_blocks([n for n in numbers if n not in cached])
+        cache.put_blocks(fetched, final)
+        downloaded = iter(fetched)
+        return [cached[n] if n in cached else next(downloaded) for n in numbers]
+
+    @staticmethod
+    def chunks(batches: Iterator[List[Any]], addresses: AbstractSet[str], logged: Logged,
+               size: int) -> Iterator[Chunk]:
+        """splits the matched txs of each block batch into chunks of at most `size` txs. each chunk
+        is tagged with the last block that is fully processed once the chunk has been resolved"""
+        for blocks in batches:
+            matches = [m for block in blocks for m in Fetch.matches(block, addresses, logged)]
+            parts = list(chunked(matches, size)) or [[]]
+            for i, part in enumerate(parts):
+                if i + 1 < len(parts):
+                    done = int(parts[i + 1][0][1]["blockNumber"], 16) - 1
+                else:
+                    done = int(blocks[-1]["number"], 16)
+                yield done, part
+
+    @staticmethod
+    def matches(block: Any, addresses: AbstractSet[str], logged: Logged) -> Iterator[Match]:
+        """yields the txs in `block` that were sent from or to one of `addresses`, or that were
+        matched by their logs or traces during prefiltering"""
+        timestamp = int(block["timestamp"], 16)
+        hashes = logged.get(int(block["number"], 16), set())
+        for tx in block["transactions"]:
+            if (tx["from"] in addresses) or (tx["to"] in addresses) or (tx["hash"] in hashes):
+                yield timestamp, tx
+
+    @staticmethod
+    def receipts(client: Client,
+                 chunks: Iterator[Chunk],
+                 concurrency: int,
+                 block_receipts: bool,
+                 cache: Optional[BlockCache] = None,
+                 final: int = -1) -> Iterator[Tuple[int, List[EthTx]]]:
+        """resolves the receipts for each chunk of matches. chunks are resolved in the background
+        while the block scan continues, and are yielded in order"""
+        return imap(partial(Fetch.resolve, client, block_receipts, cache, final), chunks,
+                    concurrency)
+
+    @staticmethod
+    def resolve(client: Client, block_receipts: bool, cache: Optional[BlockCache], final: int,
+                chunk: Chunk) -> Tuple[int, List[EthTx]]:
+        done, matches = chunk
+        cached = cache.txs([tx["hash"] for _, tx in matches]) if cache and matches else {}
+        todo = [tx for _, tx in matches if tx["hash"] not in cached]
+
+        # matches from cached blocks only carry a tx summary
+        summaries = [tx["hash"] for tx in todo if "input" not in tx]
+        full = dict(zip(summaries, client.batch([("eth_getTransactionByHash", [h])
+                                                 for h in summaries])))
+        todo = [full.get(tx["hash"], tx) for tx in todo]
+
+        if block_receipts:
+            numbers = sorted({tx["blockNumber"] for tx in todo}, key=lambda n: int(n, 16))
+            results = client.batch([("eth_getBlockReceipts", [n]) for n in numbers])
+            receipts = {r["transactionHash"]: r for rs in results for r in rs}
+        else:
+            hashes = [tx["hash"] for tx in todo]
+            receipts = dict(zip(hashes, client.get_receipts(hashes)))
+
+        resolved = dict(cached)
+        resolved.update((tx["hash"], (tx, receipts[tx["hash"]])) for tx in todo)
+        if cache:
+            cache.put_txs((resolved[tx["hash"]] for tx in todo), final)
+        return done, [Fetch.transaction(ts, *resolved[tx["hash"]]) for ts, tx in matches]
+
+    @staticmethod
+    def transaction(timestamp: int, tx: Any, receipt: Any) -> EthTx:
+        """builds an `EthTx` from the raw json-rpc representation of a tx and its receipt"""
+        return EthTx(
+            timestamp=datetime.utcfromtimestamp(timestamp),
+            blockHash=tx["blockHash"],
+            blockNumber=int(tx["blockNumber"], 16),
+            chainId=int(tx["chainId"], 16) if tx.get("chainId") else 1,
+            data=tx.get("data"),
+            sender=Web3.toChecksumAddress(tx["from"]),
+            receiver=Web3.toChecksumAddress(tx["to"]) if tx["to"] else None,
+            gas=int(tx["gas"], 16),
+            gasPrice=int(tx["gasPrice"], 16),
+            hash=tx["hash"],
+            input=tx["input"],
+            nonce=int(tx["nonce"], 16),
+            value=int(tx["value"], 16),
+            receipt=TxReceipt(
+                contractAddress=Web3.toChecksumAddress(receipt["contractAddress"])
+                if receipt["contractAddress"] else None,
+                cumulativeGasUsed=int(receipt["cumulativeGasUsed"], 16),
+                gasUsed=int(receipt["gasUsed"], 16),
+                logs=[
+                    LogReceipt(
+                        address=Web3.toChecksumAddress(log["address"]),
+                        data=log["data"],
+                        logIndex=int(log["logIndex"], 16),
+                        payload=log.get("payload"),
+                        removed=log.get("removed", False),
+                        topic=log.get("topic"),
+                        topics=log["topics"],
+                    ) for log in receipt["logs"]
+                ],
+                logsBloom=receipt["logsBloom"],
+                root=receipt.get("root"),
+                status=int(receipt["status"], 16),
+            ),
+        )
+
+
+# --- parser ---
+
+
+class Parse:
+    @staticmethod
+    def transaction(config: Config, tx: EthTx, moves: List[Transfer]) -> Transaction:
+        """the ether and token movements of `tx` from and to the configured addresses, each
+        posted to `<assets_prefix>:<address>`. the gas paid by a configured sender is an expense,
+        and whatever moved from or to other addresses is balanced by an interpolated
+        `<expenses_prefix>:Unclassified` posting. a reverted tx moves nothing but its gas"""
+        ours = {a.lower() for a in config.addresses}
+        postings: List[Posting] = []
+        net: Dict[str, Decimal] = defaultdict(Decimal)
+
+        def post(account: str, number: Decimal, currency: str) -> None:
+            postings.append(Posting(account, Amount(number, currency), None, None, None, None))
+            net[currency] += number
+
+        def move(sender: str, receiver: str, number: Decimal, currency: str) -> None:
+            if sender in ours:
+                post(f"{config.assets_prefix}:{sender}", -number, currency)
+            if receiver in ours:
+                post(f"{config.assets_prefix}:{receiver}", number, currency)
+
+        sender, receiver = tx.sender.lower(), (tx.receiver or "").lower()
+        succeeded = tx.receipt.status != 0
+        if tx.value and succeeded:
+            move(sender, receiver, Decimal(tx.value).scaleb(-WEI), ETH)
+        if sender in ours:
+            fee = Decimal(tx.receipt.gasUsed * tx.gasPrice).scaleb(-WEI)
+            post(f"{config.assets_prefix}:{sender}", -fee, ETH)
+            post(f"{config.expenses_prefix}:Fees", fee, ETH)
+        for t in moves if succeeded else []:
+            move(t.sender, t.receiver, t.amount, Parse.currency(t.token))
+
+        if any(net.values()):
+            postings.append(
+                Posting(f"{config.expenses_prefix}:Unclassified", None, None, None, None, None))
+        return Transaction(new_metadata(f"<{VENUE}>", tx.blockNumber, {"hash": tx.hash}),
+                           tx.timestamp.date(), "*", None, f"ethereum tx {tx.hash}", EMPTY_SET,
+                           EMPTY_SET, postings)
+
+    @staticmethod
+    def currency(token: Token) -> str:
+        """the token's symbol if it is a valid commodity name, otherwise a name derived from its
+        contract address"""
+        symbol = (token.symbol or "").upper()
+        if re.fullmatch(CURRENCY_RE, symbol):
+            return symbol
+        return f"T{token.address[2:10].upper()}"
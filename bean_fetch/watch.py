@@ -0,0 +1,271 @@
+import sys
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from coinbase.wallet.model import Account
+
+import bean_fetch.state as state
+import bean_fetch.venues.coinbase as cb
+import bean_fetch.venues.coinbasepro.venue as cbpro
+import bean_fetch.venues.ethereum.venue as eth
+from bean_fetch.archive import Archive, encode
+from bean_fetch.config import Config, WatchConfig
+from bean_fetch.data import Cancelled, RawTx, Stream
+from bean_fetch.dedup import HashIndex
+from bean_fetch.ratelimit import backoff
+from bean_fetch.stats import STATS
+from bean_fetch.venues.coinbasepro.cursors import Cursors
+from bean_fetch.venues.ethereum.checkpoint import Checkpoint
+from bean_fetch.writer import Writer
+
+# --- constants ---
+
+# default seconds between polls, by venue name
+INTERVALS = {
+    cb.VENUE: 60.0,
+    cbpro.VENUE: 10.0,
+    eth.VENUE: 12.0,
+}
+
+# seconds between listings of the coinbase accounts (and their balances). polls in between only
+# list the records of the known accounts that are newer than their cursors
+ACCOUNTS_INTERVAL = 600.0
+
+# failing polls are retried with exponential backoff, waiting at most this many seconds
+MAX_BACKOFF = 600.0
+
+# name of the file (in the state dir) that records the hashes of the watched ethereum blocks and
+# the records archived from them
+HEADS = "ethereum-heads.json"
+
+# --- pollers ---
+
+
+class ReorgTooDeep(Exception):
+    pass
+
+
+class Poller(ABC):
+    """fetches the records of a venue that appeared since its last poll, keeping its clients (and
+    their connections) open between polls"""
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+
+    @abstractmethod
+    def poll(self) -> Iterable[RawTx[Any]]:
+        ...
+
+    def reset(self) -> None:
+        """drops progress that was not committed, after a poll failed"""
+        pass
+
+
+class CoinbasePoller(Poller):
+    def __init__(self, config: cb.Config, interval: float, stop: Event):
+        super().__init__(cb.VENUE, interval)
+        self.config = config
+        self.client, self.bucket = cb.Fetch.connect(config, stop)
+        self.reported = state.Reported(config.state_dir, cb.VENUE)
+        self.accounts: List[Account] = []
+        # monotonic time of the last listing of the accounts, they are listed again after a
+        # failed poll
+        self.listed: Optional[float] = None
+        self.reset()
+
+    def poll(self) -> Iterable[RawTx[Any]]:
+        if self.listed is None or time.monotonic() - self.listed >= ACCOUNTS_INTERVAL:
+            self.accounts = cb.Fetch.accounts(self.client, self.bucket, self.reported)
+            self.listed = time.monotonic()
+        return Stream(cb.Fetch.records(self.config, self.bucket, self.accounts, self.cursors),
+                      self.commit)
+
+    def commit(self) -> None:
+        self.cursors.save()
+        self.reported.save()
+
+    def reset(self) -> None:
+        path = self.config.state_dir
+        self.cursors = cb.Cursors(path / cb.CURSORS if path else None)
+        self.listed = None
+
+
+class CoinbaseProPoller(Poller):
+    def __init__(self, config: cbpro.Config, interval: float, stop: Event):
+        super().__init__(cbpro.VENUE, interval)
+        self.config = config
+        self.client = cbpro.Fetch.client(config, stop)
+        self.reported = state.Reported(config.state_dir, cbpro.VENUE)
+        self.reset()
+
+    def poll(self) -> Iterable[RawTx[Any]]:
+        return Stream(cbpro.Fetch.all(self.config, self.cursors, self.client, self.reported),
+                      self.commit)
+
+    def commit(self) -> None:
+        self.cursors.save()
+        self.reported.save()
+
+    def reset(self) -> None:
+        path = self.config.state_dir
+        self.cursors = Cursors(path / cbpro.CURSORS if path else None)
+
+
+class EthereumPoller(Poller):
+    """scans the blocks that are `confirmations` deep as the chain grows. the hash of the newest
+    scanned block is checked on every poll, if it changed the chain was reorganized: the records
+    archived from blocks after the newest block that is still canonical are removed and those
+    blocks are scanned again. blocks are tracked for `reorg_depth` blocks"""
+    def __init__(self, config: eth.Config, watch: WatchConfig, index: HashIndex, lock: Lock,
+                 interval: float, stop: Event):
+        super().__init__(eth.VENUE, interval)
+        self.config = config
+        self.watch = watch
+        self.index = index
+        self.lock = lock
+        self.client = eth.Fetch.client(config, stop)
+        self.reset()
+
+    def path(self, name: str) -> Optional[Path]:
+        return self.config.state_dir / name if self.config.state_dir else None
+
+    def reset(self) -> None:
+        self.checkpoint = Checkpoint(self.path(eth.CHECKPOINT))
+        path = self.path(HEADS)
+        stored = state.load(path) if path else {}
+        # block number -> hash, of the newest scanned block of every poll
+        self.heads: Dict[int, str] = {int(n): h for n, h in stored.get("heads", {}).items()}
+        # block number -> archive keys of the records archived from it
+        self.keys: Dict[int, List[str]] = {
+            int(n): list(keys)
+            for n, keys in stored.get("keys", {}).items()
+        }
+
+    def save(self) -> None:
+        self.checkpoint.save()
+        path = self.path(HEADS)
+        if path:
+            state.save(path, {
+                "heads": {str(n): h for n, h in self.heads.items()},
+                "keys": {str(n): keys for n, keys in self.keys.items()},
+            })
+
+    def poll(self) -> Iterable[RawTx[Any]]:
+        target = self.client.block_number() - self.watch.confirmations
+        newest = max(self.heads, default=None)
+        numbers = [target] if newest is None else [target, newest]
+        blocks = self.client.get_blocks(numbers, full_transactions=False)
+
+        # a block hash commits to every block before it, so checking the newest one is enough
+        if newest is not None and (blocks[1] or {}).get("hash") != self.heads[newest]:
+            self.rollback()
+
+        # forget blocks that are too deep to be reorganized, but keep the newest one to compare
+        horizon = target - self.watch.reorg_depth
+        for n in [n for n in self.heads if n < horizon and n != max(self.heads)]:
+            del self.heads[n]
+        for n in [n for n in self.keys if n < horizon]:
+            del self.keys[n]
+
+        if self.heads and target <= max(self.heads):
+            return []
+        # recorded before scanning, if the block changes in between the next poll rolls it back
+        self.heads[target] = blocks[0]["hash"]
+        return Stream(self.records(target), self.save)
+
+    def records(self, target: int) -> Iterator[RawTx[Any]]:
+        for tx in eth.Fetch.scan(self.config, self.checkpoint, self.client, target):
+            self.keys.setdefault(tx.raw["blockNumber"], []).append(encode(tx)[0])
+            yield tx
+
+    def rollback(self) -> None:
+        """removes everything after the newest tracked block that is still canonical"""
+        numbers = sorted(self.heads, reverse=True)
+        blocks = self.client.get_blocks(numbers, full_transactions=False)
+        fork = next((n for n, block in zip(numbers, blocks)
+                     if block and block["hash"] == self.heads[n]), None)
+        if fork is None:
+            raise ReorgTooDeep(f"chain reorganized below block {numbers[-1]}, the oldest "
+                               "tracked block. raise watch.reorg_depth and fetch the affected "
+                               "blocks again")
+
+        # rewind first, so that an interrupted rollback is rescanned rather than lost
+        self.checkpoint.rewind(fork)
+        self.checkpoint.save()
+        dropped = [key for n in sorted(self.keys) if n > fork for key in self.keys[n]]
+        with self.lock:
+            for key in dropped:
+                self.index.remove(key)
+            self.index.flush()
+        for n in [n for n in self.heads if n > fork]:
+            del self.heads[n]
+        for n in [n for n in self.keys if n > fork]:
+            del self.keys[n]
+        self.save()
+
+        STATS.add(eth.VENUE, "reorgs")
+        print(f"{eth.VENUE}: chain reorganized after block {fork}, removed {len(dropped)} records")
+
+
+def pollers(config: Config, index: HashIndex, lock: Lock, stop: Event) -> List[Poller]:
+    """a poller for every configured venue. their clients stop sending requests once `stop` is
+    set"""
+    watch = config.watch or WatchConfig()
+    intervals = {**INTERVALS, **(watch.intervals or {})}
+    out: List[Poller] = []
+    if config.coinbase:
+        out.append(CoinbasePoller(config.coinbase, intervals[cb.VENUE], stop))
+    if config.coinbasepro:
+        out.append(CoinbaseProPoller(config.coinbasepro, intervals[cbpro.VENUE], stop))
+    if config.ethereum:
+        out.append(
+            EthereumPoller(config.ethereum, watch, index, lock, intervals[eth.VENUE], stop))
+    return out
+
+
+# --- watch ---
+
+
+def run(poller: Poller, writer: Writer, stop: Event) -> None:
+    """polls until `stop` is set. failed polls are reported and retried with backoff"""
+    attempt = 0
+    while not stop.is_set():
+        try:
+            with STATS.timed(poller.name, "poll"):
+                writer.consume(poller.poll(), stop)
+            attempt, wait = 0, poller.interval
+        except Cancelled:
+            return
+        except Exception as e:
+            poller.reset()
+            wait = backoff(attempt, poller.interval, max(poller.interval, MAX_BACKOFF))
+            attempt += 1
+            STATS.add(poller.name, "poll_errors")
+            print(f"failed to poll {poller.name}: {e!r}, retrying in {wait:.0f}s", file=sys.stderr)
+        stop.wait(wait)
+
+
+def watch(config: Config, archive: Archive, index: HashIndex, stop: Event) -> None:
+    """polls every configured venue on its own thread and interval, archiving new records as they
+    appear, until `stop` is set (or the process is interrupted)"""
+    lock = Lock()
+    threads: List[Thread] = []
+    for poller in pollers(config, index, lock, stop):
+        print(f"watching {poller.name} every {poller.interval:g}s")
+        writer = Writer(archive, index, lock=lock, name=poller.name)
+        threads.append(Thread(target=run, args=(poller, writer, stop), name=poller.name))
+    if not threads:
+        raise ValueError("no venues configured")
+
+    for thread in threads:
+        thread.start()
+    try:
+        while not stop.wait(1):
+            pass
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,58 @@
+from threading import Event, Lock
+from typing import Any, Iterable, List, Optional
+
+from bean_fetch.archive import Archive
+from bean_fetch.data import Cancelled, RawTx, Stream
+from bean_fetch.dedup import HashIndex
+from bean_fetch.stats import STATS, TOTAL
+
+
+class Writer:
+    """persists fetched records to the archive as they arrive, in batches of `batch_size`. after
+    each batch the archive is flushed and streams that track progress are committed, so an
+    interrupted fetch keeps everything written up to the last batch. writers for different venues
+    can share an archive by sharing `lock`. time spent writing is recorded under `name`"""
+    def __init__(self,
+                 archive: Archive,
+                 index: HashIndex,
+                 batch_size: int = 500,
+                 lock: Optional[Lock] = None,
+                 name: str = TOTAL):
+        self.archive = archive
+        self.index = index
+        self.batch_size = batch_size
+        self.lock = lock or Lock()
+        self.name = name
+        self.closed = False
+
+    def consume(self, records: Iterable[RawTx[Any]], cancel: Optional[Event] = None) -> None:
+        """writes every record in `records`. raises `Cancelled` (after writing what was already
+        received) once `cancel` is set"""
+        pending: List[RawTx[Any]] = []
+        try:
+            for tx in records:
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                pending.append(tx)
+                if len(pending) >= self.batch_size:
+                    self.flush(pending, records)
+                    pending = []
+        finally:
+            self.flush(pending, records)
+
+    def close(self) -> None:
+        """stops writing: records that arrive afterwards (e.g. from a fetch that was abandoned
+        after a timeout) are dropped, and the stream is not committed again"""
+        with self.lock:
+            self.closed = True
+
+    def flush(self, pending: List[RawTx[Any]], records: Iterable[RawTx[Any]]) -> None:
+        with self.lock, STATS.timed(self.name, "write"):
+            if self.closed:
+                return
+            for tx in pending:
+                self.index.write(tx)
+            # flushes the archive before the index lines
+            self.index.flush()
+            if isinstance(records, Stream):
+                records.commit()
@@ -0,0 +1,86 @@
+"""micro-benchmark for the fetch serialization path
+
+compares the previous path (jsonpickle for the payload, dataclasses-json `to_json` for the hash
+and again, indented, for the file) with the canonical encoder. run with:
+
+    python -m bench.encoding [-n RECORDS]
+"""
+import argparse
+import hashlib
+import timeit
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, List
+
+import jsonpickle
+
+import bean_fetch.venues.coinbasepro.venue as cbpro
+from bean_fetch.archive import encode
+from bean_fetch.encoding import dumps
+from bean_fetch.venues.coinbasepro.data import Fill
+
+# --- fixtures ---
+
+
+def fills(n: int) -> List[Fill]:
+    t0 = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    return [
+        Fill(trade_id=i,
+             product_id="ETH-USD",
+             price="%.2f" % (100 + i % 97),
+             size="1.5",
+             order_id=f"order-{i}",
+             created_at=t0 + timedelta(minutes=i),
+             user_id="user",
+             profile_id="profile",
+             liquidity="T",
+             fee="0.1",
+             side="buy",
+             settled=True,
+             usd_volume="150") for i in range(n)
+    ]
+
+
+# --- paths ---
+
+
+def previous(fill: Fill) -> None:
+    tx = cbpro.Raw(venue=cbpro.VENUE,
+                   kind=cbpro.Kind.FILL,
+                   timestamp=fill.created_at,
+                   raw=jsonpickle.encode(fill, unpicklable=False))
+    hashlib.sha256(tx.to_json().encode('UTF-8')).hexdigest()  # type: ignore
+    tx.to_json(indent=4)  # type: ignore
+
+
+def canonical(fill: Fill) -> None:
+    tx = cbpro.Raw(venue=cbpro.VENUE,
+                   kind=cbpro.Kind.FILL,
+                   timestamp=fill.created_at,
+                   raw=dumps(fill))
+    encode(tx)
+
+
+def run(name: str, path: Callable[[Any], None], records: List[Fill], repeat: int) -> float:
+    def loop() -> None:
+        for r in records:
+            path(r)
+
+    best = min(timeit.repeat(loop, number=1, repeat=repeat))
+    print(f"{name:>10}: {best:.3f}s ({len(records) / best:,.0f} records/s)")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--records", type=int, default=20000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = fills(args.records)
+    before = run("previous", previous, records, args.repeat)
+    after = run("canonical", canonical, records, args.repeat)
+    print(f"{'speedup':>10}: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""micro-benchmark for loading archived records
+
+compares the validating `decode` with the trusted, lazy `load`, both for records that are only
+sorted (venue, kind and timestamp are read) and for records whose payload is parsed. run with:
+
+    python -m bench.loading [-n RECORDS]
+"""
+import argparse
+import timeit
+from typing import Any, Callable, List
+
+import bean_fetch.venues.coinbasepro.venue as cbpro
+from bean_fetch.archive import decode, encode, load
+from bean_fetch.data import Kind, RawTx
+from bean_fetch.encoding import dumps
+from bench.encoding import fills
+
+# --- fixtures ---
+
+
+def records(n: int) -> List[bytes]:
+    return [
+        encode(cbpro.Raw(venue=cbpro.VENUE,
+                         kind=cbpro.Kind.FILL,
+                         timestamp=f.created_at,
+                         raw=dumps(f)))[1] for f in fills(n)
+    ]
+
+
+# --- paths ---
+
+
+def header(tx: RawTx[Kind]) -> Any:
+    return tx.timestamp, tx.venue
+
+
+def payload(tx: RawTx[Kind]) -> Any:
+    return tx.raw["trade_id"]
+
+
+def run(name: str, read: Callable[[bytes], RawTx[Kind]], use: Callable[[RawTx[Kind]], Any],
+        data: List[bytes], repeat: int) -> float:
+    def loop() -> None:
+        for d in data:
+            use(read(d))
+
+    best = min(timeit.repeat(loop, number=1, repeat=repeat))
+    print(f"{name:>16}: {best:.3f}s ({len(data) / best:,.0f} records/s)")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--records", type=int, default=50000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = records(args.records)
+    for use in (header, payload):
+        before = run(f"decode ({use.__name__})", decode, use, data, args.repeat)
+        after = run(f"load ({use.__name__})", load, use, data, args.repeat)
+        print(f"{'speedup':>16}: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
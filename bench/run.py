@@ -0,0 +1,282 @@
+"""offline fetch / parse benchmarks
+
+`fetch` runs every venue against the local stand-ins in `bench.servers`, `parse` runs over a
+synthetic archive from `bench.synthetic`. each run reports throughput, latency and peak memory,
+and can append its results as a json line to `--out` so they can be tracked across commits:
+
+    python -m bench.run fetch [--scale N] [--latency MS] [--concurrent] [--out FILE]
+    python -m bench.run parse [-n RECORDS] [-j JOBS] [--out FILE]
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Event
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from web3 import Web3
+
+import bean_fetch.state as state
+import bean_fetch.venues.coinbase as cb
+import bean_fetch.venues.coinbasepro.venue as cbpro
+import bean_fetch.venues.ethereum.venue as eth
+from bean_fetch.archive import CODECS, FORMATS, SEGMENTS
+from bean_fetch.config import Config, FetchConfig, archive
+from bean_fetch.data import RawTx, Stream
+from bean_fetch.dedup import HashIndex
+from bean_fetch.fetching import Source, fetch_venues
+from bean_fetch.main import INDEX, sources
+from bean_fetch.parsing import parse_archive
+from bench.servers import ADDRESS, CoinbaseProServer, CoinbaseServer, EthereumNode
+from bench.synthetic import generate
+
+# --- helpers ---
+
+
+def peak_rss() -> float:
+    """peak resident memory (in MiB) of this process and its (waited for) children"""
+    usage = [resource.getrusage(r).ru_maxrss for r in (resource.RUSAGE_SELF,
+                                                     resource.RUSAGE_CHILDREN)]
+    # linux reports kilobytes, macos bytes
+    return max(usage) / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                             capture_output=True,
+                             text=True,
+                             check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def quiet() -> Iterator[None]:
+    """silences stdout, including that of worker processes"""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as null:
+        os.dup2(null.fileno(), 1)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def report(result: Dict[str, Any], out: Optional[Path]) -> None:
+    for k, v in result.items():
+        if isinstance(v, float):
+            v = f"{v:,.3f}"
+        print(f"{k:>24}: {v}")
+    print()
+    if out:
+        with out.open("a") as f:
+            f.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+# --- fetch ---
+
+
+class Timing:
+    """when a venue yielded its first and last record, relative to the start of the run"""
+    def __init__(self) -> None:
+        self.records = 0
+        self.first: Optional[float] = None
+        self.done: Optional[float] = None
+
+
+def timed(source: Source, start: float, timings: Dict[str, Timing]) -> Source:
+    name, fn = source
+    timing = timings[name] = Timing()
+
+    def records(inner: Iterable[RawTx[Any]]) -> Iterator[RawTx[Any]]:
+        for tx in inner:
+            if timing.first is None:
+                timing.first = time.perf_counter() - start
+            timing.records += 1
+            yield tx
+        timing.done = time.perf_counter() - start
+
+    def run(cancel: Event) -> Iterable[RawTx[Any]]:
+        inner = fn(cancel)
+        if isinstance(inner, Stream):
+            return Stream(records(inner), inner.commit)
+        return records(inner)
+
+    return name, run
+
+
+def bench_fetch(args: argparse.Namespace) -> None:
+    latency = args.latency / 1000
+    servers = [
+        CoinbaseProServer(fills=args.scale, transfers=args.scale // 10, latency=latency),
+        CoinbaseServer(records=args.scale // 4, latency=latency),
+        EthereumNode(head=args.scale, latency=latency),
+    ]
+    cbpro_server, cb_server, node = servers
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp)
+        rate = args.rate_limit
+        config = Config(
+            archive_dir=path,
+            archive_format=args.format,
+            archive_codec=args.codec,
+            fetch=FetchConfig(concurrent=args.concurrent),
+            coinbase=cb.Config(api_key="key",
+                               api_secret="secret",
+                               assets_prefix="Assets",
+                               expenses_prefix="Expenses",
+                               payment_methods={},
+                               rate_limit=rate,
+                               api_url=cb_server.url + "/"),
+            coinbasepro=cbpro.Config(api_key="key",
+                                     api_secret=base64.b64encode(b"secret").decode(),
+                                     api_passphrase="passphrase",
+                                     rate_limit=rate,
+                                     api_url=cbpro_server.url,
+                                     state_dir=path / state.STATE_DIR),
+            ethereum=eth.Config(rpc_url=node.url,
+                                addresses=[Web3.toChecksumAddress(ADDRESS)],
+                                start_block=0,
+                                state_dir=path / state.STATE_DIR,
+                                cache_dir=path / state.CACHE_DIR),
+        )
+
+        # the first run fetches everything, later runs only what is new (i.e. nothing)
+        for run in range(args.runs):
+            requests = sum(s.requests for s in servers)
+            timings: Dict[str, Timing] = {}
+            start = time.perf_counter()
+            with archive(config) as a:
+                index = HashIndex(path / state.STATE_DIR / INDEX, a)
+                try:
+                    with quiet():
+                        fetch_venues([timed(s, start, timings) for s in sources(config)], a,
+                                     index, config.fetch)
+                finally:
+                    index.close()
+            seconds = time.perf_counter() - start
+
+            records = sum(t.records for t in timings.values())
+            result: Dict[str, Any] = {
+                "benchmark": "fetch",
+                "commit": commit(),
+                "run": run + 1,
+                "scale": args.scale,
+                "latency_ms": args.latency,
+                "concurrent": args.concurrent,
+                "format": args.format,
+                "records": records,
+                "requests": sum(s.requests for s in servers) - requests,
+                "seconds": seconds,
+                "records_per_s": records / seconds,
+                "peak_rss_mib": peak_rss(),
+            }
+            for name, t in sorted(timings.items()):
+                result[f"{name}_records"] = t.records
+                result[f"{name}_first_s"] = t.first
+                result[f"{name}_done_s"] = t.done
+            report(result, args.out)
+
+    for s in servers:
+        s.stop()
+
+
+# --- parse ---
+
+
+def bench_parse(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.dir or Path(tmp)
+        config = Config(
+            archive_dir=path,
+            archive_format=args.format,
+            archive_codec=args.codec,
+            fetch=FetchConfig(),
+            coinbase=cb.Config(api_key="key",
+                               api_secret="secret",
+                               assets_prefix="Assets",
+                               expenses_prefix="Expenses",
+                               payment_methods={}),
+            coinbasepro=cbpro.Config(api_key="key", api_secret="secret",
+                                     api_passphrase="passphrase"),
+            ethereum=eth.Config(rpc_url="http://localhost:8545", addresses=[], start_block=0),
+        )
+
+        if args.dir is None:
+            start = time.perf_counter()
+            generate(path, args.records, args.format, args.codec)
+            print(f"generated {args.records} records in {time.perf_counter() - start:.1f}s\n")
+
+        with archive(config) as a:
+            records = sum(1 for _ in a.keys())
+
+        # the first pass parses every record, the second is served from the parse cache
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            with quiet():
+                entries = parse_archive(config, args.jobs)
+            seconds = time.perf_counter() - start
+            report(
+                {
+                    "benchmark": "parse",
+                    "commit": commit(),
+                    "cache": label,
+                    "jobs": args.jobs,
+                    "format": args.format,
+                    "codec": args.codec,
+                    "records": records,
+                    "entries": len(entries),
+                    "seconds": seconds,
+                    "records_per_s": records / seconds,
+                    "us_per_record": seconds / max(records, 1) * 1e6,
+                    "peak_rss_mib": peak_rss(),
+                }, args.out)
+
+
+# --- cli ---
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    "fetch": bench_fetch,
+    "parse": bench_parse,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=list(BENCHMARKS))
+    parser.add_argument("--out", type=Path, help="append results as json lines to this file")
+    parser.add_argument("--format", choices=FORMATS, default=SEGMENTS)
+    parser.add_argument("--codec", choices=list(CODECS), default="none")
+    fetch = parser.add_argument_group("fetch")
+    fetch.add_argument("--scale", type=int, default=1000,
+                       help="fills per traded product and blocks on the fake chain")
+    fetch.add_argument("--latency", type=float, default=0.0, help="added per request (ms)")
+    fetch.add_argument("--rate-limit", type=float, default=1000.0,
+                       help="requests per second allowed by the venues")
+    fetch.add_argument("--concurrent", action="store_true", help="fetch venues concurrently")
+    fetch.add_argument("--runs", type=int, default=2)
+    parse = parser.add_argument_group("parse")
+    parse.add_argument("-n", "--records", type=int, default=100000,
+                       help="size of the synthetic archive")
+    parse.add_argument("-j", "--jobs", type=int, default=1)
+    parse.add_argument("--dir", type=Path, help="parse this archive instead of a synthetic one")
+    args = parser.parse_args(argv)
+
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+"""local stand-ins for the apis every venue fetches from
+
+each server generates its data deterministically from a few size knobs, so runs are comparable
+across commits. all servers can add a fixed `latency` (in seconds) to every request to mimic a
+remote api"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any, Dict, List, Optional, Tuple, Type
+from urllib.parse import parse_qs, urlparse
+
+# --- constants ---
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# address that every synthetic ethereum tx is sent from
+ADDRESS = "0x" + "ab" * 20
+
+# (status, headers, body)
+Response = Tuple[int, Dict[str, str], Any]
+
+# --- server ---
+
+
+class Server:
+    """serves `handle` on a random local port from a background thread"""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                self.respond(None)
+
+            def do_POST(self) -> None:
+                self.respond(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+
+            def respond(self, body: Any) -> None:
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                status, headers, out = server.handle(self.command, self.path, body)
+                data = json.dumps(out).encode()
+                self.send_response(status)
+                for k, v in dict(headers, **{"Content-Type": "application/json"}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def handle(self, method: str, path: str, body: Any) -> Response:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "Server":
+        return self
+
+    def __exit__(self, typ: Optional[Type[BaseException]], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        self.stop()
+
+
+def param(query: Dict[str, List[str]], name: str) -> Optional[str]:
+    """the first value of the query parameter `name`, if it was given"""
+    values = query.get(name)
+    return values[0] if values else None
+
+
+def page(items: List[Any], query: Dict[str, List[str]], key: str,
+         limit: int) -> Tuple[List[Any], Dict[str, str]]:
+    """coinbase pro style cursor pagination over `items` (sorted newest first by the numeric
+    `key`)"""
+    after, before = param(query, "after"), param(query, "before")
+    if before is not None:
+        out = [i for i in items if int(i[key]) > int(before)][-limit:]
+        return out, {"cb-before": str(out[0][key])} if out else {}
+    if after is not None:
+        items = [i for i in items if int(i[key]) < int(after)]
+    out = items[:limit]
+    return out, {"cb-after": str(out[-1][key])} if len(items) > limit else {}
+
+
+# --- coinbase pro ---
+
+
+class CoinbaseProServer(Server):
+    """`/products`, `/products/{id}/candles`, `/accounts`, `/fills` and
+    `/accounts/{id}/ledger`. every product in
+    `traded` has `fills` fills, every account has `fills` match entries for its traded products
+    and `transfers` deposits"""
+    def __init__(self,
+                 products: int = 100,
+                 traded: int = 3,
+                 accounts: int = 4,
+                 fills: int = 1000,
+                 transfers: int = 100,
+                 page_size: int = 100,
+                 latency: float = 0.0):
+        self.products = [f"C{i}-USD" for i in range(products)]
+        self.traded = self.products[:traded]
+        self.accounts = [f"account-{i}" for i in range(accounts)]
+        self.fills = fills
+        self.transfers = transfers
+        self.page_size = page_size
+        super().__init__(latency)
+
+    def handle(self, method: str, path: str, body: Any) -> Response:
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts == ["products"]:
+            return 200, {}, [self.product(p) for p in self.products]
+        if len(parts) == 3 and parts[0] == "products" and parts[2] == "candles":
+            if parts[1] not in self.products:
+                return 404, {}, {"message": "NotFound"}
+            return 200, {}, self.candles(query)
+        if parts == ["accounts"]:
+            return 200, {}, [self.account(a) for a in self.accounts]
+        if parts == ["fills"]:
+            pid = query["product_id"][0]
+            fills = [self.fill(pid, i) for i in range(self.fills, 0, -1)] if pid in self.traded \
+                else []
+            out, headers = page(fills, query, "trade_id", self.page_size)
+            return 200, headers, out
+        if len(parts) == 3 and parts[0] == "accounts" and parts[2] == "ledger":
+            entries = [self.entry(parts[1], i) for i in range(self.ledger_size(), 0, -1)]
+            out, headers = page(entries, query, "id", self.page_size)
+            return 200, headers, out
+        return 404, {}, {"message": "NotFound"}
+
+    def ledger_size(self) -> int:
+        return len(self.traded) + self.transfers
+
+    @staticmethod
+    def product(pid: str) -> Any:
+        base, quote = pid.split("-")
+        return {
+            "id": pid,
+            "base_currency": base,
+            "quote_currency": quote,
+            "base_min_size": "0.001",
+            "base_max_size": "10000",
+            "base_increment": "0.001",
+            "quote_increment": "0.01",
+            "display_name": pid.replace("-", "/"),
+            "status": "online",
+            "margin_enabled": False,
+            "status_message": "",
+            "min_market_funds": "10",
+            "max_market_funds": "1000000",
+            "post_only": False,
+            "limit_only": False,
+            "cancel_only": False,
+            "trading_disabled": False,
+        }
+
+    @staticmethod
+    def candles(query: Dict[str, List[str]]) -> Any:
+        """one candle per `granularity` seconds in `start..end`, newest first"""
+        step = int(query["granularity"][0])
+        start, end = (int(datetime.fromisoformat(query[k][0]).replace(
+            tzinfo=timezone.utc).timestamp()) for k in ("start", "end"))
+        return [[t, 99, 101, 100, 100 + (t - int(EPOCH.timestamp())) // step % 50, 10]
+                for t in range(end - end % step, start - 1, -step)]
+
+    @staticmethod
+    def account(aid: str) -> Any:
+        return {
+            "id": aid,
+            "currency": "USD",
+            "balance": "1000.00",
+            "available": "1000.00",
+            "hold": "0.00",
+            "profile_id": "profile",
+            "trading_enabled": True,
+        }
+
+    @staticmethod
+    def fill(pid: str, i: int) -> Any:
+        return {
+            "trade_id": i,
+            "product_id": pid,
+            "price": f"{100 + i % 97}.{i % 100:02d}",
+            "size": "0.5",
+            "order_id": f"order-{pid}-{i}",
+            "created_at": (EPOCH + timedelta(minutes=i)).isoformat(),
+            "user_id": "user",
+            "profile_id": "profile",
+            "liquidity": "T",
+            "fee": "0.25",
+            "side": "buy" if i % 2 else "sell",
+            "settled": True,
+            "usd_volume": "50.00",
+        }
+
+    def entry(self, aid: str, i: int) -> Any:
+        """the first entries of each ledger are one match per traded product, the rest are
+        deposits"""
+        created = (EPOCH + timedelta(hours=i)).isoformat()
+        if i <= len(self.traded):
+            pid = self.traded[i - 1]
+            return {
+                "id": str(i),
+                "created_at": created,
+                "amount": "-50.00",
+                "balance": "1000.00",
+                "type": "match",
+                "details": {"order_id": f"order-{pid}-1", "trade_id": "1", "product_id": pid},
+            }
+        return {
+            "id": str(i),
+            "created_at": created,
+            "amount": "10.00",
+            "balance": "1000.00",
+            "type": "transfer",
+            "details": {"transfer_type": "DEPOSIT", "transfer_id": f"{aid}-transfer-{i}"},
+        }
+
+
+# --- coinbase ---
+
+
+class CoinbaseServer(Server):
+    """the v2 wallet endpoints used by `coinbase.wallet.client.Client`: `/v2/accounts` and the
+    buys / sells / deposits / withdrawals of each account, newest first unless `order=asc`, with
+    `next_starting_after` pagination. records are completed unless listed in `statuses`"""
+    KINDS = ("buys", "sells", "deposits", "withdrawals")
+
+    def __init__(self, accounts: int = 4, records: int = 250, latency: float = 0.0):
+        self.accounts = [f"wallet-{i}" for i in range(accounts)]
+        self.records = records
+        # record id -> status
+        self.statuses: Dict[str, str] = {}
+        super().__init__(latency)
+
+    def handle(self, method: str, path: str, body: Any) -> Response:
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts == ["v2", "accounts"]:
+            items = [{
+                "id": a,
+                "resource": "account",
+                "name": a,
+                "balance": {"amount": "0.10000000", "currency": "BTC"},
+            } for a in self.accounts]
+        elif len(parts) == 4 and parts[:2] == ["v2", "accounts"] and parts[3] in self.KINDS:
+            items = [
+                self.record(parts[2], parts[3], i, self.statuses) for i in range(self.records)
+            ]
+            if param(query, "order") != "asc":
+                items.reverse()
+        else:
+            return 404, {}, {"errors": [{"id": "not_found", "message": "Not found"}]}
+
+        limit = int(query.get("limit", ["25"])[0])
+        start = param(query, "starting_after")
+        if start is not None:
+            items = items[[i["id"] for i in items].index(start) + 1:]
+        out = items[:limit]
+        nxt = out[-1]["id"] if len(items) > limit else None
+        return 200, {}, {"data": out, "pagination": {"next_starting_after": nxt}}
+
+    @staticmethod
+    def record(aid: str, kind: str, i: int, statuses: Optional[Dict[str, str]] = None) -> Any:
+        rid = f"{aid}-{kind}-{i}"
+        return {
+            "id": rid,
+            "resource": kind[:-1],
+            "status": (statuses or {}).get(rid, "completed"),
+            "amount": {"amount": "0.01", "currency": "BTC"},
+            "total": {"amount": "100.00", "currency": "USD"},
+            "fee": {"amount": "1.49", "currency": "USD"},
+            "created_at": (EPOCH + timedelta(hours=i)).isoformat(),
+        }
+
+
+# --- ethereum ---
+
+
+class EthereumNode(Server):
+    """json-rpc node over a synthetic chain of `head` blocks with `txs` txs each. every
+    `every`-th block also contains a tx sent from `ADDRESS`. with `tokens`, every tx also emits
+    an erc20 `Transfer` from one of that many token contracts, which answer the metadata
+    getters (every tenth one has no `decimals`)"""
+    def __init__(self,
+                 head: int = 10000,
+                 txs: int = 20,
+                 every: int = 10,
+                 tokens: int = 0,
+                 latency: float = 0.0):
+        self.head = head
+        self.txs = txs
+        self.every = every
+        self.tokens = tokens
+        super().__init__(latency)
+
+    def handle(self, method: str, path: str, body: Any) -> Response:
+        if isinstance(body, list):
+            return 200, {}, [self.call(c) for c in body]
+        return 200, {}, self.call(body)
+
+    def call(self, c: Any) -> Any:
+        method, params = c["method"], c.get("params", [])
+        if method == "eth_blockNumber":
+            result: Any = hex(self.head)
+        elif method == "eth_getBlockByNumber":
+            result = self.block(int(params[0], 16), self.txs, self.every, params[1])
+        elif method == "eth_getTransactionByHash":
+            result = self.tx(int(params[0], 16) >> 32, int(params[0], 16) & 0xffffffff,
+                             self.every)
+        elif method == "eth_getTransactionReceipt":
+            result = self.receipt(params[0], self.tokens)
+        elif method == "eth_getBlockReceipts":
+            block = self.block(int(params[0], 16), self.txs, self.every, False)
+            result = [self.receipt(t, self.tokens) for t in block["transactions"]]
+        elif method == "eth_call":
+            result = self.token_call(params[0]["to"], params[0]["data"])
+            if result is None:
+                return {"jsonrpc": "2.0", "id": c["id"],
+                        "error": {"code": 3, "message": "execution reverted"}}
+        elif method == "eth_getLogs":
+            result = []
+        elif method == "trace_filter":
+            result = self.traces(params[0])
+        elif method == "eth_getTransactionCount":
+            result = hex(self.nonce(params[0], int(params[1], 16)))
+        elif method == "eth_getBalance":
+            result = hex(10**18 - self.nonce(params[0], int(params[1], 16)))
+        else:
+            return {"jsonrpc": "2.0", "id": c["id"],
+                    "error": {"code": -32601, "message": "method not found"}}
+        return {"jsonrpc": "2.0", "id": c["id"], "result": result}
+
+    def traces(self, query: Any) -> List[Any]:
+        """`trace_filter` results for the txs sent from `ADDRESS`"""
+        if ADDRESS not in [a.lower() for a in query.get("fromAddress", [])]:
+            return []
+        lo, hi = int(query["fromBlock"], 16), min(int(query["toBlock"], 16), self.head)
+        first = lo + (-lo % self.every)
+        return [{
+            "type": "call",
+            "action": {"from": ADDRESS, "to": "0x" + "11" * 20, "value": "0xde0b6b3a7640000"},
+            "blockNumber": n,
+            "transactionHash": self.tx_hash(n, 0),
+        } for n in range(first, hi + 1, self.every)]
+
+    def nonce(self, address: str, block: int) -> int:
+        return block // self.every + 1 if address.lower() == ADDRESS else 0
+
+    @staticmethod
+    def tx_hash(block: int, i: int) -> str:
+        return "0x%056x%08x" % (block, i)
+
+    @staticmethod
+    def tx(block: int, i: int, every: int) -> Any:
+        sender = ADDRESS if i == 0 and block % every == 0 else "0x%040x" % (block * 1000 + i)
+        return {
+            "blockHash": "0x%064x" % block,
+            "blockNumber": hex(block),
+            "from": sender,
+            "to": "0x" + "11" * 20,
+            "gas": "0x5208",
+            "gasPrice": "0x3b9aca00",
+            "hash": EthereumNode.tx_hash(block, i),
+            "input": "0x",
+            "nonce": hex(block),
+            "value": "0xde0b6b3a7640000",
+        }
+
+    @staticmethod
+    def block(n: int, txs: int, every: int, full: bool) -> Any:
+        """block `n`, with full txs or just their hashes"""
+        out = [EthereumNode.tx(n, i, every) for i in range(txs)]
+        return {
+            "number": hex(n),
+            "hash": "0x%064x" % n,
+            "timestamp": hex(1577836800 + 15 * n),
+            "logsBloom": "0x" + "00" * 256,
+            "transactions": out if full else [t["hash"] for t in out],
+        }
+
+    @staticmethod
+    def token(i: int) -> str:
+        return "0x%040x" % (0xe0 << 152 | i)
+
+    @staticmethod
+    def token_call(to: str, data: str) -> Optional[str]:
+        i = int(to, 16) & 0xffffffff
+        if data == "0x313ce567":  # decimals()
+            return None if i % 10 == 9 else "0x%064x" % 18
+        text = {"0x95d89b41": f"T{i}", "0x06fdde03": f"Token {i}"}[data].encode()
+        return "0x%064x%064x%s" % (32, len(text), text.ljust(32, b"\0").hex())
+
+    @staticmethod
+    def receipt(h: str, tokens: int = 0) -> Any:
+        logs = [{
+            "address": EthereumNode.token(int(h, 16) % tokens),
+            "topics": [
+                "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
+                "0x" + "00" * 12 + ADDRESS[2:],
+                "0x" + "00" * 12 + "11" * 20,
+            ],
+            "data": "0x%064x" % (10**18),
+            "logIndex": "0x0",
+            "removed": False,
+        }] if tokens else []
+        return {
+            "transactionHash": h,
+            "blockNumber": hex(int(h, 16) >> 32),
+            "contractAddress": None,
+            "cumulativeGasUsed": "0x5208",
+            "gasUsed": "0x5208",
+            "logs": logs,
+            "logsBloom": "0x" + "00" * 256,
+            "status": "0x1",
+        }
@@ -0,0 +1,94 @@
+"""synthetic archive generator
+
+writes `n` deterministic records, spread across every venue in roughly the proportions of a
+real archive, using the same payloads as the fake servers. run with:
+
+    python -m bench.synthetic DIR [-n RECORDS] [--format files|segments] [--codec CODEC]
+"""
+import argparse
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Iterator
+
+import bean_fetch.venues.coinbase as cb
+import bean_fetch.venues.coinbasepro.venue as cbpro
+import bean_fetch.venues.ethereum.venue as eth
+from bean_fetch.archive import CODECS, FORMATS, SEGMENTS, encode, open_archive
+from bean_fetch.data import RawTx
+from bean_fetch.encoding import dumps
+from bench.servers import EPOCH, CoinbaseProServer, CoinbaseServer, EthereumNode
+
+# --- records ---
+
+# out of every 10 records: 4 coinbase pro fills, 1 coinbase pro transfer, 2 coinbase records and
+# 3 ethereum txs
+MIX = ("fill", "fill", "fill", "fill", "transfer", "coinbase", "coinbase", "eth", "eth", "eth")
+
+
+def records(n: int) -> Iterator[RawTx[Any]]:
+    for i in range(n):
+        kind = MIX[i % len(MIX)]
+        if kind == "fill":
+            fill = cbpro.Fill(**CoinbaseProServer.fill("ETH-USD", i))
+            yield cbpro.Raw(venue=cbpro.VENUE,
+                            kind=cbpro.Kind.FILL,
+                            timestamp=fill.created_at,
+                            raw=dumps(fill))
+        elif kind == "transfer":
+            created = EPOCH + timedelta(minutes=i)
+            entry = {
+                "id": str(i),
+                "created_at": created.isoformat(),
+                "amount": "10.00",
+                "balance": "1000.00",
+                "type": "transfer",
+                "details": {"transfer_type": "DEPOSIT", "transfer_id": f"transfer-{i}"},
+            }
+            yield cbpro.Raw(venue=cbpro.VENUE,
+                            kind=cbpro.Kind.DEPOSIT,
+                            timestamp=created,
+                            raw=dumps(entry),
+                            meta={"account_id": "account-0", "currency": "USD"})
+        elif kind == "coinbase":
+            k = list(cb.Kind)[i % len(cb.Kind)]
+            obj = CoinbaseServer.record("wallet-0", f"{k.value}s", i)
+            yield cb.Raw(venue=cb.VENUE,
+                         kind=k,
+                         timestamp=obj["created_at"],
+                         raw=dumps(obj),
+                         meta={"account_id": "wallet-0"})
+        else:
+            tx = EthereumNode.tx(i, 0, every=1)
+            block = EthereumNode.block(i, txs=1, every=1, full=False)
+            ethtx = eth.Fetch.transaction(int(block["timestamp"], 16), tx,
+                                          EthereumNode.receipt(tx["hash"]))
+            yield eth.Raw(venue=eth.VENUE,
+                          kind=eth.Kind.TRANSACTION,
+                          timestamp=ethtx.timestamp,
+                          raw=dumps(ethtx))
+
+
+def generate(path: Path, n: int, fmt: str = SEGMENTS, codec: str = "none") -> int:
+    """writes `n` synthetic records to the archive at `path`, returns the number written"""
+    written = 0
+    with open_archive(path, fmt, codec) as a:
+        for tx in records(n):
+            a.put(*encode(tx))
+            written += 1
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dir", type=Path, help="archive directory")
+    parser.add_argument("-n", "--records", type=int, default=100000)
+    parser.add_argument("--format", choices=FORMATS, default=SEGMENTS)
+    parser.add_argument("--codec", choices=list(CODECS), default="none")
+    args = parser.parse_args()
+
+    written = generate(args.dir, args.records, args.format, args.codec)
+    print(f"wrote {written} records to {args.dir}")
+
+
+if __name__ == "__main__":
+    main()